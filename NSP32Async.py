@@ -0,0 +1,329 @@
+#!/usr/bin/python3
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+"""
+asyncio driver for the NSP32, any number of sensors on one event loop. POSIX only, see below.
+
+    async def main():
+        async with await open_nsp32("/dev/ttyUSB0") as sensor:
+            print(await sensor.get_sensor_id(), await sensor.get_wavelength())
+            async for timestamp_ns, info in sensor.spectra(integration_time = 20, count = 100):
+                ...
+
+Every command carries a user code from 1 to 255 and its replies are matched on
+(user code, command code), so a reply that shows up after its command timed out is counted in
+unmatched_packets and can never complete a later command. Commands are written one at a time, each
+after the sensor acknowledged the previous one, as NanoLambdaNSP32.NSP32 does; acquisitions then
+overlap, the sensor sends each spectrum on its own once integrated.
+
+The port is watched with loop.add_reader(), which needs a selector event loop and a port with a file
+descriptor: serial ports on POSIX, or the simulator served on a pseudo terminal ("sim"). Windows has
+neither, AsyncNSP32 and open_nsp32() raise NotImplementedError there; use SpectroData, which reads the
+port on a thread of its own. Commands are written on the loop's default executor, so a port that is slow
+to take them never stalls the other sensors on the loop.
+"""
+
+import sys
+import time
+import asyncio
+import argparse
+import collections
+import numpy
+from NanoLambdaNSP32 import NSP32, CmdCodeEnum, SpectrumInfo
+
+DEFAULT_TIMEOUT = 2.0
+
+def build_command(cmd: int, user_code: int, payload: bytes = b'') -> bytes:
+    """Prefix, command code, user code, payload and modular sum checksum."""
+    cmd_bytes = bytearray((CmdCodeEnum.Prefix0, CmdCodeEnum.Prefix1, cmd, user_code)) + payload
+    cmd_bytes.append(-sum(cmd_bytes) & 0xFF)
+    return bytes(cmd_bytes)
+
+def check_platform() -> None:
+    if(sys.platform == "win32"):
+        raise NotImplementedError("NSP32Async needs loop.add_reader() on the serial port, which Windows does not support, use SpectroData instead")
+
+def acquisition_payload(integration_time: int, frame_average: int, auto_ae: bool) -> bytes:
+    # the last byte asks the sensor to send GetSpectrum on its own once the acquisition is done
+    return bytes((integration_time & 0xFF, integration_time >> 8, frame_average, 1 if auto_ae else 0, 1))
+
+
+class AsyncNSP32:
+    """
+    One sensor on the running event loop. port needs fileno(), read() and write() (serial.Serial opened with
+    timeout = 0), open_nsp32() opens one. Every command takes a timeout in seconds, the driver's by default,
+    and raises TimeoutError when its reply does not arrive in time."""
+
+    def __init__(self, port, timeout: float = DEFAULT_TIMEOUT, simulator = None):
+        check_platform()
+        self._loop = asyncio.get_running_loop()
+        self._port = port
+        self._timeout: float = timeout
+        self._simulator = simulator
+        self._parser = NSP32(None, self._packet_received)       # only used to frame the return packets
+        self._pending: dict = dict()                # (user code, reply command code) -> future of (timestamp_ns, ReturnPacket)
+        self._next_user_code: int = 1
+        self._send_lock = asyncio.Lock()
+        self._read_timestamp: int = 0
+        self._unmatched_packets: int = 0
+        self._spectra_lost: int = 0
+        self._bytes_received: int = 0
+        self._closed: bool = False
+        self._loop.add_reader(self._port.fileno(), self._readable)
+
+    @property
+    def bytes_discarded(self) -> int:
+        return self._parser.BytesDiscarded
+    @property
+    def checksum_failures(self) -> int:
+        return self._parser.ChecksumFailures
+    @property
+    def unmatched_packets(self) -> int:
+        """Valid replies no command was waiting for, e.g. late replies of commands that timed out."""
+        return self._unmatched_packets
+    @property
+    def spectra_lost(self) -> int:
+        return self._spectra_lost
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    async def hello(self, timeout: float = None) -> None:
+        await self._command(CmdCodeEnum.Hello, timeout = timeout)
+
+    async def standby(self, timeout: float = None) -> None:
+        await self._command(CmdCodeEnum.Standby, timeout = timeout)
+
+    async def get_sensor_id(self, timeout: float = None) -> str:
+        """Sensor ID as "XX-XX-XX-XX-XX"."""
+        _, pkt = await self._command(CmdCodeEnum.GetSensorId, timeout = timeout)
+        return pkt.ExtractSensorIdStr()
+
+    async def get_wavelength(self, timeout: float = None) -> numpy.ndarray:
+        """Wavelength of every spectral point in nm, uint16."""
+        _, pkt = await self._command(CmdCodeEnum.GetWavelength, timeout = timeout)
+        return pkt.ExtractWavelengthInfo().WavelengthArray
+
+    async def acq_spectrum(self, integration_time: int = 20, frame_average: int = 1, auto_ae: bool = False, timeout: float = None) -> SpectrumInfo:
+        """One acquisition, timeout covers the acknowledgement and then the spectrum."""
+        future = await self._start_acquisition(integration_time, frame_average, auto_ae, timeout)
+        _, info = await self._wait(future, CmdCodeEnum.GetSpectrum, timeout)
+        return info
+
+    async def spectra(self, integration_time: int = 20, frame_average: int = 1, auto_ae: bool = False, count: int = None,
+                      depth: int = 2, timeout: float = None):
+        """
+        Async iterator of (timestamp_ns, SpectrumInfo), timestamp_ns being the perf_counter_ns the spectrum was read at.\n
+        depth acquisitions are kept in flight so the sensor integrates the next spectrum while the last one is
+        on the wire. Runs until count spectra were yielded, for ever by default. Spectra that never arrive are
+        skipped and counted in spectra_lost, TimeoutError ends the iteration once the sensor stops sending anything."""
+        in_flight = collections.deque()
+        issued = yielded = 0
+        try:
+            while(count is None or yielded < count):
+                received = self._bytes_received
+                try:
+                    while(len(in_flight) < depth and (count is None or issued < count)):
+                        in_flight.append(await self._start_acquisition(integration_time, frame_average, auto_ae, timeout))
+                        issued += 1
+                    spectrum = await self._wait(in_flight.popleft(), CmdCodeEnum.GetSpectrum, timeout)
+                except TimeoutError:
+                    # a corrupted packet is replaced by the next acquisition, a sensor that went silent ends the stream
+                    if(self._bytes_received == received):
+                        raise
+                    self._spectra_lost += 1
+                    issued = yielded + len(in_flight)
+                    continue
+                yield spectrum
+                yielded += 1
+        finally:
+            # spectra still integrating are dropped, they arrive as unmatched packets
+            for future in in_flight:
+                self._forget(future)
+
+    def close(self) -> None:
+        if(self._closed):
+            return
+        self._closed = True
+        self._loop.remove_reader(self._port.fileno())
+        self._fail_pending(ConnectionError("sensor closed"))
+        self._port.close()
+        if(self._simulator is not None):
+            self._simulator.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        self.close()
+
+    def _allocate(self, replies) -> list:
+        """Register a future per reply under the next free user code."""
+        in_use = {user_code for user_code, _ in self._pending}
+        for _ in range(255):
+            user_code = self._next_user_code
+            self._next_user_code = user_code % 255 + 1
+            if(user_code not in in_use):
+                break
+        else:
+            raise RuntimeError("all 255 user codes are waiting for replies")
+        futures = list()
+        for reply in replies:
+            future = self._loop.create_future()
+            future.key = (user_code, reply)
+            self._pending[future.key] = future
+            futures.append(future)
+        return futures
+
+    def _forget(self, future: asyncio.Future) -> None:
+        if(self._pending.get(future.key) is future):
+            del self._pending[future.key]
+        future.cancel()
+
+    async def _send(self, cmd: int, futures: list, payload: bytes, timeout: float) -> tuple:
+        """Write the command and wait for its acknowledgement, the next command goes out after it."""
+        if(self._closed):
+            raise ConnectionError("sensor closed")
+        try:
+            async with self._send_lock:
+                await self._loop.run_in_executor(None, self._port.write, build_command(cmd, futures[0].key[0], payload))
+                return await self._wait(futures[0], cmd, timeout)
+        except BaseException:
+            for future in futures:
+                self._forget(future)
+            raise
+
+    async def _wait(self, future: asyncio.Future, cmd: int, timeout: float) -> tuple:
+        try:
+            timestamp_ns, pkt = await asyncio.wait_for(future, self._timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"no {CmdCodeEnum(cmd).name} reply within {self._timeout if timeout is None else timeout} s") from None
+        finally:
+            self._forget(future)
+        if(cmd == CmdCodeEnum.GetSpectrum):
+            return timestamp_ns, pkt.ExtractSpectrumInfo()
+        return timestamp_ns, pkt
+
+    async def _command(self, cmd: int, payload: bytes = b'', timeout: float = None) -> tuple:
+        futures = self._allocate((cmd,))
+        return await self._send(cmd, futures, payload, timeout)
+
+    async def _start_acquisition(self, integration_time: int, frame_average: int, auto_ae: bool, timeout: float) -> asyncio.Future:
+        """Send AcqSpectrum, returns the future of its spectrum once the sensor acknowledged it."""
+        futures = self._allocate((CmdCodeEnum.AcqSpectrum, CmdCodeEnum.GetSpectrum))
+        await self._send(CmdCodeEnum.AcqSpectrum, futures, acquisition_payload(integration_time, frame_average, auto_ae), timeout)
+        return futures[1]
+
+    def _readable(self) -> None:
+        try:
+            data = self._port.read(max(1, self._port.in_waiting))
+        except Exception as e:
+            self._loop.remove_reader(self._port.fileno())
+            self._fail_pending(ConnectionError(f"sensor read failed: {e}"))
+            return
+        self._read_timestamp = time.perf_counter_ns()
+        self._bytes_received += len(data)
+        self._parser.OnReturnBytesReceived(data)
+
+    def _packet_received(self, pkt) -> None:
+        if(not pkt.IsPacketValid):
+            return          # counted by the parser, the command it belonged to times out
+        future = self._pending.pop((pkt.UserCode, pkt.CmdCode), None)
+        if(future is None or future.done()):
+            self._unmatched_packets += 1
+            return
+        future.set_result((self._read_timestamp, pkt))
+
+    def _fail_pending(self, error: Exception) -> None:
+        pending, self._pending = self._pending, dict()
+        for future in pending.values():
+            if(not future.done()):
+                future.set_exception(error)
+
+
+async def open_nsp32(port: str, timeout: float = DEFAULT_TIMEOUT, **simulator_args) -> AsyncNSP32:
+    """Open a serial port, or "sim" for a VirtualNSP32 served on a pseudo terminal."""
+    check_platform()
+    import serial
+    simulator = None
+    if(port == "sim"):
+        from NSP32Simulator import VirtualNSP32
+        simulator = VirtualNSP32(**simulator_args)
+        port = simulator.serve_pty()
+    device = serial.Serial(port, baudrate = 115200, bytesize = serial.EIGHTBITS, parity = serial.PARITY_NONE, stopbits = serial.STOPBITS_ONE, timeout = 0)
+    return AsyncNSP32(device, timeout, simulator)
+
+async def _stream(sensor: AsyncNSP32, seconds: float, integration_time: int, counts: list, index: int) -> None:
+    deadline = time.perf_counter() + seconds
+    async for _ in sensor.spectra(integration_time):
+        counts[index] += 1
+        if(time.perf_counter() >= deadline):
+            break
+
+def measure_async_scaling(device_counts = (1, 2, 4, 8), seconds: float = 3.0, integration_time: int = 20, **simulator_args) -> dict:
+    """Aggregate spectrum rate of 1, 2, 4 ... simulated sensors streaming on a single event loop."""
+    async def run(count: int) -> dict:
+        sensors = [await open_nsp32("sim", seed = i, **simulator_args) for i in range(count)]
+        try:
+            counts = [0] * count
+            start = time.perf_counter()
+            await asyncio.gather(*[_stream(sensor, seconds, integration_time, counts, i) for i, sensor in enumerate(sensors)])
+            elapsed = time.perf_counter() - start
+            return {
+                "spectra_per_second": sum(counts) / elapsed,
+                "per_device_spectra_per_second": [c / elapsed for c in counts],
+                "spectra_lost": sum(sensor.spectra_lost for sensor in sensors),
+                "checksum_failures": sum(sensor.checksum_failures for sensor in sensors),
+                "unmatched_packets": sum(sensor.unmatched_packets for sensor in sensors),
+            }
+        finally:
+            for sensor in sensors:
+                sensor.close()
+    return {f"devices_{count}": asyncio.run(run(count)) for count in device_counts}
+
+def main():
+    parser = argparse.ArgumentParser(description = "Stream spectra from NSP32 sensors on one asyncio event loop")
+    parser.add_argument("ports", nargs = "*", default = ["sim"], help = "serial ports, \"sim\" for a simulated sensor (default: one simulator)")
+    parser.add_argument("--seconds", type = float, default = 5.0)
+    parser.add_argument("--integration-time", type = int, default = 20)
+    args = parser.parse_args()
+
+    async def run():
+        sensors = [await open_nsp32(port) for port in args.ports]
+        try:
+            for port, sensor in zip(args.ports, sensors):
+                wavelengths = await sensor.get_wavelength()
+                print(f"{port}: sensor {await sensor.get_sensor_id()}, {len(wavelengths)} points {wavelengths[0]} to {wavelengths[-1]} nm")
+            counts = [0] * len(sensors)
+            start = time.perf_counter()
+            await asyncio.gather(*[_stream(sensor, args.seconds, args.integration_time, counts, i) for i, sensor in enumerate(sensors)])
+            elapsed = time.perf_counter() - start
+            for port, count, sensor in zip(args.ports, counts, sensors):
+                print(f"{port}: {count / elapsed:.2f} spectra/s, {sensor.spectra_lost} lost, {sensor.checksum_failures} checksum failures, {sensor.unmatched_packets} unmatched")
+        finally:
+            for sensor in sensors:
+                sensor.close()
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+#!/usr/bin/python3
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+import os
+import time
+import heapq
+import struct
+import random
+import argparse
+import threading
+import numpy
+from NanoLambdaNSP32 import CmdCodeEnum
+
+# command lengths the simulated firmware accepts
+_COMMAND_LENGTHS = {
+    CmdCodeEnum.Hello: 5,
+    CmdCodeEnum.Standby: 5,
+    CmdCodeEnum.GetSensorId: 5,
+    CmdCodeEnum.GetWavelength: 5,
+    CmdCodeEnum.AcqSpectrum: 10,
+    CmdCodeEnum.GetSpectrum: 5,
+    CmdCodeEnum.AcqXYZ: 10,
+    CmdCodeEnum.GetXYZ: 5,
+}
+
+def build_packet(cmd: int, user_code: int, payload: bytes = b'') -> bytearray:
+    """Build a return packet: prefix, command code, user code, payload and modular sum checksum."""
+    pkt = bytearray((CmdCodeEnum.Prefix0, CmdCodeEnum.Prefix1, cmd, user_code))
+    pkt += payload
+    pkt.append((-sum(pkt)) & 0xFF)
+    return pkt
+
+def spectrum_packet(spectrum, user_code: int = 0, integration_time: int = 20, saturated: bool = False, xyz = (0.0, 0.0, 0.0)) -> bytearray:
+    """Build a 565 byte GetSpectrum return packet."""
+    spectrum = numpy.asarray(spectrum, dtype = '<f4')
+    payload = struct.pack('<HBxI', integration_time, 1 if saturated else 0, len(spectrum)) + spectrum.tobytes() + struct.pack('<3f', *xyz)
+    return build_packet(CmdCodeEnum.GetSpectrum, user_code, payload)
+
+def wavelength_packet(wavelengths, user_code: int = 0) -> bytearray:
+    """Build a 279 byte GetWavelength return packet."""
+    wavelengths = numpy.asarray(wavelengths, dtype = '<u2')
+    return build_packet(CmdCodeEnum.GetWavelength, user_code, struct.pack('<I', len(wavelengths)) + wavelengths.tobytes())
+
+
+class VirtualNSP32:
+    """
+    Simulated NSP32 behind a fake serial port.\n
+    Implements the subset of serial.Serial used by SpectroData (read, write, in_waiting, timeout, isOpen, close),
+    so SpectroData(VirtualNSP32()) works unchanged. serve_pty() exposes the same device on a pseudo terminal instead.\n
+    Replies are scheduled in time: an acquisition integrates for integration_overhead + integration time * frame average * integration_unit seconds and the link delivers
+    baudrate / 10 bytes per second (baudrate = 0 disables pacing)."""
+
+    def __init__(self, num_points: int = 135, baudrate: int = 115200, integration_unit: float = 0.001,
+                 integration_overhead: float = 0.002, command_latency: float = 0.0005, heart_rate: float = 72.0,
+                 noise: float = 0.002, sensor_id: bytes = b'\x4E\x4C\x00\x00\x01', drop_byte_rate: float = 0.0,
+                 bad_checksum_rate: float = 0.0, split_read_max: int = 0, seed: int = None):
+        self._num_points: int = num_points
+        self._bytes_per_second: float = baudrate / 10
+        self._integration_unit: float = integration_unit        # seconds per integration time unit per frame
+        self._integration_overhead: float = integration_overhead
+        self._command_latency: float = command_latency
+        self._sensor_id: bytes = bytes(sensor_id)
+        self._wavelengths = numpy.linspace(340, 1010, num_points).round().astype(numpy.uint16)
+
+        # synthetic PPG: every channel carries the same pulse, scaled by a wavelength dependent perfusion amplitude
+        self._heart_rate: float = heart_rate
+        self._noise: float = noise
+        wl = self._wavelengths.astype(numpy.float64)
+        self._dc = (0.2 + 0.8 * numpy.exp(-((wl - 700) / 220) ** 2)).astype(numpy.float32)
+        self._ac = (0.005 + 0.02 * numpy.exp(-((wl - 560) / 60) ** 2) + 0.01 * numpy.exp(-((wl - 940) / 80) ** 2)).astype(numpy.float32)
+
+        # fault injection
+        self.drop_byte_rate: float = drop_byte_rate         # chance per packet that one byte goes missing
+        self.bad_checksum_rate: float = bad_checksum_rate   # chance per packet that the checksum is wrong
+        self.split_read_max: int = split_read_max           # when set, a read returns at most this many bytes
+        self._random = random.Random(seed)
+        self._noise_rng = numpy.random.default_rng(seed)
+
+        # link state
+        self._lock = threading.Condition()
+        self._cmd_buf = bytearray()
+        self._rx = bytearray()                              # bytes that have arrived at the host
+        self._schedule: list = []                           # heap of (ready time, order, packet)
+        self._schedule_order: int = 0
+        self._current = None                                # packet currently on the wire
+        self._current_start: float = 0
+        self._current_sent: int = 0
+        self._link_free: float = 0
+        self._integration_free: float = 0
+        self._last_spectrum = numpy.zeros(num_points, dtype = numpy.float32)
+        self._t0: float = time.perf_counter()
+        self._open: bool = True
+        self.timeout = None
+
+        self._pty_thread = None
+        self._pty_master = None
+
+        # counters
+        self.commands_received: int = 0
+        self.spectra_sent: int = 0
+        self.bytes_sent: int = 0
+
+    @property
+    def is_open(self) -> bool:
+        return self._open
+    @property
+    def wavelengths(self) -> numpy.ndarray:
+        return self._wavelengths
+    @property
+    def in_waiting(self) -> int:
+        with self._lock:
+            self._pump(time.perf_counter())
+            return len(self._rx)
+
+    def isOpen(self) -> bool:
+        return self._open
+
+    def close(self) -> None:
+        with self._lock:
+            self._open = False
+            self._lock.notify_all()
+        if(self._pty_thread is not None and self._pty_thread is not threading.current_thread()):
+            self._pty_thread.join()
+
+    def reset_input_buffer(self) -> None:
+        with self._lock:
+            self._rx.clear()
+
+    def write(self, data) -> int:
+        with self._lock:
+            self._cmd_buf += data
+            self._parse_commands(time.perf_counter())
+            self._lock.notify_all()
+        return len(data)
+
+    def read(self, size: int = 1) -> bytes:
+        deadline = None if self.timeout is None else time.perf_counter() + self.timeout
+        limit = size
+        if(self.split_read_max):
+            limit = min(size, self._random.randint(1, self.split_read_max))
+        with self._lock:
+            while(self._open):
+                now = time.perf_counter()
+                self._pump(now)
+                if(len(self._rx) >= limit or (deadline is not None and now >= deadline)):
+                    break
+                wait = self._next_arrival(now)
+                if(deadline is not None):
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self._lock.wait(wait)
+            data = bytes(self._rx[:limit])
+            del self._rx[:limit]
+            return data
+
+    def serve_pty(self) -> str:
+        """Serve the simulated device on a pseudo terminal (POSIX only), returns the device path to open with serial.Serial."""
+        import pty
+        import tty
+        master, slave = pty.openpty()
+        tty.setraw(slave)
+        self._pty_master = master
+        self._pty_thread = threading.Thread(target = self._pty_loop, args = (master,))
+        self._pty_thread.daemon = True
+        self._pty_thread.start()
+        return os.ttyname(slave)
+
+    def spectrum_at(self, t: float) -> numpy.ndarray:
+        """Synthetic spectrum at t seconds after start: a pulsatile waveform with a dicrotic notch riding on the DC spectrum."""
+        phase = (t * self._heart_rate / 60) % 1.0
+        pulse = numpy.exp(-((phase - 0.15) / 0.07) ** 2) + 0.35 * numpy.exp(-((phase - 0.45) / 0.08) ** 2)
+        respiration = 1 + 0.01 * numpy.sin(2 * numpy.pi * 0.25 * t)
+        spectrum = self._dc * respiration * (1 - self._ac * pulse)
+        if(self._noise):
+            spectrum = spectrum + self._noise_rng.normal(0, self._noise, self._num_points)
+        return spectrum.astype(numpy.float32)
+
+    def _parse_commands(self, now: float) -> None:
+        buf = self._cmd_buf
+        while(len(buf) >= 3):
+            if(buf[0] != CmdCodeEnum.Prefix0 or buf[1] != CmdCodeEnum.Prefix1 or buf[2] not in _COMMAND_LENGTHS):
+                del buf[0]
+                continue
+            length = _COMMAND_LENGTHS[buf[2]]
+            if(len(buf) < length):
+                break
+            cmd = bytes(buf[:length])
+            del buf[:length]
+            if(sum(cmd) & 0xFF == 0):
+                self.commands_received += 1
+                self._handle_command(cmd, now)
+
+    def _handle_command(self, cmd: bytes, now: float) -> None:
+        code, user_code = cmd[2], cmd[3]
+        reply_at = now + self._command_latency
+        if(code == CmdCodeEnum.Hello or code == CmdCodeEnum.Standby):
+            self._queue_packet(reply_at, build_packet(code, user_code))
+        elif(code == CmdCodeEnum.GetSensorId):
+            self._queue_packet(reply_at, build_packet(code, user_code, self._sensor_id))
+        elif(code == CmdCodeEnum.GetWavelength):
+            self._queue_packet(reply_at, wavelength_packet(self._wavelengths, user_code))
+        elif(code == CmdCodeEnum.GetSpectrum):
+            self._queue_packet(reply_at, spectrum_packet(self._last_spectrum, user_code))
+        elif(code == CmdCodeEnum.GetXYZ):
+            self._queue_packet(reply_at, build_packet(code, user_code, bytes(16)))
+        elif(code == CmdCodeEnum.AcqSpectrum or code == CmdCodeEnum.AcqXYZ):
+            integration_time = cmd[4] | (cmd[5] << 8)
+            frame_average = max(1, cmd[6])
+            self._queue_packet(reply_at, build_packet(code, user_code))
+
+            # integrations run back to back, a new one starts once the sensor is free
+            start = max(reply_at, self._integration_free)
+            done = start + self._integration_overhead + integration_time * frame_average * self._integration_unit
+            self._integration_free = done
+            if(code == CmdCodeEnum.AcqSpectrum):
+                self._last_spectrum = self.spectrum_at(done - self._t0)
+                self._queue_packet(done, spectrum_packet(self._last_spectrum, user_code, integration_time))
+                self.spectra_sent += 1
+            else:
+                self._queue_packet(done, build_packet(CmdCodeEnum.GetXYZ, user_code, struct.pack('<HBx3f', integration_time, 0, 0.3, 0.3, 0.3)))
+
+    def _queue_packet(self, ready: float, pkt: bytearray) -> None:
+        if(self.bad_checksum_rate and self._random.random() < self.bad_checksum_rate):
+            pkt[-1] ^= 0xFF
+        if(self.drop_byte_rate and self._random.random() < self.drop_byte_rate):
+            del pkt[self._random.randrange(len(pkt))]
+        heapq.heappush(self._schedule, (ready, self._schedule_order, bytes(pkt)))
+        self._schedule_order += 1
+
+    def _pump(self, now: float) -> None:
+        # move every byte that has made it across the link by now into the receive buffer
+        while(True):
+            if(self._current is None):
+                if(not self._schedule or self._schedule[0][0] > now):
+                    return
+                ready, _, self._current = heapq.heappop(self._schedule)
+                self._current_start = max(ready, self._link_free)
+                self._current_sent = 0
+            length = len(self._current)
+            if(self._bytes_per_second):
+                arrived = min(length, max(0, int((now - self._current_start) * self._bytes_per_second)))
+            else:
+                arrived = length if now >= self._current_start else 0
+            if(arrived > self._current_sent):
+                self._rx += self._current[self._current_sent : arrived]
+                self.bytes_sent += arrived - self._current_sent
+                self._current_sent = arrived
+            if(arrived < length):
+                return
+            self._link_free = self._current_start + (length / self._bytes_per_second if self._bytes_per_second else 0)
+            self._current = None
+
+    def _next_arrival(self, now: float):
+        if(self._current is not None):
+            if(self._bytes_per_second):
+                return max(0.0, self._current_start + (self._current_sent + 1) / self._bytes_per_second - now)
+            return max(0.0, self._current_start - now)
+        if(self._schedule):
+            return max(0.0, max(self._schedule[0][0], self._link_free) - now)
+        return None
+
+    def _pty_loop(self, master: int) -> None:
+        import select
+        while(self._open):
+            with self._lock:
+                now = time.perf_counter()
+                self._pump(now)
+                data = bytes(self._rx)
+                self._rx.clear()
+                wait = self._next_arrival(now)
+            if(data):
+                os.write(master, data)
+            readable, _, _ = select.select([master], [], [], 0.05 if wait is None else min(wait, 0.05))
+            if(readable):
+                try:
+                    self.write(os.read(master, 4096))
+                except OSError:
+                    break
+        os.close(master)
+
+
+def measure_capture_rate(seconds: float = 5.0, integration_passes: int = 20, frame_average: int = 1, **simulator_args) -> dict:
+    """Run SpectroData against a VirtualNSP32 and report the end to end capture rate of the host stack."""
+    from SpectroData import SpectroData
+    sim = VirtualNSP32(**simulator_args)
+    spec_data = SpectroData(sim)
+    spec_data.integration_passes = integration_passes
+    spec_data.frame_average = frame_average
+    spec_data.capture_running = True
+    time.sleep(min(1.0, seconds / 5))
+    start_count, start_time = spec_data.captures_taken, time.perf_counter()
+    time.sleep(seconds)
+    captures, elapsed = spec_data.captures_taken - start_count, time.perf_counter() - start_time
+    spec_data.close()
+    return {
+        "captures_per_second": captures / elapsed,
+        "spectra_sent": sim.spectra_sent,
+        "captures_taken": spec_data.captures_taken,
+        "captures_dropped": spec_data.captures_dropped,
+        "bytes_discarded": spec_data.bytes_discarded,
+        "checksum_failures": spec_data.checksum_failures,
+        "latency": spec_data.latency.summary(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description = "Simulated NanoLambda NSP32 for hardware free testing")
+    parser.add_argument("--pty", action = "store_true", help = "serve the simulator on a pseudo terminal until interrupted")
+    parser.add_argument("--seconds", type = float, default = 5.0, help = "capture rate measurement length")
+    parser.add_argument("--baudrate", type = int, default = 115200, help = "link pacing, 0 disables it")
+    parser.add_argument("--integration-passes", type = int, default = 20)
+    parser.add_argument("--frame-average", type = int, default = 1)
+    parser.add_argument("--drop-byte-rate", type = float, default = 0.0)
+    parser.add_argument("--bad-checksum-rate", type = float, default = 0.0)
+    parser.add_argument("--split-read-max", type = int, default = 0)
+    args = parser.parse_args()
+
+    faults = dict(drop_byte_rate = args.drop_byte_rate, bad_checksum_rate = args.bad_checksum_rate, split_read_max = args.split_read_max)
+    if(args.pty):
+        sim = VirtualNSP32(baudrate = args.baudrate, **faults)
+        print(sim.serve_pty(), flush = True)
+        try:
+            while(True):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            sim.close()
+    else:
+        result = measure_capture_rate(args.seconds, args.integration_passes, args.frame_average, baudrate = args.baudrate, **faults)
+        latency = result.pop("latency")
+        for name, value in result.items():
+            print(f"{name}: {value:.2f}" if isinstance(value, float) else f"{name}: {value}")
+        for stage, stats in latency.items():
+            if(stats["count"]):
+                print(f"{stage}: p50 {stats['p50_ms']:.3f} ms, p95 {stats['p95_ms']:.3f} ms, p99 {stats['p99_ms']:.3f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -17,6 +17,9 @@
 import enum
 import struct
 import queue
+import threading
+import time
+import numpy
 
 """
 .. module:: NanoLambdaNSP32
@@ -68,6 +71,14 @@ class WavelengthInfo:
 		# convert received bytes to short data
 		return struct.unpack('<' + 'H' * self._numOfPoints, self._packetBytes[8 : 8 + self._numOfPoints * 2])
 
+	@property
+	def WavelengthArray(self):
+		"""numpy.ndarray: wavelength data (read-only view over the packet bytes, no copy)"""
+
+		arr = numpy.frombuffer(self._packetBytes, dtype = '<u2', count = self._numOfPoints, offset = 8)
+		arr.flags.writeable = False
+		return arr
+
 
 class SpectrumInfo:
 	"""spectrum info"""
@@ -108,6 +119,28 @@ class SpectrumInfo:
 		# convert received bytes to float data
 		return struct.unpack('<' + 'f' * self._numOfPoints, self._packetBytes[12 : 12 + self._numOfPoints * 4])
 
+	@property
+	def SpectrumArray(self):
+		"""numpy.ndarray: spectrum data (read-only view over the packet bytes, no copy)"""
+
+		arr = numpy.frombuffer(self._packetBytes, dtype = '<f4', count = self._numOfPoints, offset = 12)
+		arr.flags.writeable = False
+		return arr
+
+	def CopySpectrumTo(self, dest):
+		"""decode the spectrum data straight into a caller supplied array (e.g. a row of a capture history)
+		
+		Args:
+			dest(numpy.ndarray): destination array with NumOfPoints elements
+
+		Returns:
+			numpy.ndarray: the destination array
+
+		"""
+
+		dest[:] = numpy.frombuffer(self._packetBytes, dtype = '<f4', count = self._numOfPoints, offset = 12)
+		return dest
+
 	@property
 	def X(self):
 		"""float: X"""
@@ -305,8 +338,11 @@ class NSP32:
 
 	__CmdBufSize = max(__CmdLen)			# command buffer size
 	__RetBufSize = max(__RetPacketLen)		# return packet buffer size
+	__RetPacketMinLen = min(x for x in __RetPacketLen if x > 0)		# shortest return packet length
+	__Prefix = bytes((CmdCodeEnum.Prefix0, CmdCodeEnum.Prefix1))		# packet prefix codes
+	__ActiveReturn = { CmdCodeEnum.AcqSpectrum : CmdCodeEnum.GetSpectrum, CmdCodeEnum.AcqXYZ : CmdCodeEnum.GetXYZ }		# packets NSP32 actively sends out once an acquisition is done
 
-	def __init__(self, sendDataDelegate, returnPacketReceivedDelegate):
+	def __init__(self, sendDataDelegate, returnPacketReceivedDelegate, packetHeaderReceivedDelegate = None):
 		"""__init__ method
 
 		Args:
@@ -314,19 +350,74 @@ class NSP32:
 
 			returnPacketReceivedDelegate(function): "return packet received" delegate
 
+			packetHeaderReceivedDelegate(function): optional "packet header received" delegate, called with (cmdCode, userCode) as soon as the header of a return packet is recognized
+
 		"""
 
 		self._cmdBuf = bytearray(NSP32.__CmdBufSize)	# command buffer
-		self._retBuf = bytearray(NSP32.__RetBufSize)	# return packet buffer
-		self._retBufIdx = 0								# return packet buffer write index
+		self._retBuf = bytearray()						# return packet buffer (holds the bytes not yet parsed)
 		self._invalidPacketReceived = False				# "invalid packet received" flag
+		self._bytesDiscarded = 0						# num of unaligned bytes discarded while resyncing
+		self._checksumFailures = 0						# num of return packets with an invalid checksum
+		self._packetsEmitted = 0						# num of valid return packets emitted
+		self._headerNotified = False					# "header of the packet being received was notified" flag
 
 		self._cmdQueue = queue.Queue()					# command queue
-		self._isWaitingCmdReturn = False				# "is waiting command return" flag
+		self._waitingCmd = None							# (command function code, user code) of the command waiting for its return, None if not waiting
+		self._waitingCmdSince = 0.0						# time.monotonic() when the waiting command was sent
+		self._lock = threading.Lock()					# guards the command buffer and the waiting command (commands may be queued from any thread)
 
 		self._dataChannelSendDataDelegate = sendDataDelegate					# "send data" delegate: to send data (commands) to NSP32 through data channel (e.g. UART, BLE, WIFI, ...)
 		self._onReturnPacketReceivedDelegate = returnPacketReceivedDelegate		# "return packet received" delegate: to notify the listener that a packet is received
+		self._onPacketHeaderReceivedDelegate = packetHeaderReceivedDelegate		# "packet header received" delegate: to notify the listener that a packet has started arriving
 		
+	@property
+	def BytesDiscarded(self):
+		"""int: num of unaligned bytes discarded while resyncing to the packet prefix"""
+
+		return self._bytesDiscarded
+
+	@property
+	def ChecksumFailures(self):
+		"""int: num of return packets received with an invalid checksum"""
+
+		return self._checksumFailures
+
+	@property
+	def PacketsEmitted(self):
+		"""int: num of valid return packets emitted to the listener"""
+
+		return self._packetsEmitted
+
+	@property
+	def ExpectedBytes(self):
+		"""int: num of bytes still needed to complete the return packet being received (a sensible size for the next blocking read)"""
+
+		bufLen = len(self._retBuf)
+		returnLen = NSP32.__RetPacketLen[self._retBuf[2]] if bufLen >= 3 else 0
+
+		return returnLen - bufLen if returnLen > bufLen else max(1, NSP32.__RetPacketMinLen - bufLen)
+
+	@property
+	def IsWaitingCmdReturn(self):
+		"""bool: True if a command was sent and its return packet is not yet received"""
+
+		return self._waitingCmd is not None
+
+	@property
+	def WaitingCmdAge(self):
+		"""float: seconds since the command waiting for its return was sent (0 if not waiting)"""
+
+		return time.monotonic() - self._waitingCmdSince if self._waitingCmd is not None else 0.0
+
+	def AbortWaitingCmd(self):
+		"""stop waiting for the return of the last command sent (e.g. its return packet was lost), and send the next queued command"""
+
+		with self._lock :
+			self._waitingCmd = None
+
+		self._SendQueuedCmd()
+
 	def Hello(self, userCode):
 		"""say hello to NSP32
 		
@@ -383,13 +474,15 @@ class NSP32:
 
 		"""
 
-		self._cmdBuf[4] = integrationTime & 0xFF
-		self._cmdBuf[5] = integrationTime >> 8
-		self._cmdBuf[6] = frameAvgNum
-		self._cmdBuf[7] = 1 if enableAE else 0
-		self._cmdBuf[8] = 1		# active return
+		params = (
+			integrationTime & 0xFF,
+			integrationTime >> 8,
+			frameAvgNum,
+			1 if enableAE else 0,
+			1,		# active return
+		)
 
-		self._QueueCmd(CmdCodeEnum.AcqSpectrum, userCode)
+		self._QueueCmd(CmdCodeEnum.AcqSpectrum, userCode, params)
 
 	def AcqXYZ(self, userCode, integrationTime, frameAvgNum, enableAE):
 		"""start XYZ acquisition
@@ -407,13 +500,15 @@ class NSP32:
 
 		"""
 
-		self._cmdBuf[4] = integrationTime & 0xFF
-		self._cmdBuf[5] = integrationTime >> 8
-		self._cmdBuf[6] = frameAvgNum
-		self._cmdBuf[7] = 1 if enableAE else 0
-		self._cmdBuf[8] = 1		# active return
-		
-		self._QueueCmd(CmdCodeEnum.AcqXYZ, userCode)
+		params = (
+			integrationTime & 0xFF,
+			integrationTime >> 8,
+			frameAvgNum,
+			1 if enableAE else 0,
+			1,		# active return
+		)
+
+		self._QueueCmd(CmdCodeEnum.AcqXYZ, userCode, params)
 
 	def OnReturnByteReceived(self, rcv):
 		"""byte received handler (call this function when receiving a single byte from data channel)
@@ -423,121 +518,188 @@ class NSP32:
 
 		"""
 
-		# copy received byte into return packet buffer
-		if self._retBufIdx < NSP32.__RetBufSize :
-			self._retBuf[self._retBufIdx] = rcv
-			self._retBufIdx += 1
-
-			# parse the return packet buffer (to see if a valid return packet is received)
-			self._ParseRetBuf()
+		self.OnReturnBytesReceived((rcv,))
 
 	def OnReturnBytesReceived(self, data):
 		"""bytes received handler (call this function when receiving multiple bytes from data channel)
+
+		The bytes can be of any length: every complete return packet found is emitted, and a trailing partial packet is kept for the next call.
 		
 		Args:
 			data(list): bytes received
 
 		"""
 
-		# copy received bytes into return packet buffer
-		end = self._retBufIdx + len(data)
-		
-		if end <= NSP32.__RetBufSize :
-			self._retBuf[self._retBufIdx : end] = data
-			self._retBufIdx = end	# update return packet buffer write index
+		# append received bytes to the return packet buffer
+		self._retBuf.extend(data)
 
-			# parse the return packet buffer (to see if a valid return packet is received)
-			self._ParseRetBuf()
+		# parse the return packet buffer (emit every valid return packet received so far)
+		self._ParseRetBuf()
 
 	def _ParseRetBuf(self):
-		"""parse the return packet buffer (to see if a valid return packet is received)"""
+		"""parse the return packet buffer (emit every complete return packet, and keep the remaining partial packet for the next call)"""
+
+		buf = self._retBuf
+		end = len(buf)
+		idx = 0		# start of the packet currently being parsed
+
+		try :
+			while idx < end :
+				# if prefix codes are not aligned, scan forward to the next prefix and discard the bytes in front of it
+				if buf[idx] != CmdCodeEnum.Prefix0 or (idx + 1 < end and buf[idx + 1] != CmdCodeEnum.Prefix1) :
+					nxt = buf.find(NSP32.__Prefix, idx + 1)
+
+					if nxt < 0 :
+						# a trailing prefix 0 may be the start of the next packet
+						nxt = end - 1 if buf[end - 1] == CmdCodeEnum.Prefix0 else end
+
+					self._DiscardBytes(buf, idx, nxt)
+					idx = nxt
+					continue
+
+				if end - idx < 3 :
+					break
+
+				# determine the expected packet length based on command function code
+				returnLen = NSP32.__RetPacketLen[buf[idx + 2]]
+
+				# if we get an unrecognized command function code, the prefix was not a real one, so skip it and resync
+				if returnLen == 0 :
+					self._DiscardBytes(buf, idx, idx + 1)
+					idx += 1
+					continue
+
+				# notify the listener once per packet that it has started arriving (the user code is the 4th byte)
+				if not self._headerNotified and end - idx >= 4 :
+					self._headerNotified = True
+
+					if self._onPacketHeaderReceivedDelegate is not None :
+						self._onPacketHeaderReceivedDelegate(CmdCodeEnum(buf[idx + 2]), buf[idx + 3])
+
+				# wait for the rest of the packet
+				if end - idx < returnLen :
+					break
+
+				packetBytes = buf[idx : idx + returnLen]
+				self._headerNotified = False
+
+				if self._IsChecksumValid(packetBytes, returnLen) :
+					self._invalidPacketReceived = False
+					self._packetsEmitted += 1
+					idx += returnLen
+					self._EmitPacket(ReturnPacket(CmdCodeEnum(packetBytes[2]), packetBytes[3], True, packetBytes))
+				else :
+					# notify the listener of the bad packet, then resync after its prefix (it may have been a false prefix inside another packet's data)
+					self._checksumFailures += 1
+					self._invalidPacketReceived = True
+					self._bytesDiscarded += 2
+					idx += 2
+					self._EmitPacket(ReturnPacket(CmdCodeEnum(packetBytes[2]), packetBytes[3], False, packetBytes))
+		finally :
+			# drop everything that has been consumed, keep the partial packet
+			del buf[0 : idx]
+
+	def _DiscardBytes(self, buf, start, stop):
+		"""discard unaligned bytes from the return packet buffer (notify the listener once until a valid packet is received again)
+		
+		Args:
+			buf(bytearray): return packet buffer
 
-		pkt = None
+			start(int): start index of the discarded bytes
 
-		# if prefix codes are not aligned, notify the listener an invalid packet is received
-		if (self._retBufIdx == 1 and self._retBuf[0] != CmdCodeEnum.Prefix0) or (self._retBufIdx == 2 and self._retBuf[1] != CmdCodeEnum.Prefix1) :
-			if not self._invalidPacketReceived :
-				self._invalidPacketReceived = True
-				pkt = ReturnPacket(CmdCodeEnum.Unknown, 0, False, self._ExtractPacketBytes())
+			stop(int): stop index of the discarded bytes
 
-			self._retBufIdx = 0		# reset return packet buffer write index
-	
-		# determine the expected packet length based on command function code
-		returnLen = 0
+		"""
 
-		if self._retBufIdx >= 3 :
-			returnLen = NSP32.__RetPacketLen[self._retBuf[2]]
+		self._bytesDiscarded += stop - start
 
-			# if we get an unrecognized command function code, notify the listener an invalid packet is received				
-			if returnLen == 0 :
-				if not self._invalidPacketReceived :
-					self._invalidPacketReceived = True
-					pkt = ReturnPacket(CmdCodeEnum.Unknown, 0, False, self._ExtractPacketBytes())
+		if not self._invalidPacketReceived :
+			self._invalidPacketReceived = True
+			self._EmitPacket(ReturnPacket(CmdCodeEnum.Unknown, 0, False, buf[start : stop]))
 
-				self._retBufIdx = 0    # reset return packet buffer write index
+	def _EmitPacket(self, pkt):
+		"""notify the listener a return packet is received, then send the next queued command
 		
-		# if a whole packet is received, process it
-		if returnLen > 0 and self._retBufIdx >= returnLen :
-			self._invalidPacketReceived = False
-			isChecksumValid = self._IsChecksumValid(self._retBuf, returnLen)
-
-			# prepare return packet object
-			pkt = ReturnPacket(CmdCodeEnum(self._retBuf[2]), self._retBuf[3], isChecksumValid, self._ExtractPacketBytes())
+		Args:
+			pkt(ReturnPacket): return packet
 
-			# reset return packet buffer for next packet
-			self._retBufIdx = 0
+		"""
 
-		if pkt is not None :
+		try :
 			# notify the listener a return packet is received
 			if self._onReturnPacketReceivedDelegate is not None :
 				self._onReturnPacketReceivedDelegate(pkt)
+		finally :
+			self._EndCmdWait(pkt)
+
+	def _EndCmdWait(self, pkt):
+		"""stop waiting if the packet returns the waiting command, then send the next queued command
+		
+		Args:
+			pkt(ReturnPacket): return packet
+
+		"""
 
-			# send queued commands
-			self._isWaitingCmdReturn = False
-			self._SendQueuedCmd()
+		# the waiting command is returned by its own return packet, or the packet it makes NSP32 actively send out (both carry its user code);
+		# corrupted or discarded bytes also end the wait, since they may have been the return packet (which will then never come)
+		with self._lock :
+			waiting = self._waitingCmd
+
+			if waiting is not None :
+				if (not pkt.IsPacketValid) or (pkt.UserCode == waiting[1] and (pkt.CmdCode == waiting[0] or pkt.CmdCode == NSP32.__ActiveReturn.get(waiting[0]))) :
+					self._waitingCmd = None
+
+		# send queued commands
+		self._SendQueuedCmd()
 
 	def _SendQueuedCmd(self):
 		"""send out queued command (all commands from main application will be queued, and then be sent to NSP32 after the previous one is returned)"""
 
 		# if the previous command is not yet returned, do nothing, otherwise send the next command to NSP32 through data channel
-		if (not self._isWaitingCmdReturn) and (not self._cmdQueue.empty()) :
-			self._isWaitingCmdReturn = True
-			self._dataChannelSendDataDelegate(self._cmdQueue.get())
+		# (the command is taken under the lock, so only one thread can send it; the send itself happens outside the lock)
+		with self._lock :
+			if self._waitingCmd is not None :
+				return
+
+			try :
+				cmd = self._cmdQueue.get_nowait()
+			except queue.Empty :
+				return
+
+			self._waitingCmd = (cmd[2], cmd[3])
+			self._waitingCmdSince = time.monotonic()
+
+		self._dataChannelSendDataDelegate(cmd)
 
-	def _QueueCmd(self, cmdCode, userCode):
+	def _QueueCmd(self, cmdCode, userCode, params = ()):
 		"""queue command
 		
 		Args:
 			cmdCode(CmdCodeEnum): command function code
 
 			userCode(int): command user code
+
+			params(tuple): command parameter bytes (following the user code)
 	
 		"""
 
 		cmdLen = NSP32.__CmdLen[cmdCode]
-		
-		self._cmdBuf[0] = CmdCodeEnum.Prefix0
-		self._cmdBuf[1] = CmdCodeEnum.Prefix1
-		self._cmdBuf[2] = cmdCode
-		self._cmdBuf[3] = userCode
-		self._PlaceChecksum(self._cmdBuf, cmdLen - 1)		# add checksum
 
-		# queue the command (then the queued commands will be sent one by one)
-		self._cmdQueue.put(self._cmdBuf[0 : cmdLen])
+		# the command buffer is shared, build the command and queue it in one go
+		with self._lock :
+			self._cmdBuf[0] = CmdCodeEnum.Prefix0
+			self._cmdBuf[1] = CmdCodeEnum.Prefix1
+			self._cmdBuf[2] = cmdCode
+			self._cmdBuf[3] = userCode
+			self._cmdBuf[4 : 4 + len(params)] = bytes(params)
+			self._PlaceChecksum(self._cmdBuf, cmdLen - 1)		# add checksum
+
+			# queue the command (then the queued commands will be sent one by one)
+			self._cmdQueue.put(self._cmdBuf[0 : cmdLen])
 		
 		# check if we can send this command immediately
 		self._SendQueuedCmd()
 
-	def _ExtractPacketBytes(self):
-		"""extract packet bytes from return packet buffer
-		
-		Returns:
-			bytearray: packet bytes
-
-		"""
-
-		return None if self._retBufIdx <= 0 else self._retBuf[0 : self._retBufIdx]
-
 	def _PlaceChecksum(self, buf, len):
 		"""calculate checksum and append it to the end of the buffer (use "modular sum" method)
 		
@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+"""
+Pulse metrics for every spectral point of the capture history, on a pool of worker processes.
+
+For each channel, over the history resampled to a uniform rate:
+
+    dc                  mean level
+    ac                  peak to peak amplitude of the cardiac band (40 to 200 bpm), from its power
+    perfusion_index     ac / dc in percent
+    snr_db              power at the pulse rate and its first harmonic against the rest of 40 to 400 bpm
+    bpm                 pulse rate of the strongest cardiac band peak
+
+AnalysisPool needs a SpectroData created with shared_memory = True. The workers map its capture ring
+and each works on a block of channels in place, only the small metric arrays travel back. The pool can
+only be faster than pulse_metrics() in process when it has more than one core to run on: it defaults to
+one worker per core this process may use, and SpectroBench's "analysis" benchmark only times worker
+counts the machine has cores for.
+"""
+
+import os
+import concurrent.futures
+import numpy
+from SpectroData import resample_uniform
+
+METRICS_DTYPE = numpy.dtype([
+    ('dc', '<f4'),
+    ('ac', '<f4'),
+    ('perfusion_index', '<f4'),
+    ('snr_db', '<f4'),
+    ('bpm', '<f4'),
+])
+
+def pulse_metrics(timestamps_ns: numpy.ndarray, captures: numpy.ndarray, min_bpm: float = 40, max_bpm: float = 200) -> numpy.ndarray:
+    """Metrics of every column of captures (rows in time order), as a METRICS_DTYPE array with one entry per column."""
+    metrics = numpy.zeros(captures.shape[1], dtype = METRICS_DTYPE)
+    times, uniform = resample_uniform(timestamps_ns, captures)
+    if(len(uniform) < 8 or times[1] <= times[0]):
+        metrics['dc'] = captures.mean(axis = 0) if len(captures) else 0
+        return metrics
+    rate_hz = 1 / (times[1] - times[0])
+    count = len(uniform)
+
+    dc = uniform.mean(axis = 0)
+    power = numpy.abs(numpy.fft.rfft(uniform - dc, axis = 0)) ** 2
+    bpm_bins = numpy.fft.rfftfreq(count, 1 / rate_hz) * 60
+    band = numpy.flatnonzero((bpm_bins >= min_bpm) & (bpm_bins <= max_bpm))
+    if(len(band) == 0):
+        metrics['dc'] = dc
+        return metrics
+
+    band_power = power[band]
+    # mean square of the band limited signal is 2 * sum(|X|^2) / count^2 (Parseval, one sided spectrum),
+    # a sinusoid with that mean square is 2 * sqrt(2 * mean square) peak to peak
+    ac = 2 * numpy.sqrt(2 * 2 * band_power.sum(axis = 0) / count ** 2)
+    peak = band[numpy.argmax(band_power, axis = 0)]
+
+    # signal: the peak and its first harmonic, one bin either side
+    signal = numpy.zeros(power.shape, dtype = bool)
+    columns = numpy.arange(power.shape[1])
+    for harmonic in (1, 2):
+        for offset in (-1, 0, 1):
+            signal[numpy.clip(peak * harmonic + offset, 0, len(power) - 1), columns] = True
+    in_band = numpy.zeros(len(power), dtype = bool)
+    in_band[band[0] : min(2 * band[-1] + 2, len(power))] = True
+    signal_power = (power * (signal & in_band[:, None])).sum(axis = 0)
+    noise_power = (power * (~signal & in_band[:, None])).sum(axis = 0)
+
+    metrics['dc'] = dc
+    metrics['ac'] = ac
+    metrics['perfusion_index'] = numpy.divide(ac, dc, out = numpy.zeros_like(ac), where = dc != 0) * 100
+    metrics['snr_db'] = 10 * numpy.log10(numpy.maximum(signal_power, 1e-30) / numpy.maximum(noise_power, 1e-30))
+    metrics['bpm'] = bpm_bins[peak]
+    return metrics
+
+
+def usable_cores() -> int:
+    """Cores this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# worker process state, the shared ring is mapped once per worker
+_worker_ring = None
+
+def _worker_attach(name: str) -> None:
+    global _worker_ring
+    from SpectroShared import SharedCaptureClient
+    _worker_ring = SharedCaptureClient(name)
+
+def _worker_metrics(first: int, stop: int, first_channel: int, last_channel: int, min_bpm: float, max_bpm: float) -> numpy.ndarray:
+    rows = _worker_ring.span(first, stop)
+    return pulse_metrics(rows.timestamps, rows.captures[:, first_channel : last_channel], min_bpm, max_bpm)
+
+
+class AnalysisPool:
+    """
+    Pulse metrics of all channels, split in blocks of channels over worker processes.\n
+    analyze() hands every worker the ring rows of one snapshot and a channel range, the rows are read in place
+    from shared memory. If the writer wrapped onto the rows meanwhile the snapshot is taken again."""
+
+    def __init__(self, spec_data, workers: int = None, blocks_per_worker: int = 1, min_bpm: float = 40, max_bpm: float = 200):
+        name = spec_data.shared_memory_name
+        if(name is None):
+            raise ValueError("AnalysisPool needs a SpectroData created with shared_memory = True")
+        self._spec_data = spec_data
+        self._workers: int = workers or usable_cores()
+        self._min_bpm: float = min_bpm
+        self._max_bpm: float = max_bpm
+        self._executor = concurrent.futures.ProcessPoolExecutor(self._workers, initializer = _worker_attach, initargs = (name,))
+        # channel blocks, a few per worker evens out the load
+        edges = numpy.linspace(0, spec_data.num_points, min(self._workers * blocks_per_worker, spec_data.num_points) + 1).round().astype(int)
+        self._blocks: list = list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+    @property
+    def blocks(self) -> list:
+        return list(self._blocks)
+
+    def analyze(self, length: int = None) -> numpy.ndarray:
+        """METRICS_DTYPE array with one entry per spectral point, over the latest length captures (the whole history by default)."""
+        while(True):
+            snapshot = self._spec_data.snapshot(length)
+            futures = [self._executor.submit(_worker_metrics, snapshot.first, snapshot.sequence, first, last, self._min_bpm, self._max_bpm)
+                       for first, last in self._blocks]
+            metrics = numpy.concatenate([future.result() for future in futures])
+            if(snapshot.valid):
+                return metrics
+
+    def close(self) -> None:
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
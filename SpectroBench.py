@@ -0,0 +1,277 @@
+#!/usr/bin/python3
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+import os
+import sys
+import json
+import time
+import timeit
+import argparse
+import platform
+import numpy
+from NanoLambdaNSP32 import *
+from NSP32Simulator import VirtualNSP32, build_packet, spectrum_packet
+
+def _per_call_us(func, number: int) -> float:
+    return min(timeit.repeat(func, number = number, repeat = 5)) / number * 1e6
+
+def _finite(value: float):
+    # NaN is not valid JSON
+    return value if numpy.isfinite(value) else None
+
+def _packet_stream(packets: int) -> bytes:
+    ack = build_packet(CmdCodeEnum.AcqSpectrum, 0)
+    spectra = [ack + spectrum_packet(numpy.random.default_rng(i).random(135)) for i in range(16)]
+    return b''.join(spectra[i % len(spectra)] for i in range(packets))
+
+def bench_framer(chunk_sizes = (1, 16, 64, 565, 4096), packets: int = 2000) -> dict:
+    stream = _packet_stream(packets)
+    results = {}
+    for chunk in chunk_sizes:
+        # chunk size 1 is very slow, keep its run short
+        data = stream if chunk > 16 else stream[: len(stream) * chunk // 64]
+        chunks = [data[i : i + chunk] for i in range(0, len(data), chunk)]
+        nsp32 = NSP32(lambda d: None, None)
+        start = time.perf_counter()
+        for c in chunks:
+            nsp32.OnReturnBytesReceived(c)
+        elapsed = time.perf_counter() - start
+        results[f"chunk_{chunk}"] = {
+            "packets_per_second": nsp32.PacketsEmitted / 2 / elapsed,     # every spectrum comes with its acquisition ack
+            "megabytes_per_second": len(data) / elapsed / 1e6,
+        }
+    return results
+
+def bench_decode(number: int = 20000) -> dict:
+    info = ReturnPacket(CmdCodeEnum.GetSpectrum, 0, True, spectrum_packet(numpy.linspace(0, 1, 135))).ExtractSpectrumInfo()
+    row = numpy.zeros(135, dtype = numpy.float32)
+    return {
+        "spectrum_tuple_us": _per_call_us(lambda: info.Spectrum, number),
+        "spectrum_array_us": _per_call_us(lambda: info.SpectrumArray, number),
+        "spectrum_copy_to_us": _per_call_us(lambda: info.CopySpectrumTo(row), number),
+        "store_tuple_us": _per_call_us(lambda: row.__setitem__(slice(None), info.Spectrum), number),
+        "store_array_us": _per_call_us(lambda: row.__setitem__(slice(None), info.SpectrumArray), number),
+    }
+
+def bench_history(history_sizes = (100, 1000, 10000), number: int = 20000) -> dict:
+    from SpectroData import SpectroData, resample_uniform
+    from SpectroFilter import FilteredChannel
+    spectrum = spectrum_packet(numpy.linspace(0, 1, 135))
+    row = ReturnPacket(CmdCodeEnum.GetSpectrum, 0, True, spectrum).ExtractSpectrumInfo().SpectrumArray
+    results = {}
+    for size in history_sizes:
+        spec_data = SpectroData(VirtualNSP32(), max_capture_history = size)
+        # irregular capture times, as with auto AE
+        timestamps = numpy.cumsum(numpy.random.default_rng(0).integers(30_000_000, 60_000_000, size))
+        for timestamp in timestamps:
+            spec_data.add_capture(row, int(timestamp))
+        history_timestamps, history_captures = spec_data.timestamps.copy(), spec_data.captures.copy()
+        columns = numpy.arange(0, 128, 4)
+        vector = spec_data.channel_weights(columns)
+        savgol = FilteredChannel(11, 3)
+        savgol.update(spec_data, 67, lambda rows: rows[:, 67])
+        def savgol_tick():
+            # one new capture per tick, as at the channel graph rate
+            spec_data.add_capture(row)
+            savgol.update(spec_data, 67, lambda rows: rows[:, 67])
+        results[f"history_{size}"] = {
+            "add_capture_us": _per_call_us(lambda: spec_data.add_capture(row), number),
+            "channel_graph_us": _per_call_us(lambda: spec_data.channel_graph(67), number),
+            "captures_us": _per_call_us(lambda: spec_data.captures, number),
+            "mca_32_mean_us": _per_call_us(lambda: spec_data.combined_channel_graph(columns, "mean", vector), number // 20),
+            "mca_32_median_us": _per_call_us(lambda: spec_data.combined_channel_graph(columns, "median"), number // 20),
+            "savgol_tick_us": _per_call_us(savgol_tick, number // 20),
+            "resample_channel_us": _per_call_us(lambda: resample_uniform(history_timestamps, history_captures[:, 67]), number // 20),
+            "resample_32_channels_us": _per_call_us(lambda: resample_uniform(history_timestamps, history_captures[:, columns]), number // 20),
+            "uniform_cached_us": _per_call_us(lambda: spec_data.uniform_channel_graph(67), number),
+        }
+        spec_data.close()
+    return results
+
+def _gui_tick_ms(update, graph, number: int) -> float:
+    # a tick is the update call plus rendering the plot it touched
+    return _per_call_us(lambda: (update(), graph.grab()), number) / 1000
+
+def bench_gui(history_sizes = (100, 1000), marked_channels = (1, 8, 32), number: int = 50) -> dict:
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5 import QtWidgets
+    from SpectroPPG import MainWindow
+    from SpectroData import SpectroData
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+    results = {}
+    for size in history_sizes:
+        window = MainWindow()
+        sim = VirtualNSP32()
+        spec_data = SpectroData(sim, max_capture_history = size)
+        for i in range(size):
+            spec_data.add_capture(sim.spectrum_at(i / 20))
+        window._spec_data = spec_data
+        window.checkbox_enable_mca.setChecked(False)
+        result = {
+            "update_graph_ms": _gui_tick_ms(window.update_graph, window.graph, number),
+            "channel_graph_update_ms": _gui_tick_ms(window.channel_graph_update, window.graph_2, number),
+        }
+        window.checkbox_enable_mca.setChecked(True)
+        for marked in marked_channels:
+            window.list_mca.clear()
+            for chan in numpy.linspace(0, spec_data.num_points - 1, marked).astype(int):
+                window.list_mca.addItem(str(chan))
+            result[f"mca_{marked}"] = {
+                "update_graph_ms": _gui_tick_ms(window.update_graph, window.graph, number),
+                "channel_graph_update_ms": _gui_tick_ms(window.channel_graph_update, window.graph_2, number),
+            }
+        results[f"history_{size}"] = result
+        window._spec_data = None
+        spec_data.close()
+        window.close()
+        app.processEvents()
+    return results
+
+def bench_heartrate(channel_counts = (1, 8, 32), samples: int = 2000, live_seconds: float = 8.0) -> dict:
+    from SpectroData import SpectroData
+    from SpectroHeartRate import HeartRateEngine
+    sim = VirtualNSP32()
+    results = {}
+    for count in channel_counts:
+        engine = HeartRateEngine(channels = numpy.linspace(0, 134, count).astype(int), publish_interval = 0, queue_size = samples + 1)
+        start = time.perf_counter_ns()
+        for i in range(samples):
+            engine.push(start + i * 50_000_000, sim.spectrum_at(i / 20))
+        engine.close()
+        results[f"channels_{count}"] = {"update_us": engine.update_us, "bpm": _finite(engine.latest.bpm)}
+
+    # end to end, from the receipt of a capture to the reading that includes it
+    for interval in (0.0, 1.0):
+        spec_data = SpectroData(VirtualNSP32())
+        engine = HeartRateEngine(spec_data, channels = range(0, 135, 4), publish_interval = interval)
+        latencies = list()
+        engine.add_listener(lambda reading: latencies.append(reading.latency_ms))
+        spec_data.capture_running = True
+        time.sleep(live_seconds)
+        spec_data.capture_running = False
+        engine.close()
+        spec_data.close()
+        results[f"live_publish_{interval:g}s"] = {
+            "readings": len(latencies),
+            "latency_p50_ms": float(numpy.percentile(latencies, 50)) if latencies else None,
+            "latency_max_ms": engine.latency_max_ms,
+            "bpm": _finite(engine.latest.bpm) if engine.latest else None,
+            "samples_dropped": engine.samples_dropped,
+        }
+    return results
+
+def bench_analysis(history_sizes = (1000, 10000), worker_counts = (1, 2, 4, 8), number: int = 10) -> dict:
+    from SpectroData import SpectroData
+    from SpectroAnalysis import AnalysisPool, pulse_metrics, usable_cores
+    # more workers than cores only measures the pool's overhead, such counts are left out
+    cores = usable_cores()
+    measured = [workers for workers in worker_counts if workers <= cores]
+    results = {"usable_cores": cores, "skipped_worker_counts": [workers for workers in worker_counts if workers > cores]}
+    for size in history_sizes:
+        sim = VirtualNSP32(seed = 0)
+        spec_data = SpectroData(VirtualNSP32(), max_capture_history = size, shared_memory = True)
+        # irregular capture times around 50 per second, as with auto AE
+        timestamps = numpy.cumsum(numpy.random.default_rng(0).integers(15_000_000, 25_000_000, size))
+        for timestamp in timestamps:
+            spec_data.add_capture(sim.spectrum_at(timestamp / 1e9), int(timestamp))
+        entry = {"in_process_ms": _per_call_us(lambda: pulse_metrics(spec_data.timestamps, spec_data.captures), number) / 1000}
+        for workers in measured:
+            with AnalysisPool(spec_data, workers) as pool:
+                pool.analyze()      # workers start and map the ring on first use
+                entry[f"workers_{workers}_ms"] = _per_call_us(pool.analyze, number) / 1000
+            entry[f"workers_{workers}_speedup"] = entry["in_process_ms"] / entry[f"workers_{workers}_ms"]
+        results[f"history_{size}"] = entry
+        spec_data.close()
+        sim.close()
+    return results
+
+def bench_devices(device_counts = (1, 2, 4, 8), seconds: float = 3.0) -> dict:
+    from SpectroDevices import measure_device_scaling
+    # unpaced links show where the host runs out, paced ones what real sensors at 115200 baud get
+    return {
+        "baudrate_115200": measure_device_scaling(device_counts, seconds),
+        "unpaced": measure_device_scaling(device_counts, seconds, baudrate = 0),
+    }
+
+def bench_async(device_counts = (1, 2, 4, 8), seconds: float = 3.0) -> dict:
+    if(sys.platform == "win32"):
+        return {"skipped": "NSP32Async is POSIX only"}
+    from NSP32Async import measure_async_scaling
+    # the same sensors as bench_devices, on one event loop instead of two threads each
+    return {
+        "baudrate_115200": measure_async_scaling(device_counts, seconds),
+        "unpaced": measure_async_scaling(device_counts, seconds, baudrate = 0),
+    }
+
+def bench_stream(subscriber_counts = (1, 4), seconds: float = 2.0) -> dict:
+    from SpectroStream import measure_loopback
+    # a sensor delivers at most a few hundred captures per second
+    results = {}
+    for subscribers in subscriber_counts:
+        results[f"subscribers_{subscribers}"] = measure_loopback("127.0.0.1:0", subscribers, seconds)
+        results[f"subscribers_{subscribers}_3_channels"] = measure_loopback("127.0.0.1:0", subscribers, seconds, channels = (10, 67, 120))
+    return results
+
+BENCHMARKS = {
+    "framer": bench_framer,
+    "decode": bench_decode,
+    "history": bench_history,
+    "gui": bench_gui,
+    "heartrate": bench_heartrate,
+    "devices": bench_devices,
+    "async": bench_async,
+    "analysis": bench_analysis,
+    "stream": bench_stream,
+}
+
+def run(names = None) -> dict:
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "numpy": numpy.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": {},
+    }
+    for name in (names or BENCHMARKS):
+        report["results"][name] = BENCHMARKS[name]()
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description = "SpectroPPG benchmark suite, prints a JSON report")
+    parser.add_argument("benchmarks", nargs = "*", help = f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("-o", "--output", help = "write the report to this file instead of stdout")
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if(name not in BENCHMARKS):
+            parser.error(f"unknown benchmark: {name}")
+
+    report = json.dumps(run(args.benchmarks), indent = 2)
+    if(args.output):
+        with open(args.output, 'w') as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+if __name__ == "__main__":
+    main()
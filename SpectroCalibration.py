@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+"""
+Wavelength calibration of a sensor (the nm of every spectral point) and its on disk cache keyed by sensor ID.
+
+The cache is one "<sensor id>.npy" uint16 array per sensor, in %LOCALAPPDATA%\\SpectroPPG\\calibration on
+Windows and $XDG_CACHE_HOME/SpectroPPG/calibration (~/.cache by default) elsewhere.
+"""
+
+import os
+import re
+import tempfile
+import numpy
+
+def default_cache_directory() -> str:
+    base = os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "SpectroPPG", "calibration")
+
+
+class Calibration:
+    """
+    Wavelength table of one sensor.\n
+    channel_at() finds the channel nearest a wavelength with a binary search over the midpoints between
+    neighbouring wavelengths, which are worked out once here."""
+
+    def __init__(self, sensor_id: str, wavelengths):
+        self._sensor_id: str = sensor_id
+        self._wavelengths = numpy.array(wavelengths, dtype = numpy.uint16)
+        self._wavelengths.flags.writeable = False
+        self._wavelengths_nm = self._wavelengths.astype(numpy.float64)
+        self._wavelengths_nm.flags.writeable = False
+        self._order = numpy.argsort(self._wavelengths, kind = 'stable')
+        ordered = self._wavelengths_nm[self._order]
+        self._midpoints = (ordered[1:] + ordered[:-1]) / 2
+
+    @property
+    def sensor_id(self) -> str:
+        return self._sensor_id
+    @property
+    def num_points(self) -> int:
+        return len(self._wavelengths)
+    @property
+    def wavelengths(self) -> numpy.ndarray:
+        """nm of every spectral point, uint16 as the sensor reports them."""
+        return self._wavelengths
+    @property
+    def wavelengths_nm(self) -> numpy.ndarray:
+        """The same as float64, ready to plot against."""
+        return self._wavelengths_nm
+
+    def channel_at(self, nm):
+        """Channel nearest nm (an int), or the nearest channels of an array of wavelengths."""
+        channels = self._order[numpy.searchsorted(self._midpoints, nm)]
+        return int(channels) if numpy.ndim(channels) == 0 else channels
+
+    def wavelength_of(self, channel: int) -> int:
+        return int(self._wavelengths[channel])
+
+
+class CalibrationCache:
+    def __init__(self, directory: str = None):
+        self._directory: str = directory or default_cache_directory()
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    def path(self, sensor_id: str) -> str:
+        return os.path.join(self._directory, re.sub(r'[^0-9A-Za-z_-]', '_', sensor_id) + ".npy")
+
+    def load(self, sensor_id: str) -> Calibration:
+        """The cached calibration, None if there is none or it can not be read."""
+        try:
+            wavelengths = numpy.load(self.path(sensor_id), allow_pickle = False)
+        except Exception:
+            # missing, truncated or not an array at all, either way the sensor is asked again
+            return None
+        if(not isinstance(wavelengths, numpy.ndarray) or wavelengths.ndim != 1 or wavelengths.dtype != numpy.uint16 or len(wavelengths) == 0):
+            return None
+        return Calibration(sensor_id, wavelengths)
+
+    def store(self, calibration: Calibration) -> bool:
+        """Write atomically, a reader never sees half a file. Returns False if the cache is not writable."""
+        try:
+            os.makedirs(self._directory, exist_ok = True)
+            fd, temp_path = tempfile.mkstemp(suffix = ".tmp", dir = self._directory)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    numpy.save(f, calibration.wavelengths)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, self.path(calibration.sensor_id))
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        except OSError:
+            return False
+        return True
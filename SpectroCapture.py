@@ -0,0 +1,178 @@
+#!/usr/bin/python3
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+"""
+Headless capture for bench PCs and loggers, never imports Qt or pyqtgraph.
+
+    python SpectroCapture.py --port /dev/ttyUSB0 --duration 60 --output session.sppg
+    python SpectroCapture.py --port COM3 --count 1000 --format csv --output -
+
+Output formats:
+
+    recording   a SpectroRecorder file (the default, readable by SpectroRecording and the GUI review mode)
+    csv         the same table as a SpectroExport .csv: time in seconds since the first capture and every channel,
+                labelled in nm when the sensor's calibration arrives within a few seconds
+    raw         bare SpectroRecorder.record_dtype records back to back, no header, e.g. piped into another program
+    none        nothing is written, for measuring the capture rate
+
+--output - writes csv or raw to stdout. The capture summary always goes to stderr.
+"""
+
+import sys
+import time
+import argparse
+import threading
+import numpy
+import serial
+import SpectroRecorder
+import SpectroExport
+from SpectroData import SpectroData
+
+FORMATS = ("recording", "csv", "raw", "none")
+
+
+class _CsvSink:
+    def __init__(self, f, num_points: int, wavelengths = None):
+        channels = numpy.arange(num_points)
+        self._writer = SpectroExport.CsvWriter(f, SpectroExport.column_labels(channels, wavelengths), 0, channels, wavelengths)
+        self._t0: int = None
+
+    def __call__(self, timestamp_ns: int, info) -> None:
+        if(self._t0 is None):
+            self._t0 = timestamp_ns
+        self._writer.write(numpy.array([(timestamp_ns - self._t0) / 1e9]), info.SpectrumArray[numpy.newaxis])
+
+
+class _RawSink:
+    def __init__(self, f, num_points: int):
+        self._file = f
+        self._record = numpy.zeros(1, dtype = SpectroRecorder.record_dtype(num_points))
+
+    def __call__(self, timestamp_ns: int, info) -> None:
+        self._record[0] = (timestamp_ns, info.IntegrationTime, info.IsSaturated, 0, info.SpectrumArray)
+        self._file.write(self._record.tobytes())
+
+
+def open_device(port: str):
+    if(port == "sim"):
+        from NSP32Simulator import VirtualNSP32
+        return VirtualNSP32()
+    return serial.Serial(port, baudrate = 115200, bytesize = serial.EIGHTBITS, parity = serial.PARITY_NONE, stopbits = serial.STOPBITS_ONE)
+
+def capture(spec_data: SpectroData, count: int = 0, duration: float = 0, listener = None):
+    """
+    Capture until count captures were stored, duration seconds passed, Ctrl+C or the listener failed.\n
+    Returns the seconds captured and the listener's exception, if any."""
+    done = threading.Event()
+    target = spec_data.captures_taken + count
+    error = list()
+    def counter(timestamp_ns, info):
+        if(done.is_set()):
+            return
+        try:
+            if(listener is not None):
+                listener(timestamp_ns, info)
+        except Exception as e:
+            # e.g. the reader of a pipe went away, there is no point capturing on
+            error.append(e)
+            done.set()
+        if(count and spec_data.captures_taken >= target):
+            done.set()
+    spec_data.add_capture_listener(counter)
+
+    start = time.perf_counter()
+    spec_data.capture_running = True
+    try:
+        done.wait(duration if duration > 0 else None)
+    except KeyboardInterrupt:
+        pass
+    spec_data.capture_running = False
+    elapsed = time.perf_counter() - start
+    spec_data.remove_capture_listener(counter)
+    return elapsed, error[0] if error else None
+
+def main(argv = None) -> int:
+    parser = argparse.ArgumentParser(description = "Headless NSP32 capture")
+    parser.add_argument("--port", required = True, help = "serial port of the sensor, or \"sim\" for the simulator")
+    parser.add_argument("--integration-passes", type = int, default = 20)
+    parser.add_argument("--frame-average", type = int, default = 1)
+    parser.add_argument("--auto-ae", action = "store_true")
+    parser.add_argument("--count", type = int, default = 0, help = "stop after this many captures")
+    parser.add_argument("--duration", type = float, default = 0, help = "stop after this many seconds")
+    parser.add_argument("--output", help = "output file, - for stdout")
+    parser.add_argument("--format", choices = FORMATS, help = "output format (default: recording, or csv for .csv files)")
+    parser.add_argument("--compress", action = "store_true", help = "zlib compress recording chunks")
+    parser.add_argument("--publish", metavar = "NAME", help = "publish the capture ring as shared memory segment NAME (see SpectroShared)")
+    args = parser.parse_args(argv)
+
+    output_format = args.format or ("none" if args.output is None else "csv" if args.output.lower().endswith(".csv") else "recording")
+    if(output_format != "none" and args.output is None):
+        parser.error(f"--format {output_format} needs an --output")
+    if(output_format == "recording" and args.output == "-"):
+        parser.error("recordings can not be written to stdout, use --format raw")
+    if(args.count <= 0 and args.duration <= 0):
+        print("capturing until interrupted (Ctrl+C)", file = sys.stderr)
+
+    spec_data = SpectroData(open_device(args.port), shared_memory = args.publish or False)
+    spec_data.integration_passes = args.integration_passes
+    spec_data.frame_average = args.frame_average
+    spec_data.auto_ae = args.auto_ae
+
+    out = None
+    listener = None
+    if(output_format == "recording"):
+        spec_data.start_recording(args.output, compress = args.compress)
+    elif(output_format in ("csv", "raw")):
+        if(args.output == "-"):
+            out = sys.stdout if output_format == "csv" else sys.stdout.buffer
+        else:
+            out = open(args.output, 'w' if output_format == "csv" else 'wb')
+        if(output_format == "csv"):
+            calibration = spec_data.wait_calibration(3.0)
+            listener = _CsvSink(out, spec_data.num_points, calibration.wavelengths if calibration is not None else None)
+        else:
+            listener = _RawSink(out, spec_data.num_points)
+
+    try:
+        elapsed, error = capture(spec_data, args.count, args.duration, listener)
+    finally:
+        # close() drains the captures still in flight into the recording before closing it
+        recorder = spec_data.recorder
+        spec_data.close()
+        if(out is not None):
+            try:
+                out.flush()
+                if(args.output != "-"):
+                    out.close()
+            except BrokenPipeError:
+                pass
+
+    taken = spec_data.captures_taken
+    print(f"captures: {taken} in {elapsed:.2f} s ({taken / elapsed if elapsed > 0 else 0:.2f} per second)", file = sys.stderr)
+    print(f"dropped: {spec_data.captures_dropped}, bytes discarded: {spec_data.bytes_discarded}, checksum failures: {spec_data.checksum_failures}", file = sys.stderr)
+    if(recorder is not None):
+        print(f"recorded: {recorder.records_written} to {recorder.path} ({recorder.records_dropped} dropped)", file = sys.stderr)
+    if(error is not None):
+        print(f"output failed: {error}", file = sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
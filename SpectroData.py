@@ -19,37 +19,279 @@
 #  MA 02110-1301, USA.
 
 import time
+import queue
+import numpy
 import serial
 import threading
 from NanoLambdaNSP32 import *
+from SpectroRecorder import SpectroRecorder
+from SpectroLatency import LatencyTracker
+from SpectroCalibration import Calibration, CalibrationCache
 
-class SpectroData:
-    def __init__(self, serial_device: serial.Serial, max_capture_history = 100):
-        assert max_capture_history > 0
+def resample_uniform(timestamps_ns: numpy.ndarray, values: numpy.ndarray, rate_hz: float = None):
+    """
+    Linear interpolation of irregularly timed samples onto a uniform grid, as (times_s, values).\n
+    values is one series or a block of rows (one per timestamp). The grid ends on the newest sample and times are
+    seconds relative to it. rate_hz defaults to the median sample rate, so the point count stays about the same."""
+    timestamps_ns = numpy.asarray(timestamps_ns, dtype = numpy.int64)
+    values = numpy.asarray(values, dtype = numpy.float64)
+    if(len(timestamps_ns) < 2):
+        return numpy.zeros(len(timestamps_ns), dtype = numpy.float64), values.copy()
+    t = (timestamps_ns - timestamps_ns[-1]) / 1e9
+    if(rate_hz is None):
+        interval = numpy.median(numpy.diff(t))
+        if(interval <= 0):
+            return t, values.copy()
+        rate_hz = 1 / interval
+    count = int(-t[0] * rate_hz + 1e-9) + 1
+    grid = (numpy.arange(count, dtype = numpy.float64) - (count - 1)) / rate_hz
+    # every grid point sits between samples right - 1 and right, interpolated in one go for all columns
+    right = numpy.clip(numpy.searchsorted(t, grid, side = 'left'), 1, len(t) - 1)
+    t0 = t[right - 1]
+    span = t[right] - t0
+    fraction = numpy.divide(grid - t0, span, out = numpy.zeros_like(grid), where = span > 0)
+    if(values.ndim > 1):
+        fraction = fraction[:, None]
+    return grid, values[right - 1] + (values[right] - values[right - 1]) * fraction
+
+
+class CaptureSnapshot:
+    """
+    A consistent, copy-free view of captures first to sequence - 1 (numbered from 0 in arrival order).\n
+    The rows are views into the capture ring. The writer never touches them until it wraps around onto them,
+    which takes at least the ring's slack rows of new captures, valid tells whether that has happened yet.
+    Copy what you keep for longer and check valid after copying."""
+
+    def __init__(self, source, sequence: int, captures: numpy.ndarray, timestamps: numpy.ndarray, headroom: int = None, integration_times: numpy.ndarray = None):
+        self._source = source
+        self._sequence: int = sequence
+        self._captures: numpy.ndarray = captures
+        self._timestamps: numpy.ndarray = timestamps
+        self._integration_times: numpy.ndarray = integration_times
+        self._headroom: int = headroom          # None when the source never rewrites its rows
+
+    @property
+    def sequence(self) -> int:
+        return self._sequence
+    @property
+    def first(self) -> int:
+        return self._sequence - len(self._captures)
+    @property
+    def captures(self) -> numpy.ndarray:
+        return self._captures
+    @property
+    def timestamps(self) -> numpy.ndarray:
+        return self._timestamps
+    @property
+    def integration_times(self) -> numpy.ndarray:
+        return self._integration_times
+    @property
+    def times_s(self) -> numpy.ndarray:
+        """Timestamps in seconds relative to the newest capture, so the latest one is at 0."""
+        if(len(self._timestamps) == 0):
+            return numpy.zeros(0, dtype = numpy.float64)
+        return (self._timestamps - self._timestamps[-1]) / 1e9
+    @property
+    def valid(self) -> bool:
+        return self._headroom is None or self._source.sequence - self._sequence < self._headroom
+
+    def since(self, sequence: int) -> "CaptureSnapshot":
+        """The part of this snapshot from capture sequence on, it stays valid as long as the whole does."""
+        start = min(max(sequence - self.first, 0), len(self._captures))
+        integration_times = None if self._integration_times is None else self._integration_times[start:]
+        return CaptureSnapshot(self._source, self._sequence, self._captures[start:], self._timestamps[start:], self._headroom, integration_times)
+
+    def __len__(self) -> int:
+        return len(self._captures)
+
+
+class CaptureView:
+    """
+    Accessors shared by the live capture history and recorded sessions.\n
+    Subclasses provide since() (or captures), sequence and num_points."""
+
+    _uniform_cache: tuple = None
+
+    @property
+    def sequence(self) -> int:
+        """Number of captures so far, only ever grows on a live source."""
+        return self.captures_taken
+
+    @property
+    def captures(self) -> numpy.ndarray:
+        raise NotImplementedError
+    @property
+    def num_points(self) -> int:
+        raise NotImplementedError
+    @property
+    def calibration(self) -> "Calibration":
+        """Wavelength calibration of the sensor, None where it is not known."""
+        return None
+
+    def channel_graph(self, index: int) -> numpy.ndarray:
+        return self.captures[:, index]
+
+    def since(self, sequence: int) -> CaptureSnapshot:
+        """Snapshot of the captures from sequence on, or of the whole history if it reaches back further."""
+        raise NotImplementedError
+
+    def snapshot(self, length: int = None) -> CaptureSnapshot:
+        """Snapshot of the latest length captures (the whole history by default)."""
+        return self.since(self.sequence - (self.max_captures if length is None else length))
+
+    def channel_weights(self, columns, weights = None) -> numpy.ndarray:
+        """Weight vector over all points that averages the given columns, optionally weighted per column."""
+        vector = numpy.zeros(self.num_points, dtype = numpy.float32)
+        numpy.add.at(vector, columns, 1.0 if weights is None else numpy.asarray(weights, dtype = numpy.float32))
+        total = vector.sum()
+        if(len(columns) == 0 or total <= 0):
+            raise ValueError("no channels to combine" if len(columns) == 0 else "channel weights add up to zero")
+        vector /= total
+        return vector
+
+    def combined_channel_graph(self, columns, combiner: str = "mean", weights: numpy.ndarray = None) -> numpy.ndarray:
+        """
+        Combine several channels into one series with a single vectorized reduction over the capture history.\n
+        combiner is "mean", "weighted" or "median". For the means, weights is the vector from channel_weights(),
+        pass it in precomputed to skip building it every call (it is required for "weighted")."""
+        return self.combine_rows(self.captures, columns, combiner, weights)
+
+    def combine_rows(self, rows: numpy.ndarray, columns, combiner: str = "mean", weights: numpy.ndarray = None) -> numpy.ndarray:
+        """combined_channel_graph() on any block of capture rows, e.g. only the ones that arrived since the last tick."""
+        if(combiner == "median"):
+            return numpy.median(rows[:, columns], axis = 1)
+        if(weights is None):
+            if(combiner == "weighted"):
+                raise ValueError("weighted combiner needs a weight vector")
+            weights = self.channel_weights(columns)
+        return rows @ weights
+
+    def uniform_channel_graph(self, columns, rate_hz: float = None, combiner: str = "mean", weights: numpy.ndarray = None):
+        """
+        One channel (an int) or the combination of several resampled to a uniform rate, as (times_s, values).\n
+        Times are seconds relative to the newest capture. rate_hz defaults to the median capture rate of the
+        history. The result is cached until the next capture arrives, asking again for the same series is free."""
+        key = (self.sequence, self.max_captures, columns if isinstance(columns, int) else tuple(columns), rate_hz, combiner,
+               None if weights is None else tuple(numpy.asarray(weights, dtype = numpy.float64).tolist()))
+        if(self._uniform_cache is not None and self._uniform_cache[0] == key):
+            return self._uniform_cache[1]
+        while(True):
+            snapshot = self.snapshot()
+            if(isinstance(columns, int)):
+                values = numpy.array(snapshot.captures[:, columns], dtype = numpy.float64)
+            else:
+                values = self.combine_rows(snapshot.captures, list(columns), combiner, weights).astype(numpy.float64)
+            timestamps = numpy.array(snapshot.timestamps)
+            if(snapshot.valid):
+                break
+        result = resample_uniform(timestamps, values, rate_hz)
+        # keyed on the snapshot actually used, a capture that raced in is picked up by the next call
+        self._uniform_cache = ((snapshot.sequence,) + key[1:], result)
+        return result
+
+
+class SpectroData(CaptureView):
+    def __init__(self, serial_device: serial.Serial, max_capture_history = 100, num_points = 135, snapshot_slack = 32, shared_memory = False,
+                 calibration_cache = False):
+        assert max_capture_history > 0 and snapshot_slack > 0
         self._max_capture_history: int = max_capture_history
-        self._capture_history: list = [[] for _ in range(self._max_capture_history)]
-        self._capture_index_pointer: int = 0
+        self._num_points: int = num_points
+
+        # the ring is stored twice back to back, so any run of rows is one contiguous, chronological view.
+        # It holds snapshot_slack rows more than the history, a snapshot stays untouched for at least that many
+        # new captures. Capture n goes to slot n % capacity, and _captures_taken only moves on once the row is
+        # written, so it doubles as the sequence number readers check their snapshots against.
+        self._capacity: int = max_capture_history + snapshot_slack
+        # with shared_memory (True or a segment name) the rings are published in shared memory for other
+        # processes, see SpectroShared for the layout
+        self._shared_ring = None
+        if(shared_memory):
+            from SpectroShared import SharedRing
+            self._shared_ring = SharedRing(shared_memory if isinstance(shared_memory, str) else None, self._capacity, self._num_points, self._max_capture_history)
+            self._capture_history = self._shared_ring.captures
+            self._timestamp_history = self._shared_ring.timestamps
+            self._integration_time_history = self._shared_ring.integration_times
+        else:
+            self._capture_history = numpy.zeros((2 * self._capacity, self._num_points), dtype = numpy.float32)
+            self._timestamp_history = numpy.zeros(2 * self._capacity, dtype = numpy.int64)
+            self._integration_time_history = numpy.zeros(2 * self._capacity, dtype = numpy.uint16)
+        self._capture_history_ro = self._capture_history.view()
+        self._capture_history_ro.flags.writeable = False
+        self._timestamp_history_ro = self._timestamp_history.view()
+        self._timestamp_history_ro.flags.writeable = False
+        self._integration_time_history_ro = self._integration_time_history.view()
+        self._integration_time_history_ro.flags.writeable = False
         self._captures_taken: int = 0
         self._capture_running = False
 
+        # acquisition scheduler: the next AcqSpectrum is issued as soon as the previous GetSpectrum header
+        # arrives, so the sensor integrates while the host is still receiving and storing the last frame
+        self._burst_size: int = 0                   # 0 captures continuously, otherwise frames per start
+        self._burst_remaining: int = 0
+        self._acq_pending: bool = False             # an AcqSpectrum was sent and its GetSpectrum header is not in yet
+        self._acq_timeout: float = 2.0              # re-issue an acquisition if its spectrum never shows up
+        self._reply_timeout: float = 0.5            # give up on the reply of a command and send the next one
+        self._acq_user_code: int = 0                # user code of the latest AcqSpectrum, 1 to 255 so its replies can be told from the previous one's
+        self._command_lock = threading.Lock()
+
         # sensor
         self._sensor = serial_device
-        self._nsp32 = NSP32(self._sensor_data_send, self._sensor_packet_recieved)
+        self._nsp32 = NSP32(self._sensor_data_send, self._sensor_packet_recieved, self._sensor_header_recieved)
         self._integration_passes = 20
         self._frame_average = 1
         self._auto_ae = False
 
-        # recieving port thread
-        self._thread = threading.Thread(target = self._sensor_data_recieve)
-        self._thread.daemon = True
-        self._thread.start()
-
         # timing
         self._capture_time_history_max: int = 10
         self._capture_time_history: list = [0 for _ in range(self._capture_time_history_max)]
         self._capture_time_history_index: int = 0
-        self._capture_time_average: int = 0
+        self._capture_time_history_count: int = 0
         self._capture_timer = 0
+        self._last_capture_time = 0
+
+        # per stage latency, each acquisition carries its stage stamps (see SpectroLatency.STAGES) from
+        # test_capture to the consumer: acquisitions waiting for their spectrum by user code, so a lost spectrum
+        # never shifts the stamps onto the next one, then the one being received
+        self._latency = LatencyTracker()
+        self._acq_stamps: dict = dict()
+        self._receiving_stamps: list = None
+        self._read_ns: int = 0
+
+        # capture listeners are called from the consumer stage with (timestamp_ns, SpectrumInfo) once a capture is stored
+        self._capture_listeners: list = list()
+        self._recorder: SpectroRecorder = None
+        self._recorder_listener = None
+
+        # consumer stage, decodes and stores spectra handed over by the reader thread
+        self._capture_queue = queue.Queue(maxsize = 64)
+        self._captures_dropped: int = 0
+        self._consumer_thread = threading.Thread(target = self._capture_consumer)
+        self._consumer_thread.daemon = True
+        self._consumer_thread.start()
+
+        # wavelength calibration, fetched once on connect: the sensor ID, then the wavelength table unless the
+        # cache (True for the default directory, or a directory, off by default) already has it for that sensor.
+        # The replies are handled on the consumer thread, a request without a reply is sent again a few times
+        self._calibration_cache: CalibrationCache = None
+        if(calibration_cache):
+            self._calibration_cache = CalibrationCache(calibration_cache if isinstance(calibration_cache, str) else None)
+        self._sensor_id: str = None
+        self._calibration: Calibration = None
+        self._calibration_cached: bool = False
+        self._calibration_ready = threading.Event()
+        self._calibration_request: tuple = None     # (command, time.monotonic() it was sent, attempt) until answered
+        self._calibration_timeout: float = 1.0
+        self._calibration_attempts: int = 3
+
+        # recieving port thread, blocks on the port and wakes up at least every read timeout to check for shutdown
+        self._read_timeout: float = 0.1
+        self._sensor.timeout = self._read_timeout
+        self._reader_stop = threading.Event()
+        self._thread = threading.Thread(target = self._sensor_data_recieve)
+        self._thread.daemon = True
+        self._thread.start()
+
+        self._request_calibration(CmdCodeEnum.GetSensorId)
 
     @property
     def integration_passes(self) -> int:
@@ -72,20 +314,86 @@ class SpectroData:
     def auto_ae(self, val: bool) -> None:
         self._auto_ae = bool(val)
     @property
-    def captures(self) -> list:
-        return self._capture_history
+    def captures(self) -> numpy.ndarray:
+        return self.snapshot().captures
+    @property
+    def timestamps(self) -> numpy.ndarray:
+        return self.snapshot().timestamps
+    @property
+    def integration_times(self) -> numpy.ndarray:
+        return self.snapshot().integration_times
+    @property
+    def history_length(self) -> int:
+        return min(self._captures_taken, self._max_capture_history)
     @property
     def max_captures(self) -> int:
         return self._max_capture_history
     @property
+    def num_points(self) -> int:
+        return self._num_points
+    @property
+    def captures_taken(self) -> int:
+        return self._captures_taken
+    @property
     def capture_index(self) -> int:
-        return self._capture_index_pointer
+        return self._captures_taken % self._capacity
+    @property
+    def sequence(self) -> int:
+        return self._captures_taken
+    @property
+    def snapshot_slack(self) -> int:
+        return self._capacity - self._max_capture_history
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+    @property
+    def shared_memory_name(self) -> str:
+        """Name of the shared memory segment the ring is published in, None unless created with shared_memory."""
+        return self._shared_ring.name if self._shared_ring is not None else None
+    @property
+    def captures_dropped(self) -> int:
+        return self._captures_dropped
     @property
     def capture_time_ms(self) -> float:
-        sps = 0
-        for i in self._capture_time_history:
-            sps = sps + i
-        return round((sps / self._capture_time_history_max) * 1000)
+        # only the slots filled so far count, the history starts out empty
+        count = min(self._capture_time_history_count, self._capture_time_history_max)
+        return round(sum(self._capture_time_history) / count * 1000) if count else 0
+    @property
+    def captures_per_second(self) -> float:
+        total = sum(self._capture_time_history)
+        return min(self._capture_time_history_count, self._capture_time_history_max) / total if total > 0 else 0.0
+    @property
+    def bytes_discarded(self) -> int:
+        return self._nsp32.BytesDiscarded
+    @property
+    def checksum_failures(self) -> int:
+        return self._nsp32.ChecksumFailures
+    @property
+    def sensor_id(self) -> str:
+        """"XX-XX-XX-XX-XX" once the sensor answered, None before."""
+        return self._sensor_id
+    @property
+    def calibration(self) -> Calibration:
+        """Wavelength calibration of the sensor, None until it is known."""
+        return self._calibration
+    @property
+    def wavelengths(self) -> numpy.ndarray:
+        """nm of every spectral point (uint16), None until the calibration is known."""
+        return self._calibration.wavelengths if self._calibration is not None else None
+    @property
+    def calibration_cached(self) -> bool:
+        """The calibration came from the cache, the wavelength table was not read from the sensor."""
+        return self._calibration_cached
+    @property
+    def latency(self) -> LatencyTracker:
+        return self._latency
+    @property
+    def burst_size(self) -> int:
+        return self._burst_size
+    @burst_size.setter
+    def burst_size(self, val: int) -> None:
+        assert val >= 0
+        self._burst_size = val
     @property
     def capture_running(self) -> bool:
         return self._capture_running
@@ -93,39 +401,224 @@ class SpectroData:
     def capture_running(self, run: bool) -> None:
         if(not self.capture_running and run):
             self._capture_running = True
-            self.test_capture()
+            self._burst_remaining = self._burst_size
+            self._last_capture_time = 0
+            self._capture_time_history = [0 for _ in range(self._capture_time_history_max)]
+            self._capture_time_history_count = 0
+            # an acquisition still in flight restarts the chain when its spectrum arrives
+            if(not self._acq_pending):
+                self.test_capture()
         else:
             self._capture_running = False
 
-    def channel_graph(self, index: int) -> list:
-        channel = list()
-        for i in self._capture_history:
-            channel.append(i[index])
-        return channel
+    def wait_calibration(self, timeout: float = None) -> Calibration:
+        """Block until the calibration is known, returns None on timeout."""
+        self._calibration_ready.wait(timeout)
+        return self._calibration
 
-    def add_capture(self, data: tuple) -> None:
-        self._capture_history[self._capture_index_pointer] = data
-        self._capture_index_pointer = (self._capture_index_pointer + 1) % self._max_capture_history
+    def channel_graph(self, index: int) -> numpy.ndarray:
+        return self.snapshot().captures[:, index]
+
+    def since(self, sequence: int) -> CaptureSnapshot:
+        taken = self._captures_taken
+        count = max(0, min(taken - sequence, taken, self._max_capture_history))
+        start = (taken - count) % self._capacity
+        return CaptureSnapshot(self, taken, self._capture_history_ro[start : start + count],
+                               self._timestamp_history_ro[start : start + count], self._capacity - count,
+                               self._integration_time_history_ro[start : start + count])
+
+    def add_capture(self, data, timestamp_ns: int = 0, integration_time: int = 0) -> None:
+        slot = self._captures_taken % self._capacity
+        row = self._capture_history[slot]
+        row[:] = data
+        self._capture_history[slot + self._capacity] = row
+        self._timestamp_history[slot] = timestamp_ns
+        self._timestamp_history[slot + self._capacity] = timestamp_ns
+        self._integration_time_history[slot] = integration_time
+        self._integration_time_history[slot + self._capacity] = integration_time
+        # publish only once the row is complete
+        self._captures_taken += 1
+        if(self._shared_ring is not None):
+            self._shared_ring.publish(self._captures_taken)
+
+    def add_capture_listener(self, listener) -> None:
+        # copied on write, so the consumer thread can iterate the list without a lock
+        self._capture_listeners = self._capture_listeners + [listener]
+
+    def remove_capture_listener(self, listener) -> None:
+        self._capture_listeners = [l for l in self._capture_listeners if l != listener]
+
+    @property
+    def recorder(self) -> SpectroRecorder:
+        return self._recorder
+
+    def start_recording(self, path: str, **recorder_args) -> SpectroRecorder:
+        self.stop_recording()
+        recorder = SpectroRecorder(path, self._num_points, calibration = self._calibration, **recorder_args)
+        self._recorder_listener = lambda timestamp_ns, info: recorder.add(timestamp_ns, info.IntegrationTime, info.IsSaturated, info.SpectrumArray)
+        self._recorder = recorder
+        self.add_capture_listener(self._recorder_listener)
+        return recorder
+
+    def stop_recording(self) -> SpectroRecorder:
+        recorder = self._recorder
+        if(recorder is not None):
+            self.remove_capture_listener(self._recorder_listener)
+            self._recorder = None
+            self._recorder_listener = None
+            recorder.close()
+        return recorder
+
+    def close(self) -> None:
+        self._capture_running = False
+        self._reader_stop.set()
+        if(self._thread is not threading.current_thread()):
+            self._thread.join()
+        self._capture_queue.put(None)
+        if(self._consumer_thread is not threading.current_thread()):
+            self._consumer_thread.join()
+        self.stop_recording()
+        self._sensor.close()
+        if(self._shared_ring is not None):
+            # the ring can only unmap the segment once no array of ours points into it
+            self._capture_history = self._timestamp_history = self._integration_time_history = None
+            self._capture_history_ro = self._timestamp_history_ro = self._integration_time_history_ro = None
+            self._shared_ring.close()
+            self._shared_ring = None
 
     def test_capture(self):
-        self._capture_timer = time.time()
-        self._nsp32.AcqSpectrum(0, self._integration_passes, self._frame_average, self._auto_ae)    # Params: (sensor ID number, integration time, frame average, auto AE)
-        
+        with self._command_lock:
+            if(self._burst_size):
+                if(self._burst_remaining <= 0):
+                    self._capture_running = False
+                    return
+                self._burst_remaining -= 1
+            self._acq_pending = True
+            self._acq_user_code = self._acq_user_code % 255 + 1
+            self._capture_timer = time.monotonic()
+            self._acq_stamps[self._acq_user_code] = [time.perf_counter_ns(), 0, 0, 0, 0, 0]
+            self._nsp32.AcqSpectrum(self._acq_user_code, self._integration_passes, self._frame_average, self._auto_ae)    # Params: (user code, integration time, frame average, auto AE)
+
     def _sensor_data_send(self, data):
         self._sensor.write(data)
+        if(data[2] == CmdCodeEnum.AcqSpectrum):
+            stamps = self._acq_stamps.get(data[3])
+            if(stamps is not None):
+                stamps[1] = time.perf_counter_ns()
 
     def _sensor_data_recieve(self):
-        while(self._sensor.isOpen()):
-            if(self._sensor.in_waiting):
-                self._nsp32.OnReturnBytesReceived(self._sensor.read(self._sensor.in_waiting))
+        while(not self._reader_stop.is_set() and self._sensor.isOpen()):
+            try:
+                # block until the rest of the expected packet (or everything already buffered) arrives, or the read times out
+                data = self._sensor.read(max(self._nsp32.ExpectedBytes, self._sensor.in_waiting))
+            except serial.SerialException as e:
+                print(e)
+                break
+            if(data):
+                self._read_ns = time.perf_counter_ns()
+                try:
+                    self._nsp32.OnReturnBytesReceived(data)
+                except Exception as e:
+                    # the framer keeps its place, a failing handler costs at most the packet it was handling
+                    print(e)
+            if(self._nsp32.WaitingCmdAge > self._reply_timeout):
+                # the reply was lost, or corrupted beyond recognition, let the queued commands go out
+                self._nsp32.AbortWaitingCmd()
+            request = self._calibration_request
+            if(request is not None and time.monotonic() - request[1] > self._calibration_timeout):
+                if(request[2] < self._calibration_attempts):
+                    self._request_calibration(request[0], request[2] + 1)
+                else:
+                    self._calibration_request = None
+                    print(f"no reply to {request[0].name} after {request[2]} attempts, spectra stay uncalibrated")
+            if(not data and self._capture_running and self._acq_pending and time.monotonic() - self._capture_timer > self._acq_timeout):
+                # the spectrum of the last acquisition was lost, stop waiting for any reply and restart the capture chain
+                self._nsp32.AbortWaitingCmd()
+                self.test_capture()
+
+    def _sensor_header_recieved(self, cmd: CmdCodeEnum, user_code: int) -> None:
+        if cmd == CmdCodeEnum.GetSpectrum:
+            # the read that brought the header in is when the first reply bytes arrived
+            self._receiving_stamps = self._acq_stamps.pop(user_code, None) or [0, 0, 0, 0, 0, 0]
+            self._receiving_stamps[2] = self._read_ns
+        # the sensor is done integrating and is sending the spectrum, queue up the next acquisition right away
+        if cmd == CmdCodeEnum.GetSpectrum and self._acq_pending:
+            self._acq_pending = False
+            if(self._capture_running):
+                self.test_capture()
 
     def _sensor_packet_recieved(self, pkt: ReturnPacket) -> None:
         if pkt.CmdCode == CmdCodeEnum.GetSpectrum:
-            self.add_capture(pkt.ExtractSpectrumInfo().Spectrum)
-            self._captures_taken += 1
-            self._capture_time_history[self._capture_time_history_index] = time.time() - self._capture_timer
-            self._capture_time_history_index = (self._capture_time_history_index + 1) % self._capture_time_history_max
+            # a corrupted spectrum is dropped, the next acquisition is already on its way
+            if(pkt.IsPacketValid):
+                stamps = self._receiving_stamps or [0, 0, 0, 0, 0, 0]
+                self._receiving_stamps = None
+                stamps[3] = time.perf_counter_ns()
+                try:
+                    self._capture_queue.put_nowait((pkt, stamps))
+                except queue.Full:
+                    self._captures_dropped += 1
+        elif (pkt.CmdCode == CmdCodeEnum.GetSensorId or pkt.CmdCode == CmdCodeEnum.GetWavelength) and pkt.IsPacketValid:
+            # the cache is file I/O, which the reader thread leaves to the consumer
+            self._capture_queue.put((pkt, None))
 
-            # if captures are still running, call the next capture
-            if(self._capture_running):
-                self.test_capture()
+    def _request_calibration(self, cmd: CmdCodeEnum, attempt: int = 1) -> None:
+        self._calibration_request = (cmd, time.monotonic(), attempt)
+        with self._command_lock:
+            if(cmd == CmdCodeEnum.GetSensorId):
+                self._nsp32.GetSensorId(0)
+            else:
+                self._nsp32.GetWavelength(0)
+
+    def _calibration_recieved(self, pkt: ReturnPacket) -> None:
+        if pkt.CmdCode == CmdCodeEnum.GetSensorId:
+            self._sensor_id = pkt.ExtractSensorIdStr()
+            calibration = self._calibration_cache.load(self._sensor_id) if self._calibration_cache is not None else None
+            if(calibration is not None):
+                self._calibration_request = None
+                self._calibration_cached = True
+                self._set_calibration(calibration)
+            else:
+                self._request_calibration(CmdCodeEnum.GetWavelength)
+        elif self._sensor_id is not None:
+            self._calibration_request = None
+            calibration = Calibration(self._sensor_id, pkt.ExtractWavelengthInfo().WavelengthArray)
+            if(self._calibration_cache is not None):
+                self._calibration_cache.store(calibration)
+            self._set_calibration(calibration)
+
+    def _set_calibration(self, calibration: Calibration) -> None:
+        if(calibration.num_points != self._num_points):
+            print(f"sensor {calibration.sensor_id} reports {calibration.num_points} wavelengths for {self._num_points} points, calibration ignored")
+            return
+        self._calibration = calibration
+        self._calibration_ready.set()
+
+    def _capture_consumer(self) -> None:
+        while(True):
+            item = self._capture_queue.get()
+            if(item is None):
+                break
+            pkt, stamps = item
+            if(stamps is None):
+                self._calibration_recieved(pkt)
+                continue
+            recieved_ns = stamps[3]
+            info = pkt.ExtractSpectrumInfo()
+            stamps[4] = time.perf_counter_ns()
+            self.add_capture(info.SpectrumArray, recieved_ns, info.IntegrationTime)
+            stamps[5] = time.perf_counter_ns()
+            self._latency.stamp(self._captures_taken - 1, stamps)
+
+            # time between consecutive spectra, which is the real capture period once acquisitions overlap
+            if(self._last_capture_time):
+                self._capture_time_history[self._capture_time_history_index] = (recieved_ns - self._last_capture_time) / 1e9
+                self._capture_time_history_index = (self._capture_time_history_index + 1) % self._capture_time_history_max
+                self._capture_time_history_count += 1
+            self._last_capture_time = recieved_ns
+
+            for listener in self._capture_listeners:
+                try:
+                    listener(recieved_ns, info)
+                except Exception as e:
+                    print(e)
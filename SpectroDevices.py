@@ -0,0 +1,223 @@
+#!/usr/bin/python3
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+"""
+Simultaneous capture from several NSP32 sensors, e.g. one on a finger and one on an earlobe.
+
+Every device is a SpectroData of its own, with its own port, reader and consumer threads and acquisition chain,
+so devices never wait on each other. All of them stamp captures with the same host perf_counter_ns clock,
+which is the shared time base: times_s() puts any timestamp on the manager's clock and aligned() matches
+up the captures of all devices in time.
+"""
+
+import time
+import threading
+import numpy
+import serial
+from SpectroData import SpectroData
+
+def open_serial_port(port: str) -> serial.Serial:
+    return serial.Serial(port, baudrate = 115200, bytesize = serial.EIGHTBITS, parity = serial.PARITY_NONE, stopbits = serial.STOPBITS_ONE)
+
+
+class DeviceManager:
+    """
+    A named set of SpectroData devices captured side by side.\n
+    open() takes a port name, or an already open serial device (VirtualNSP32 works too). Any keyword arguments
+    given to the manager are passed on to every SpectroData it creates."""
+
+    def __init__(self, serial_factory = open_serial_port, **spectro_args):
+        self._serial_factory = serial_factory
+        self._spectro_args: dict = spectro_args
+        self._devices: dict = dict()
+        # per device (captures_taken, perf_counter_ns) when capture started, for the average rate
+        self._started: dict = dict()
+        self._epoch_ns: int = time.perf_counter_ns()
+        self._lock = threading.Lock()
+        self._next_index: int = 0         # default names are never reused, closing a device frees no name
+
+    @property
+    def devices(self) -> dict:
+        return dict(self._devices)
+    @property
+    def names(self) -> list:
+        return list(self._devices)
+    @property
+    def epoch_ns(self) -> int:
+        """perf_counter_ns at which the manager's time base starts."""
+        return self._epoch_ns
+    @property
+    def capture_running(self) -> bool:
+        return any(device.capture_running for device in self._devices.values())
+    @capture_running.setter
+    def capture_running(self, run: bool) -> None:
+        if(run):
+            self.start()
+        else:
+            self.stop()
+
+    def __getitem__(self, name: str) -> SpectroData:
+        return self._devices[name]
+
+    def __len__(self) -> int:
+        return len(self._devices)
+
+    def open(self, port, name: str = None) -> SpectroData:
+        """Connect a device, port is a port name for the serial factory or an open serial device. Returns its SpectroData."""
+        with self._lock:
+            if(name is None):
+                name = port if isinstance(port, str) else self._default_name()
+            if(name in self._devices):
+                raise ValueError(f"a device named {name} is already open")
+            serial_device = self._serial_factory(port) if isinstance(port, str) else port
+            try:
+                device = SpectroData(serial_device, **self._spectro_args)
+            except Exception:
+                # a port the manager opened is closed again, a device handed in stays the caller's
+                if(serial_device is not port):
+                    serial_device.close()
+                raise
+            self._devices[name] = device
+        return device
+
+    def _default_name(self) -> str:
+        while(True):
+            name = f"device{self._next_index}"
+            self._next_index += 1
+            if(name not in self._devices):
+                return name
+
+    def close(self, name: str) -> None:
+        with self._lock:
+            device = self._devices.pop(name)
+            self._started.pop(name, None)
+        device.close()
+
+    def close_all(self) -> None:
+        for name in self.names:
+            self.close(name)
+
+    def start(self) -> None:
+        now = time.perf_counter_ns()
+        for name, device in self._devices.items():
+            if(not device.capture_running):
+                self._started[name] = (device.captures_taken, now)
+                device.capture_running = True
+
+    def stop(self) -> None:
+        for device in self._devices.values():
+            device.capture_running = False
+
+    def configure(self, integration_passes: int = None, frame_average: int = None, auto_ae: bool = None) -> None:
+        """Apply sensor settings to every device, settings left at None are not changed."""
+        for device in self._devices.values():
+            if(integration_passes is not None):
+                device.integration_passes = integration_passes
+            if(frame_average is not None):
+                device.frame_average = frame_average
+            if(auto_ae is not None):
+                device.auto_ae = auto_ae
+
+    def times_s(self, timestamps_ns) -> numpy.ndarray:
+        """Capture timestamps of any device in seconds on the shared time base."""
+        return (numpy.asarray(timestamps_ns, dtype = numpy.int64) - self._epoch_ns) / 1e9
+
+    def stats(self) -> dict:
+        """Throughput counters per device plus their totals under "total"."""
+        now = time.perf_counter_ns()
+        report = dict()
+        for name, device in self._devices.items():
+            start_taken, start_ns = self._started.get(name, (device.captures_taken, now))
+            elapsed = (now - start_ns) / 1e9
+            report[name] = {
+                "captures_taken": device.captures_taken,
+                "captures_dropped": device.captures_dropped,
+                "captures_per_second": device.captures_per_second,
+                "average_captures_per_second": (device.captures_taken - start_taken) / elapsed if elapsed > 0 else 0.0,
+                "bytes_discarded": device.bytes_discarded,
+                "checksum_failures": device.checksum_failures,
+            }
+        report["total"] = {key: sum(device[key] for device in report.values()) for key in
+                           ("captures_taken", "captures_dropped", "captures_per_second", "average_captures_per_second", "bytes_discarded", "checksum_failures")}
+        return report
+
+    def aligned(self, reference: str = None, tolerance_ms: float = None):
+        """
+        The capture histories of all devices matched up in time, as (times_s, {name: rows}).\n
+        Every capture of the reference device (the first one opened by default) is paired with the nearest capture
+        of each other device. Rows without a partner within tolerance_ms are NaN. Empty without devices."""
+        if(not self._devices):
+            return numpy.zeros(0, dtype = numpy.float64), dict()
+        reference = self.names[0] if reference is None else reference
+        histories = dict()
+        for name, device in self._devices.items():
+            while(True):
+                snapshot = device.snapshot()
+                timestamps, captures = snapshot.timestamps.copy(), snapshot.captures.copy()
+                if(snapshot.valid):
+                    break
+            histories[name] = (timestamps, captures)
+
+        reference_ns = histories[reference][0]
+        rows = dict()
+        for name, (timestamps, captures) in histories.items():
+            if(name == reference):
+                rows[name] = captures
+                continue
+            matched = numpy.full((len(reference_ns), captures.shape[1]), numpy.nan, dtype = numpy.float32)
+            if(len(timestamps)):
+                # nearest of the two captures either side of every reference time
+                after = numpy.searchsorted(timestamps, reference_ns)
+                left = numpy.clip(after - 1, 0, len(timestamps) - 1)
+                right = numpy.clip(after, 0, len(timestamps) - 1)
+                nearest = numpy.where(numpy.abs(timestamps[left] - reference_ns) <= numpy.abs(timestamps[right] - reference_ns), left, right)
+                keep = numpy.ones(len(reference_ns), dtype = bool) if tolerance_ms is None else numpy.abs(timestamps[nearest] - reference_ns) <= tolerance_ms * 1e6
+                matched[keep] = captures[nearest[keep]]
+            rows[name] = matched
+        return self.times_s(reference_ns), rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close_all()
+
+
+def measure_device_scaling(device_counts = (1, 2, 4, 8), seconds: float = 3.0, **simulator_args) -> dict:
+    """Aggregate capture rate of the host stack against 1, 2, 4 ... simulated sensors captured at once."""
+    from NSP32Simulator import VirtualNSP32
+    results = dict()
+    for count in device_counts:
+        with DeviceManager() as manager:
+            for i in range(count):
+                manager.open(VirtualNSP32(seed = i, **simulator_args), f"sim{i}")
+            manager.start()
+            time.sleep(min(1.0, seconds / 3))
+            start_taken, start_time = manager.stats()["total"]["captures_taken"], time.perf_counter()
+            time.sleep(seconds)
+            stats = manager.stats()
+            elapsed = time.perf_counter() - start_time
+            manager.stop()
+        results[f"devices_{count}"] = {
+            "captures_per_second": (stats["total"]["captures_taken"] - start_taken) / elapsed,
+            "per_device_captures_per_second": [stats[name]["captures_per_second"] for name in stats if name != "total"],
+            "captures_dropped": stats["total"]["captures_dropped"],
+        }
+    return results
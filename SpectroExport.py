@@ -0,0 +1,232 @@
+#!/usr/bin/python3
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+"""
+Bulk export of captures to CSV, .npy or .npz, picked by the file extension.
+
+    .csv    header row, then one row per capture: time in seconds followed by the exported channels
+    .npy    the same table as a float64 array of shape (captures, 1 + channels)
+    .npz    "timestamps_s" (float64), "spectra" (float32, captures x channels), "channels" and, when known, "wavelengths"
+
+Exports run block by block, so a recording of any length is streamed from disk instead of loaded whole,
+and ExportJob runs any export on a worker thread with progress and cancellation. An export is written to
+path + ".part" and only renamed to path once it completed, a failed or cancelled export leaves no file behind.
+"""
+
+import os
+import zipfile
+import contextlib
+import threading
+import numpy
+import SpectroRecorder
+
+BLOCK_ROWS = 4096
+
+class ExportCancelled(Exception):
+    pass
+
+
+class ExportJob:
+    """Runs an export function on a worker thread, passing it a progress callback that also handles cancellation."""
+
+    def __init__(self, target, *args, **kwargs):
+        self._progress: float = 0.0
+        self._cancelled: bool = False
+        self._done: bool = False
+        self._error: Exception = None
+        self._result = None
+        self._thread = threading.Thread(target = self._run, args = (target, args, kwargs))
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def progress(self) -> float:
+        return self._progress
+    @property
+    def done(self) -> bool:
+        return self._done
+    @property
+    def error(self) -> Exception:
+        return self._error
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+    @property
+    def result(self):
+        return self._result
+
+    def cancel(self) -> None:
+        self._cancelled = True
+
+    def wait(self, timeout: float = None) -> bool:
+        self._thread.join(timeout)
+        return self._done
+
+    def _set_progress(self, fraction: float) -> None:
+        if(self._cancelled):
+            raise ExportCancelled()
+        self._progress = fraction
+
+    def _run(self, target, args, kwargs) -> None:
+        try:
+            self._result = target(*args, progress = self._set_progress, **kwargs)
+            self._progress = 1.0
+        except Exception as e:
+            self._error = e
+        self._done = True
+
+
+def column_labels(channels, wavelengths = None) -> list:
+    if(wavelengths is None):
+        return ["time_s"] + [f"ch{c}" for c in channels]
+    return ["time_s"] + [f"{wavelengths[c]:g}nm" for c in channels]
+
+
+class CsvWriter:
+    """The CSV export, also written row by row by SpectroCapture. path may be an open text file, which is left open."""
+
+    def __init__(self, path, labels: list, total_rows: int, channels: numpy.ndarray, wavelengths):
+        self._owns_file: bool = isinstance(path, str)
+        self._file = open(path, 'w', newline = '') if self._owns_file else path
+        self._file.write(",".join(labels) + "\n")
+        self._row_format = "%.6f" + ",%.7g" * len(channels) + "\n"
+
+    def write(self, times_s: numpy.ndarray, spectra: numpy.ndarray) -> None:
+        # one % call formats the whole block, instead of a python level call per cell
+        table = numpy.empty((len(times_s), spectra.shape[1] + 1), dtype = numpy.float64)
+        table[:, 0] = times_s
+        table[:, 1:] = spectra
+        self._file.write((self._row_format * len(table)) % tuple(table.ravel().tolist()))
+
+    def close(self) -> None:
+        if(self._owns_file):
+            self._file.close()
+
+
+class _NpyWriter:
+    def __init__(self, path: str, labels: list, total_rows: int, channels: numpy.ndarray, wavelengths):
+        self._file = open(path, 'wb')
+        numpy.lib.format.write_array_header_1_0(self._file, {
+            'descr': numpy.lib.format.dtype_to_descr(numpy.dtype('<f8')),
+            'fortran_order': False,
+            'shape': (total_rows, len(channels) + 1),
+        })
+
+    def write(self, times_s: numpy.ndarray, spectra: numpy.ndarray) -> None:
+        table = numpy.empty((len(times_s), spectra.shape[1] + 1), dtype = '<f8')
+        table[:, 0] = times_s
+        table[:, 1:] = spectra
+        self._file.write(table.tobytes())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _NpzWriter:
+    def __init__(self, path: str, labels: list, total_rows: int, channels: numpy.ndarray, wavelengths):
+        self._zip = zipfile.ZipFile(path, 'w', allowZip64 = True)
+        self._times: list = list()
+        self._channels = channels
+        self._wavelengths = wavelengths
+        # the spectra are streamed into the archive, the (small) timestamps are written once at the end
+        self._spectra = self._zip.open("spectra.npy", 'w', force_zip64 = True)
+        numpy.lib.format.write_array_header_1_0(self._spectra, {
+            'descr': numpy.lib.format.dtype_to_descr(numpy.dtype('<f4')),
+            'fortran_order': False,
+            'shape': (total_rows, len(channels)),
+        })
+
+    def write(self, times_s: numpy.ndarray, spectra: numpy.ndarray) -> None:
+        self._times.append(numpy.array(times_s, dtype = '<f8'))
+        self._spectra.write(numpy.ascontiguousarray(spectra, dtype = '<f4').tobytes())
+
+    def close(self) -> None:
+        self._spectra.close()
+        arrays = {
+            "timestamps_s": numpy.concatenate(self._times) if self._times else numpy.zeros(0),
+            "channels": numpy.asarray(self._channels),
+        }
+        if(self._wavelengths is not None):
+            arrays["wavelengths"] = numpy.asarray(self._wavelengths)
+        for name, array in arrays.items():
+            with self._zip.open(name + ".npy", 'w') as f:
+                numpy.lib.format.write_array(f, array)
+        self._zip.close()
+
+_WRITERS = {
+    ".csv": CsvWriter,
+    ".npy": _NpyWriter,
+    ".npz": _NpzWriter,
+}
+
+@contextlib.contextmanager
+def _open_writer(path: str, total_rows: int, channels: numpy.ndarray, wavelengths):
+    extension = os.path.splitext(path)[1].lower()
+    if(extension not in _WRITERS):
+        raise ValueError(f"unsupported export format {extension}, use one of {', '.join(_WRITERS)}")
+    part_path = path + ".part"
+    writer = _WRITERS[extension](part_path, column_labels(channels, wavelengths), total_rows, channels, wavelengths)
+    try:
+        yield writer
+    except BaseException:
+        try:
+            writer.close()
+        finally:
+            os.remove(part_path)
+        raise
+    writer.close()
+    os.replace(part_path, path)
+
+def export_captures(path: str, timestamps_ns: numpy.ndarray, captures: numpy.ndarray, channels = None, wavelengths = None, progress = None) -> int:
+    """Export in-memory captures (rows) with their perf_counter_ns timestamps, times are written relative to the first capture."""
+    channels = numpy.arange(captures.shape[1]) if channels is None else numpy.asarray(channels, dtype = numpy.intp)
+    rows = len(captures)
+    t0 = timestamps_ns[0] if rows else 0
+    with _open_writer(path, rows, channels, wavelengths) as writer:
+        for start in range(0, rows, BLOCK_ROWS):
+            stop = min(rows, start + BLOCK_ROWS)
+            writer.write((timestamps_ns[start:stop] - t0) / 1e9, captures[start:stop][:, channels])
+            if(progress is not None):
+                progress(stop / rows)
+    return rows
+
+def export_recording(path: str, recording_path: str, channels = None, wavelengths = None, progress = None) -> int:
+    """Stream every capture of a recording file chunk by chunk, times are written relative to the start of the recording."""
+    with open(recording_path, 'rb') as f:
+        header = SpectroRecorder.read_header(f)
+        index = SpectroRecorder.read_index(f)
+        num_points = header["num_points"]
+        if(wavelengths is None):
+            # labelled with the calibration of the sensor that recorded it, channel numbers without one
+            calibration = SpectroRecorder.read_calibration(f)
+            wavelengths = calibration.wavelengths if calibration is not None else None
+        elif(len(wavelengths) != num_points):
+            raise ValueError(f"{len(wavelengths)} wavelengths for a recording of {num_points} points")
+        channels = numpy.arange(num_points) if channels is None else numpy.asarray(channels, dtype = numpy.intp)
+        rows = int(index['record_count'].sum())
+        with _open_writer(path, rows, channels, wavelengths) as writer:
+            written = 0
+            for entry in index:
+                records = SpectroRecorder.read_chunk(f, entry, num_points)
+                writer.write((records['timestamp_ns'] - header["start_counter_ns"]) / 1e9, records['spectrum'][:, channels])
+                written += len(records)
+                if(progress is not None):
+                    progress(written / rows)
+    return rows
@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+import numpy
+
+def savgol_coefficients(window_length: int, polyorder: int) -> numpy.ndarray:
+    """
+    Causal Savitzky-Golay weights.\n
+    Dotted with the last window_length samples (oldest first) they give the value of the least squares
+    polynomial fit at the newest sample, so every output only depends on samples that already arrived."""
+    if(window_length < 1 or not 0 <= polyorder < window_length):
+        raise ValueError("polyorder must be less than window_length")
+    x = numpy.arange(1 - window_length, 1, dtype = numpy.float64)
+    return numpy.linalg.pinv(numpy.vander(x, polyorder + 1, increasing = True))[0]
+
+
+class StreamingSavgol:
+    """
+    Causal Savitzky-Golay filter over a stream of samples, keeping the last history outputs in a ring.\n
+    extend() only filters the samples it is given, using the raw tail of the previous call for their windows.
+    Until window_length samples have arrived the outputs are the raw samples."""
+
+    def __init__(self, history: int, window_length: int = 11, polyorder: int = 3):
+        assert history > 0
+        self._history: int = history
+        # mirrored like the capture ring, so series is always one contiguous chronological view
+        self._ring = numpy.zeros(2 * history, dtype = numpy.float32)
+        self._ring_ro = self._ring.view()
+        self._ring_ro.flags.writeable = False
+        self._cursor: int = 0
+        self._coefficients = savgol_coefficients(window_length, polyorder)
+        self._window_length: int = window_length
+        self._polyorder: int = polyorder
+        self.reset()
+
+    @property
+    def history(self) -> int:
+        return self._history
+    @property
+    def window_length(self) -> int:
+        return self._window_length
+    @property
+    def polyorder(self) -> int:
+        return self._polyorder
+    @property
+    def coefficients(self) -> numpy.ndarray:
+        return self._coefficients
+    @property
+    def series(self) -> numpy.ndarray:
+        return self._ring_ro[self._cursor : self._cursor + self._history]
+
+    def configure(self, window_length: int, polyorder: int) -> bool:
+        """Switch to new filter parameters, returns True if they changed (the filter is then reset)."""
+        if(window_length == self._window_length and polyorder == self._polyorder):
+            return False
+        self._coefficients = savgol_coefficients(window_length, polyorder)
+        self._window_length = window_length
+        self._polyorder = polyorder
+        self.reset()
+        return True
+
+    def reset(self) -> None:
+        self._ring[:] = 0
+        self._cursor = 0
+        self._tail = numpy.zeros(0, dtype = numpy.float64)
+
+    def extend(self, samples) -> None:
+        samples = numpy.asarray(samples, dtype = numpy.float64)
+        count = len(samples)
+        if(count == 0):
+            return
+        # only the samples that end up in the ring and the windows behind them need filtering
+        keep = self._history + self._window_length - 1
+        if(count > keep):
+            self._tail = samples[-keep : -self._history]
+            samples = samples[-self._history:]
+            count = self._history
+
+        x = numpy.concatenate((self._tail, samples))
+        filtered = max(len(x) - self._window_length + 1, 0)
+        out = numpy.empty(count, dtype = numpy.float64)
+        out[: count - filtered] = samples[: count - filtered]
+        if(filtered):
+            out[count - filtered :] = numpy.lib.stride_tricks.sliding_window_view(x[-(filtered + self._window_length - 1):], self._window_length) @ self._coefficients
+        self._tail = x[max(len(x) - self._window_length + 1, 0):] if self._window_length > 1 else x[:0]
+
+        index = (self._cursor + numpy.arange(count)) % self._history
+        self._ring[index] = out
+        self._ring[index + self._history] = out
+        self._cursor = (self._cursor + count) % self._history
+
+
+class FilteredChannel:
+    """
+    Savitzky-Golay filtered copy of one channel series of a SpectroData or SpectroRecording, kept up to date
+    incrementally. Every update only pulls and filters the captures that arrived since the previous one, so the
+    cost per tick does not grow with the history."""
+
+    def __init__(self, window_length: int = 11, polyorder: int = 3):
+        self._window_length: int = window_length
+        self._polyorder: int = polyorder
+        self._filter: StreamingSavgol = None
+        self._source = None
+        self._key = None
+        self._taken: int = 0
+
+    @property
+    def window_length(self) -> int:
+        return self._window_length
+    @property
+    def polyorder(self) -> int:
+        return self._polyorder
+
+    def configure(self, window_length: int, polyorder: int) -> None:
+        savgol_coefficients(window_length, polyorder)       # validates before anything changes
+        self._window_length = window_length
+        self._polyorder = polyorder
+        if(self._filter is not None and self._filter.configure(window_length, polyorder)):
+            self._taken = 0
+
+    def reset(self) -> None:
+        self._filter = None
+        self._source = None
+
+    def update(self, spec_data, key, series, snapshot = None) -> numpy.ndarray:
+        """
+        Filtered series over the current capture history.\n
+        series maps a block of capture rows to the channel values, e.g. lambda rows: rows[:, 10]. key identifies
+        what series computes, a different key starts over from the whole history. Pass the snapshot of the whole
+        history the caller is drawing from to filter exactly up to it, so the result lines up with its timestamps."""
+        if(spec_data is not self._source or key != self._key or self._filter is None or self._filter.history != spec_data.max_captures):
+            self._filter = StreamingSavgol(spec_data.max_captures, self._window_length, self._polyorder)
+            self._source = spec_data
+            self._key = key
+            self._taken = 0
+
+        # only the captures since the last update, taken again if the writer wrapped onto them while they were read
+        while(True):
+            if(snapshot is None or not snapshot.valid):
+                snapshot = spec_data.snapshot()
+            # moved backwards (review) or fell behind by more than the history, the tail no longer connects
+            restart = snapshot.sequence < self._taken or snapshot.first > self._taken
+            rows = snapshot if restart else snapshot.since(self._taken)
+            values = numpy.array(series(rows.captures), dtype = numpy.float64) if len(rows) else None
+            if(snapshot.valid):
+                break
+            snapshot = None
+        if(restart):
+            self._filter.reset()
+        if(values is not None):
+            self._filter.extend(values)
+        self._taken = snapshot.sequence
+        return self._filter.series[self._filter.history - min(len(snapshot), self._filter.history):]
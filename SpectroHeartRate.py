@@ -0,0 +1,336 @@
+#!/usr/bin/python3
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+"""
+Streaming pulse rate estimation on the channel time series.
+
+Two estimators run side by side on a sliding time window of the selected channels, both updated per capture:
+
+    spectral    a sliding DFT evaluated only on the bins of the heart rate band. Captures are not evenly spaced,
+                so every sample adds x * exp(-2j pi f t) at its own timestamp and subtracts it again when it leaves
+                the window, which costs O(bins) per sample. The window mean is removed analytically, and the sums
+                are rebuilt from the stored terms once per window length so rounding errors cannot build up.
+                The strongest bin is checked against its sub-harmonics, as a sharp pulse puts much of its power
+                into the harmonics.
+    peak        a slope sum beat detector on the selected channels combined relative to their DC level, inverted
+                first as blood volume pulses show up as dips in the received light. Summing only the rises over a
+                short window ignores breathing and drift. A beat has to reach a fraction of a decaying envelope of
+                recent beats, which rejects the dicrotic notch, and is held off for a refractory period set by the
+                top of the band. This needs a fair signal to noise ratio, mark several channels for it.
+
+The engine runs on its own thread. Readings are published every publish_interval seconds, or after every capture
+when it is 0. Each reading carries its latency, measured from the receipt of the newest capture it includes.
+"""
+
+import time
+import math
+import queue
+import threading
+import collections
+import numpy
+
+class HeartRateReading:
+    """One published estimate, rates are in beats per minute and NaN while there is not enough data."""
+
+    def __init__(self, timestamp_ns: int, bpm: float, spectral_bpm: float, peak_bpm: float, confidence: float,
+                 channel_bpm: numpy.ndarray, samples: int, latency_ms: float):
+        self.timestamp_ns: int = timestamp_ns           # receipt time of the newest capture included
+        self.bpm: float = bpm                           # the spectral estimate, NaN when it is not confident enough
+        self.spectral_bpm: float = spectral_bpm
+        self.peak_bpm: float = peak_bpm
+        self.confidence: float = confidence             # share of the band power in the spectral peak and its harmonics, 0 to 1
+        self.channel_bpm: numpy.ndarray = channel_bpm   # spectral estimate of every selected channel
+        self.samples: int = samples
+        self.latency_ms: float = latency_ms
+
+    def __repr__(self) -> str:
+        return f"HeartRateReading(bpm={self.bpm:.1f}, spectral={self.spectral_bpm:.1f}, peak={self.peak_bpm:.1f}, confidence={self.confidence:.2f}, latency={self.latency_ms:.2f}ms)"
+
+
+class HeartRateEngine:
+    """
+    Consumes every capture of a SpectroData (or samples pushed with push()) and estimates the pulse rate.\n
+    channels are the spectrum columns to track, each gets its own window. Results go to the listeners and to latest."""
+
+    def __init__(self, spec_data = None, channels = (), window_s: float = 10.0, publish_interval: float = 1.0,
+                 min_bpm: float = 40.0, max_bpm: float = 200.0, resolution_bpm: float = 0.5,
+                 min_confidence: float = 0.1, queue_size: int = 256):
+        assert window_s > 0 and publish_interval >= 0 and 0 < min_bpm < max_bpm
+        self._spec_data = spec_data
+        self._window_ns: int = int(window_s * 1e9)
+        self._publish_interval: float = publish_interval
+        self._min_confidence: float = min_confidence
+        self._bpm_bins = numpy.arange(min_bpm, max_bpm + resolution_bpm / 2, resolution_bpm)
+        self._omega = 2 * numpy.pi * self._bpm_bins / 60        # rad/s
+        self._refractory_ns: int = int(60e9 / max_bpm)
+        self._min_span_ns: int = int(2 * 60e9 / min_bpm)         # two periods at the bottom of the band
+        self._slope_window_ns: int = 150_000_000
+        self._envelope_decay_s: float = 1.0
+        self._beat_threshold: float = 0.7                         # fraction of the recent beat slope sum
+        self._subharmonic_ratio: float = 0.3
+
+        self._columns = numpy.zeros(0, dtype = numpy.intp)
+        self._reset()
+
+        self._latest: HeartRateReading = None
+        self._listeners: list = list()
+        self._samples_dropped: int = 0
+        self._readings_published: int = 0
+        self._latency_max_ms: float = 0.0
+        self._update_ns_total: int = 0
+        self._updates: int = 0
+
+        self._pending_channels: numpy.ndarray = None
+        self._channels_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._queue = queue.Queue(maxsize = queue_size)
+        self._thread = threading.Thread(target = self._worker)
+        self._thread.daemon = True
+        self._thread.start()
+
+        self.channels = channels
+        if(spec_data is not None):
+            spec_data.add_capture_listener(self._on_capture)
+
+    @property
+    def channels(self) -> numpy.ndarray:
+        pending = self._pending_channels
+        return pending if pending is not None else self._columns
+    @channels.setter
+    def channels(self, channels) -> None:
+        # picked up by the engine thread before its next sample, never waits on a full queue
+        columns = numpy.array(sorted(set(int(c) for c in channels)), dtype = numpy.intp)
+        with self._channels_lock:
+            self._pending_channels = columns
+    @property
+    def latest(self) -> HeartRateReading:
+        return self._latest
+    @property
+    def publish_interval(self) -> float:
+        return self._publish_interval
+    @publish_interval.setter
+    def publish_interval(self, val: float) -> None:
+        assert val >= 0
+        self._publish_interval = val
+    @property
+    def samples_dropped(self) -> int:
+        return self._samples_dropped
+    @property
+    def readings_published(self) -> int:
+        return self._readings_published
+    @property
+    def latency_max_ms(self) -> float:
+        return self._latency_max_ms
+    @property
+    def update_us(self) -> float:
+        """Average cost of folding one capture into the estimators."""
+        return self._update_ns_total / self._updates / 1000 if self._updates else 0.0
+
+    def add_listener(self, listener) -> None:
+        # copied on write like the capture listeners, called from the engine thread with each HeartRateReading
+        self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener) -> None:
+        self._listeners = [l for l in self._listeners if l != listener]
+
+    def push(self, timestamp_ns: int, spectrum) -> bool:
+        """Queue one capture (a full spectrum row), returns False if it was dropped because the engine is behind."""
+        try:
+            self._queue.put_nowait((timestamp_ns, spectrum))
+        except queue.Full:
+            self._samples_dropped += 1
+            return False
+        return True
+
+    def close(self) -> None:
+        if(self._spec_data is not None):
+            self._spec_data.remove_capture_listener(self._on_capture)
+            self._spec_data = None
+        self._stop.set()
+        try:
+            self._queue.put_nowait(None)        # wakes the engine thread, a full queue keeps it awake anyway
+        except queue.Full:
+            pass
+        self._thread.join(timeout = 2.0)
+
+    def _on_capture(self, timestamp_ns: int, info) -> None:
+        self.push(timestamp_ns, info.SpectrumArray)
+
+    def _reset(self) -> None:
+        channel_count = len(self._columns)
+        self._t0_ns: int = None
+        self._window = collections.deque()                  # (timestamp_ns, values, phasors) per sample in the window
+        self._dft = numpy.zeros((channel_count, len(self._omega)), dtype = numpy.complex128)
+        self._dft_ones = numpy.zeros(len(self._omega), dtype = numpy.complex128)   # DFT of the window's sample pattern, for mean removal
+        self._sum = numpy.zeros(channel_count)
+        self._since_rebuild: int = 0
+
+        self._peak_last_x: float = None
+        self._peak_last_sample_ns: int = 0
+        self._peak_rises = collections.deque()              # (timestamp_ns, rise) inside the slope sum window
+        self._peak_envelope: float = 0.0
+        self._peak_prev: tuple = (0.0, 0.0)
+        self._peak_last_ns: int = 0
+        self._peak_intervals = collections.deque()          # (timestamp_ns, interval_ns) of the beats in the window
+
+    def _worker(self) -> None:
+        next_publish = time.monotonic() + self._publish_interval
+        newest_ns = None
+        while(not self._stop.is_set()):
+            try:
+                item = self._queue.get(timeout = max(next_publish - time.monotonic(), 0.0))
+            except queue.Empty:
+                item = False
+            if(item is None):
+                break
+            try:
+                if(self._pending_channels is not None):
+                    with self._channels_lock:
+                        self._columns, self._pending_channels = self._pending_channels, None
+                    self._reset()
+                    newest_ns = None
+                if(item):
+                    start = time.perf_counter_ns()
+                    self._update(item[0], numpy.asarray(item[1], dtype = numpy.float64)[self._columns])
+                    self._update_ns_total += time.perf_counter_ns() - start
+                    self._updates += 1
+                    newest_ns = item[0]
+            except Exception as e:
+                # a bad sample or listener costs that sample, the engine keeps running
+                print(e)
+
+            now = time.monotonic()
+            if(newest_ns is not None and (self._publish_interval == 0 or now >= next_publish)):
+                try:
+                    self._publish(newest_ns)
+                except Exception as e:
+                    print(e)
+                newest_ns = None
+            if(now >= next_publish):
+                next_publish = now + self._publish_interval
+
+    def _update(self, timestamp_ns: int, values: numpy.ndarray) -> None:
+        if(len(values) == 0):
+            return
+        if(self._t0_ns is None):
+            self._t0_ns = timestamp_ns
+        self._update_spectral(timestamp_ns, values)
+        self._update_peaks(timestamp_ns, values)
+
+    def _update_spectral(self, timestamp_ns: int, values: numpy.ndarray) -> None:
+        t = (timestamp_ns - self._t0_ns) / 1e9
+        phasors = numpy.exp(-1j * self._omega * t)
+        self._window.append((timestamp_ns, values, phasors))
+        self._dft += values[:, None] * phasors
+        self._dft_ones += phasors
+        self._sum += values
+        while(self._window[0][0] <= timestamp_ns - self._window_ns):
+            _, old_values, old_phasors = self._window.popleft()
+            self._dft -= old_values[:, None] * old_phasors
+            self._dft_ones -= old_phasors
+            self._sum -= old_values
+
+        self._since_rebuild += 1
+        if(self._since_rebuild >= max(len(self._window), 64)):
+            values = numpy.array([w[1] for w in self._window])
+            phasors = numpy.array([w[2] for w in self._window])
+            self._dft = values.T @ phasors
+            self._dft_ones = phasors.sum(axis = 0)
+            self._sum = values.sum(axis = 0)
+            self._since_rebuild = 0
+
+    def _update_peaks(self, timestamp_ns: int, values: numpy.ndarray) -> None:
+        # channels are combined relative to their window mean, so each one contributes its pulsatile fraction
+        dc = self._sum / len(self._window)
+        x = -float(numpy.mean(values / numpy.where(dc != 0, dc, 1)))
+        if(self._peak_last_x is None):
+            self._peak_last_x, self._peak_last_sample_ns = x, timestamp_ns
+            return
+        dt = (timestamp_ns - self._peak_last_sample_ns) / 1e9
+        self._peak_rises.append((timestamp_ns, max(x - self._peak_last_x, 0.0)))
+        self._peak_last_x, self._peak_last_sample_ns = x, timestamp_ns
+        while(self._peak_rises[0][0] <= timestamp_ns - self._slope_window_ns):
+            self._peak_rises.popleft()
+        slope = sum(rise for _, rise in self._peak_rises)
+        self._peak_envelope = max(self._peak_envelope * math.exp(-dt / self._envelope_decay_s), slope)
+
+        # the previous sample is a beat if it is a local maximum above the threshold and out of the refractory period
+        prev2, prev1 = self._peak_prev
+        if(prev1 > prev2 and prev1 >= slope and prev1 > self._beat_threshold * self._peak_envelope
+           and timestamp_ns - self._peak_last_ns > self._refractory_ns):
+            if(self._peak_last_ns):
+                self._peak_intervals.append((timestamp_ns, timestamp_ns - self._peak_last_ns))
+            self._peak_last_ns = timestamp_ns
+        self._peak_prev = (prev1, slope)
+        while(self._peak_intervals and self._peak_intervals[0][0] <= timestamp_ns - self._window_ns):
+            self._peak_intervals.popleft()
+
+    def _estimate(self):
+        nan = float('nan')
+        channel_count = len(self._columns)
+        if(len(self._window) < 2 or self._window[-1][0] - self._window[0][0] < self._min_span_ns):
+            return nan, nan, 0.0, numpy.full(channel_count, nan)
+
+        mean = self._sum / len(self._window)
+        power = numpy.abs(self._dft - mean[:, None] * self._dft_ones) ** 2
+        channel_bpm = self._bpm_bins[numpy.argmax(power, axis = 1)]
+
+        # channels are combined on their normalized spectra so one strong channel does not drown the rest
+        totals = power.sum(axis = 1, keepdims = True)
+        combined = (power / numpy.where(totals > 0, totals, 1)).sum(axis = 0)
+        peak = int(numpy.argmax(combined))
+        for divisor in (3, 2):
+            sub = int(numpy.argmin(numpy.abs(self._bpm_bins - self._bpm_bins[peak] / divisor)))
+            sub_peak = max(sub - 1, 0) + int(numpy.argmax(combined[max(sub - 1, 0) : sub + 2]))
+            if(self._bpm_bins[peak] / divisor >= self._bpm_bins[0] and combined[sub_peak] >= self._subharmonic_ratio * combined[peak]):
+                peak = sub_peak
+                break
+        bpm = float(self._bpm_bins[peak])
+        if(0 < peak < len(combined) - 1):
+            a, b, c = combined[peak - 1 : peak + 2]
+            denom = a - 2 * b + c
+            if(denom != 0):
+                bpm += 0.5 * (a - c) / denom * (self._bpm_bins[1] - self._bpm_bins[0])
+        # confidence counts the power around the fundamental and its harmonics inside the band
+        near = numpy.zeros(len(combined), dtype = bool)
+        for harmonic in range(1, 4):
+            centre = int(numpy.argmin(numpy.abs(self._bpm_bins - self._bpm_bins[peak] * harmonic)))
+            if(self._bpm_bins[peak] * harmonic <= self._bpm_bins[-1]):
+                near[max(centre - 2, 0) : centre + 3] = True
+        confidence = float(combined[near].sum() / combined.sum()) if combined.sum() > 0 else 0.0
+
+        intervals = [i for _, i in self._peak_intervals]
+        peak_bpm = 60e9 / float(numpy.median(intervals)) if intervals else nan
+        return bpm, peak_bpm, confidence, channel_bpm
+
+    def _publish(self, newest_ns: int) -> None:
+        spectral_bpm, peak_bpm, confidence, channel_bpm = self._estimate()
+        bpm = spectral_bpm if confidence >= self._min_confidence else float('nan')
+        latency_ms = (time.perf_counter_ns() - newest_ns) / 1e6
+        reading = HeartRateReading(newest_ns, bpm, spectral_bpm, peak_bpm, confidence, channel_bpm, len(self._window), latency_ms)
+        self._latest = reading
+        self._readings_published += 1
+        if(latency_ms > self._latency_max_ms):
+            self._latency_max_ms = latency_ms
+        for listener in self._listeners:
+            try:
+                listener(reading)
+            except Exception as e:
+                print(e)
@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+"""
+Latency of every stage of the capture path, in fixed memory histograms.
+
+Every acquisition is stamped with perf_counter_ns at each stage:
+
+    queued      AcqSpectrum handed to the NSP32 driver
+    written     the command bytes were written to the port
+    first_byte  the read holding the start of the spectrum packet returned (firmware integration ends)
+    complete    the whole spectrum packet was framed
+    decoded     the spectrum was unpacked
+    stored      the capture is in the history ring
+    rendered    the GUI handed it to the plot (setData), the paint itself follows in the Qt event loop
+
+so written to first_byte is the sensor, first_byte to complete the serial link and everything else the host.
+"""
+
+import json
+import math
+import time
+import threading
+import numpy
+
+STAGES = ("queued", "written", "first_byte", "complete", "decoded", "stored", "rendered")
+
+
+class LatencyHistogram:
+    """Log spaced histogram of durations from 100 ns to 100 s, about 12% wide bins (20 per decade), its memory never grows."""
+
+    MIN_NS = 100
+    DECADES = 9
+    BINS_PER_DECADE = 20
+
+    def __init__(self):
+        self._counts = numpy.zeros(self.DECADES * self.BINS_PER_DECADE + 2, dtype = numpy.int64)     # plus under and overflow
+        self._count: int = 0
+        self._total_ns: int = 0
+        self._min_ns: int = 0
+        self._max_ns: int = 0
+
+    @property
+    def count(self) -> int:
+        return self._count
+    @property
+    def mean_ns(self) -> float:
+        return self._total_ns / self._count if self._count else 0.0
+    @property
+    def min_ns(self) -> int:
+        return self._min_ns
+    @property
+    def max_ns(self) -> int:
+        return self._max_ns
+
+    def record(self, duration_ns: int) -> None:
+        if(duration_ns < self.MIN_NS):
+            index = 0
+        else:
+            index = min(int(math.log10(duration_ns / self.MIN_NS) * self.BINS_PER_DECADE) + 1, len(self._counts) - 1)
+        self._counts[index] += 1
+        if(self._count == 0 or duration_ns < self._min_ns):
+            self._min_ns = duration_ns
+        if(duration_ns > self._max_ns):
+            self._max_ns = duration_ns
+        self._count += 1
+        self._total_ns += duration_ns
+
+    def percentile(self, q: float) -> float:
+        """Approximate q-th percentile in ns (the geometric centre of its bin, clamped to the observed range)."""
+        if(self._count == 0):
+            return 0.0
+        index = int(numpy.searchsorted(numpy.cumsum(self._counts), math.ceil(q / 100 * self._count)))
+        if(index == 0):
+            value = self._min_ns
+        elif(index == len(self._counts) - 1):
+            value = self._max_ns
+        else:
+            value = self.MIN_NS * 10 ** ((index - 0.5) / self.BINS_PER_DECADE)
+        return float(min(max(value, self._min_ns), self._max_ns))
+
+    def reset(self) -> None:
+        self._counts[:] = 0
+        self._count = 0
+        self._total_ns = 0
+        self._min_ns = 0
+        self._max_ns = 0
+
+    def summary(self) -> dict:
+        return {
+            "count": self._count,
+            "mean_ms": self.mean_ns / 1e6,
+            "min_ms": self._min_ns / 1e6,
+            "p50_ms": self.percentile(50) / 1e6,
+            "p95_ms": self.percentile(95) / 1e6,
+            "p99_ms": self.percentile(99) / 1e6,
+            "max_ms": self._max_ns / 1e6,
+        }
+
+
+class LatencyTracker:
+    """
+    Per stage latency of the capture path.\n
+    The acquisition path calls stamp() with the stage timestamps of each capture, the GUI calls rendered() with
+    the sequence number of what it just passed to setData. Each stage gets a histogram of the time since the stage before it,
+    plus "total" from queued to stored and "capture_period" between stored captures."""
+
+    HISTOGRAMS = tuple(f"{a}-{b}" for a, b in zip(STAGES, STAGES[1:])) + ("total", "capture_period")
+
+    def __init__(self, stored_history: int = 256):
+        self._histograms: dict = {name: LatencyHistogram() for name in self.HISTOGRAMS}
+        # stored time of the latest captures by sequence number, for the render stage
+        self._stored_ns = numpy.zeros(stored_history, dtype = numpy.int64)
+        self._stored_sequence = numpy.full(stored_history, -1, dtype = numpy.int64)
+        self._last_stored_ns: int = 0
+        self._last_rendered: int = -1
+        self._lock = threading.Lock()
+
+    @property
+    def histograms(self) -> dict:
+        return self._histograms
+
+    def stamp(self, sequence: int, stamps: list) -> None:
+        """stamps are the perf_counter_ns times of the stages up to stored, 0 where a stage was not seen."""
+        with self._lock:
+            for i in range(len(stamps) - 1):
+                if(stamps[i] and stamps[i + 1]):
+                    self._histograms[f"{STAGES[i]}-{STAGES[i + 1]}"].record(stamps[i + 1] - stamps[i])
+            stored = stamps[-1]
+            if(stamps[0] and stored):
+                self._histograms["total"].record(stored - stamps[0])
+            if(self._last_stored_ns and stored):
+                self._histograms["capture_period"].record(stored - self._last_stored_ns)
+            self._last_stored_ns = stored
+            slot = sequence % len(self._stored_ns)
+            self._stored_ns[slot] = stored
+            self._stored_sequence[slot] = sequence
+
+    def rendered(self, sequence: int, rendered_ns: int = None) -> None:
+        """The capture with this sequence number was just handed to the plot, each capture is only counted the first time."""
+        rendered_ns = time.perf_counter_ns() if rendered_ns is None else rendered_ns
+        with self._lock:
+            slot = sequence % len(self._stored_ns)
+            if(sequence > self._last_rendered and self._stored_sequence[slot] == sequence):
+                self._histograms["stored-rendered"].record(rendered_ns - int(self._stored_ns[slot]))
+                self._last_rendered = sequence
+
+    def reset(self) -> None:
+        with self._lock:
+            for histogram in self._histograms.values():
+                histogram.reset()
+            self._last_stored_ns = 0
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {name: histogram.summary() for name, histogram in self._histograms.items()}
+
+    def dump(self, path: str = None) -> str:
+        """The summary as JSON, also written to path if one is given."""
+        report = json.dumps({"time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "stages": self.summary()}, indent = 2)
+        if(path):
+            with open(path, 'w') as f:
+                f.write(report + "\n")
+        return report
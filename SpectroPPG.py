@@ -18,42 +18,113 @@
 #  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 #  MA 02110-1301, USA.
 
-import csv
+# first, so the startup profile (SPECTROPPG_STARTUP_PROFILE, see SpectroProfile) covers every import after it
+from SpectroProfile import startup
 import sys
 import time
-import statistics as stat
 import math
-import xlwt
 import numpy
+startup.lap("import numpy")
 import serial
 import serial.tools.list_ports
-import threading
-import pyqtgraph as pg
-from scipy.signal import savgol_filter
+startup.lap("import serial")
 from PyQt5 import QtWidgets, QtCore, QtWidgets, QtGui
+startup.lap("import PyQt5")
+import pyqtgraph as pg
+startup.lap("import pyqtgraph")
 
 
-# manual includes to fix occasional compile problem
-try:
-    from pyqtgraph.graphicsItems.ViewBox.axisCtrlTemplate_pyqt5 import *
-    from pyqtgraph.graphicsItems.PlotItem.plotConfigTemplate_pyqt5 import *
-    from pyqtgraph.imageview.ImageViewTemplate_pyqt5 import *
-    from pyqtgraph.console.template_pyqt5 import *
-except:
-    pass
+def _pyinstaller_hidden_imports():
+    # manual includes to fix occasional compile problem: PyInstaller bundles whatever is imported anywhere in
+    # the code, so listing the templates in a function that never runs is enough and costs nothing at startup.
+    # pyqtgraph generates these from .ui files and loads them by name, which PyInstaller can not follow.
+    import pyqtgraph.graphicsItems.ViewBox.axisCtrlTemplate_generic
+    import pyqtgraph.graphicsItems.PlotItem.plotConfigTemplate_generic
+    import pyqtgraph.imageview.ImageViewTemplate_generic
 
 
 from test_ui import Ui_MainWindow
 from SpectroData import SpectroData
+from SpectroFilter import FilteredChannel
+from SpectroLatency import LatencyTracker
+startup.lap("import SpectroPPG modules")
+# recordings, the heart rate engine and exports are imported when first used
+
+class LatencyDialog(QtWidgets.QDialog):
+    """Live table of the capture path latency percentiles, refreshed every second."""
+
+    COLUMNS = ("count", "p50_ms", "p95_ms", "p99_ms", "max_ms")
+
+    def __init__(self, window, *args, **kwargs):
+        super(LatencyDialog, self).__init__(window, *args, **kwargs)
+        self._window = window
+        self.setWindowTitle("Capture Latency")
+        self.resize(560, 330)
+        self.table = QtWidgets.QTableWidget(len(LatencyTracker.HISTOGRAMS), len(self.COLUMNS), self)
+        self.table.setVerticalHeaderLabels(LatencyTracker.HISTOGRAMS)
+        self.table.setHorizontalHeaderLabels(["Count", "p50 (ms)", "p95 (ms)", "p99 (ms)", "Max (ms)"])
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.button_reset = QtWidgets.QPushButton("Reset", self)
+        self.button_save = QtWidgets.QPushButton("Save JSON...", self)
+        buttons = QtWidgets.QHBoxLayout()
+        buttons.addStretch()
+        buttons.addWidget(self.button_reset)
+        buttons.addWidget(self.button_save)
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.addWidget(self.table)
+        layout.addLayout(buttons)
+        self.button_reset.clicked.connect(self.reset)
+        self.button_save.clicked.connect(self.save)
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(1000)
+        self.refresh()
+
+    def tracker(self) -> LatencyTracker:
+        spec_data = self._window._spec_data
+        return spec_data.latency if isinstance(spec_data, SpectroData) else None
+
+    def refresh(self):
+        tracker = self.tracker()
+        summary = tracker.summary() if tracker is not None else dict()
+        for row, name in enumerate(LatencyTracker.HISTOGRAMS):
+            stage = summary.get(name)
+            for column, key in enumerate(self.COLUMNS):
+                text = "" if stage is None else (str(stage[key]) if key == "count" else f"{stage[key]:.3f}")
+                self.table.setItem(row, column, QtWidgets.QTableWidgetItem(text))
+
+    def reset(self):
+        if(self.tracker() is not None):
+            self.tracker().reset()
+            self.refresh()
+
+    def save(self):
+        if(self.tracker() is None):
+            return
+        default_filename = str(time.time()).split('.', maxsplit=1)[0] + '_latency.json'
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Save Latency", default_filename, "JSON (*.json)")
+        if(path):
+            self.tracker().dump(path)
+
 
 class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
     def __init__(self, *args, **kwargs):
         super(MainWindow, self).__init__(*args, **kwargs)
-        self.setupUi(self)
+        startup.lap("QMainWindow")
+        with startup.phase("setupUi"):
+            self.setupUi(self)
         self.setWindowTitle(f"SpectroPPG - ALPHA")
 
         self._spec_data: SpectroData = None
+        self._recording: "SpectroRecording" = None        # set while reviewing a recording, it is then also _spec_data
+        self._heart_rate: "HeartRateEngine" = None
+        self._heart_rate_channels: list = list()
+        self._calibration: "Calibration" = None              # wavelengths of the sensor, the graphs use nm once known
+        self._latency_dialog: LatencyDialog = None
+        self._savgol = FilteredChannel(self.spinbox_fw_length.value(), self.spinbox_filter_po.value())
         self._running: bool = False
+        self._export_jobs: list = list()
+        self.export_filter = "CSV (*.csv);;NumPy archive (*.npz);;NumPy array (*.npy)"
 
         # graph properties
         self.graph.disableAutoRange()
@@ -65,6 +136,21 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.grey_pen = pg.mkPen({'color': "#DDD", 'width': 1})
         self.graph_padding_factor = 0.667
 
+        # plot items are created once and updated in place every tick
+        self._x_axis_cache: dict = dict()
+        self.spectrum_curve = self.graph.plot(pen = self.green_pen, skipFiniteCheck = True)
+        self.track_line = pg.InfiniteLine(pos = self.channel_slider.value(), pen = self.red_pen, angle = 90, movable = False)
+        self.graph.addItem(self.track_line)
+        self.mca_lines: dict = dict()
+        self.mca_weights: dict = dict()          # per channel weights for the weighted mean combiner, 1.0 unless set
+        self._mca_columns = numpy.zeros(0, dtype = numpy.intp)
+        self._mca_vector = None
+        self.channel_curve = self.graph_2.plot(pen = self.green_pen, skipFiniteCheck = True)
+        self.avg_track_line = pg.InfiniteLine(pen = self.red_pen, angle = 0, movable = False)
+        self.avg_track_line.setVisible(False)
+        self.graph_2.addItem(self.avg_track_line)
+        startup.lap("graphs")
+
         # graph timer
         self.graph_timer = QtCore.QTimer()
         self.graph_timer.timeout.connect(self.update_graph)
@@ -79,92 +165,293 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
 
         # ui handlers
         self.channel_slider.valueChanged.connect(self.update_channel_ui)
+        self.spinbox_wavelength.valueChanged.connect(self.wavelength_selected)
         self.button_refresh.clicked.connect(self.ser_com_refresh)
         self.button_connect.clicked.connect(self.serial_connect)
+        self.button_open_recording.clicked.connect(self.review_toggle)
+        self.button_latency.clicked.connect(self.show_latency)
+        self.slider_review.valueChanged.connect(self.review_seek)
         self.button_startstop.clicked.connect(self.startstop)
         self.button_update_sensor.clicked.connect(self.update_sensor)
         self.button_export_channel.clicked.connect(self.export_channel_csv)
         self.button_export_all.clicked.connect(self.export_all_csv)
+        self.button_export_recording.clicked.connect(self.export_recording_file)
+        self.button_record.toggled.connect(self.record_toggle)
         self.button_mca_mark.clicked.connect(self.mca_mark_channel)
         self.button_mca_clear.clicked.connect(self.mca_clear_channel)
+        self.list_mca.currentRowChanged.connect(self.mca_selection_changed)
+        self.spinbox_mca_weight.valueChanged.connect(self.mca_weight_changed)
+        self.checkbox_enable_mca.toggled.connect(self.mca_channels_changed)
+        self.checkBox_savgol_enable.toggled.connect(self.savgol_changed)
+        self.checkbox_time_axis.toggled.connect(self.time_axis_changed)
+        self.spinbox_fw_length.valueChanged.connect(self.savgol_changed)
+        self.spinbox_filter_po.valueChanged.connect(self.savgol_changed)
+        self.combo_mca_combiner.currentIndexChanged.connect(self.mca_channels_changed)
+        self.list_mca.model().rowsInserted.connect(self.mca_channels_changed)
+        self.list_mca.model().rowsRemoved.connect(self.mca_channels_changed)
+        startup.lap("timers and handlers")
 
         self.ser_com_refresh()
+        startup.lap("serial port scan")
+        self.mca_channels_changed()
+        startup.lap("channel state")
+
+    def x_axis(self, length: int) -> numpy.ndarray:
+        x = self._x_axis_cache.get(length)
+        if(x is None):
+            x = numpy.arange(length)
+            self._x_axis_cache[length] = x
+        return x
+
+    def channel_x_axis(self, snapshot, length: int) -> numpy.ndarray:
+        """x values for the last length captures of snapshot, capture index or seconds before the newest capture."""
+        if(self.checkbox_time_axis.isChecked()):
+            return snapshot.times_s[max(len(snapshot) - length, 0):]
+        return self.x_axis(length)
+
+    def channel_position(self, channel: int) -> float:
+        """x position of a channel on the spectrum graph, its wavelength once the calibration is known."""
+        if(self._calibration is not None and 0 <= channel < self._calibration.num_points):
+            return float(self._calibration.wavelengths_nm[channel])
+        return channel
+
+    def calibration_changed(self, calibration):
+        self._calibration = calibration
+        self.graph.setLabel('bottom', "Wavelength (nm)" if calibration is not None else None)
+        for chan, line in self.mca_lines.items():
+            line.setValue(self.channel_position(chan))
+        for row in range(self.list_mca.count()):
+            item = self.list_mca.item(row)
+            item.setText(self.mca_item_text(self.mca_item_channel(item)))
+        self.spinbox_wavelength.setEnabled(calibration is not None)
+        self.update_channel_ui()
 
     def update_graph(self):
-        self.graph.clear()
-        capture = self._spec_data.captures[self._spec_data.capture_index - 1]
-        self.graph.plot(numpy.arange(len(capture)), capture, pen = self.green_pen, skipFiniteCheck = True)
-        self.graph.enableAutoRange()
-        self.graph.disableAutoRange()
-        track_line = pg.InfiniteLine(pos = self.channel_slider.value(), pen = self.red_pen, angle = 90, movable = False)
-        self.graph.addItem(track_line)
-
+        # the calibration arrives shortly after connecting, or is cleared for a source without one
+        if(self._spec_data.calibration is not self._calibration):
+            self.calibration_changed(self._spec_data.calibration)
+        # plot a copy of the row, taken again if the ring wrapped onto it while copying
+        while(True):
+            latest = self._spec_data.snapshot(1)
+            if(len(latest) == 0):
+                return
+            capture = latest.captures[-1].copy()
+            if(latest.valid):
+                break
+        if(self._calibration is not None and self._calibration.num_points == len(capture)):
+            x = self._calibration.wavelengths_nm
+        else:
+            x = self.x_axis(len(capture))
+        self.spectrum_curve.setData(x, capture)
+        self.graph.setRange(xRange = (x[0], x[-1]), yRange = (float(capture.min()), float(capture.max())))
+        self.track_line.setValue(self.channel_position(self.channel_slider.value()))
+        if(self._recording is None):
+            self._spec_data.latency.rendered(latest.sequence - 1)
+
+    def mca_item_text(self, channel: int) -> str:
+        text = str(channel)
+        if(self._calibration is not None and 0 <= channel < self._calibration.num_points):
+            text += f"  ({self._calibration.wavelength_of(channel)} nm)"
+        weight = self.mca_weights.get(channel, 1.0)
+        if(weight != 1.0):
+            text += f"  x{weight:g}"
+        return text
+
+    def mca_item_channel(self, item) -> int:
+        return int(item.text().split()[0])
+
+    def mca_channels_changed(self, *args):
+        marked_channels = set(self.mca_item_channel(self.list_mca.item(x)) for x in range(self.list_mca.count()))
+        for chan in list(self.mca_lines):
+            if(chan not in marked_channels):
+                self.graph.removeItem(self.mca_lines.pop(chan))
+                self.mca_weights.pop(chan, None)
+        for chan in marked_channels:
+            if(chan not in self.mca_lines):
+                self.mca_lines[chan] = pg.InfiniteLine(pos = self.channel_position(chan), pen = self.grey_pen, angle = 90, movable = False)
+                self.graph.addItem(self.mca_lines[chan])
+        for line in self.mca_lines.values():
+            line.setVisible(self.checkbox_enable_mca.isChecked())
+
+        # column indices for the combined channel, the weight vector is rebuilt on the next tick
+        self._mca_columns = numpy.array(sorted(marked_channels), dtype = numpy.intp)
+        self._mca_vector = None
+        self.heart_rate_channels_changed()
+        self.review_refresh()
+
+    def set_mca_weight(self, channel: int, weight: float) -> None:
+        """Weight of a marked channel in the weighted mean combiner."""
+        self.mca_weights[channel] = float(weight)
+        for row in range(self.list_mca.count()):
+            item = self.list_mca.item(row)
+            if(self.mca_item_channel(item) == channel):
+                item.setText(self.mca_item_text(channel))
+        self._mca_vector = None
+        self.review_refresh()
+
+    def mca_selection_changed(self, row: int):
+        if(row >= 0):
+            self.spinbox_mca_weight.blockSignals(True)
+            self.spinbox_mca_weight.setValue(self.mca_weights.get(self.mca_item_channel(self.list_mca.item(row)), 1.0))
+            self.spinbox_mca_weight.blockSignals(False)
+
+    def mca_weight_changed(self, weight: float):
+        item = self.list_mca.currentItem()
+        if(item is not None):
+            self.set_mca_weight(self.mca_item_channel(item), weight)
+
+    def savgol_changed(self, *args):
+        # the polynomial has to stay below the window length
+        self.spinbox_filter_po.setMaximum(self.spinbox_fw_length.value() - 1)
+        self._savgol.configure(self.spinbox_fw_length.value(), self.spinbox_filter_po.value())
+        self.review_refresh()
+
+    def time_axis_changed(self, *args):
+        self.graph_2.setLabel('bottom', "Time (s)" if self.checkbox_time_axis.isChecked() else None)
+        self.review_refresh()
+
+    def mca_combiner(self) -> str:
+        return ("mean", "weighted", "median")[self.combo_mca_combiner.currentIndex()]
+
+    def channel_series(self, snapshot):
+        """x and y of the channel graph from snapshot, y is never a view into the capture ring."""
         if(self.checkbox_enable_mca.isChecked()):
-            marked_channels = [int(self.list_mca.item(x).text()) for x in range(self.list_mca.count())]
-            if(len(marked_channels)):
-                for i in marked_channels:
-                    mark_line = pg.InfiniteLine(pos = i, pen = self.grey_pen, angle = 90, movable = False)
-                    self.graph.addItem(mark_line)
+            combiner = self.mca_combiner()
+            if(self._mca_vector is None and combiner != "median"):
+                weights = [self.mca_weights.get(chan, 1.0) for chan in self._mca_columns] if combiner == "weighted" else None
+                self._mca_vector = self._spec_data.channel_weights(self._mca_columns, weights)
+            if(self.checkBox_savgol_enable.isChecked()):
+                columns, vector = self._mca_columns, self._mca_vector
+                # new weights restart the filter like new columns do
+                key = ("mca", tuple(columns), combiner, None if vector is None else tuple(vector.tolist()))
+                channel = self._savgol.update(self._spec_data, key,
+                                              lambda rows: self._spec_data.combine_rows(rows, columns, combiner, vector), snapshot)
+            else:
+                channel = self._spec_data.combine_rows(snapshot.captures, self._mca_columns, combiner, self._mca_vector)
+        else:
+            index = self.channel_slider.value()
+            if(self.checkBox_savgol_enable.isChecked()):
+                channel = self._savgol.update(self._spec_data, ("channel", index), lambda rows: rows[:, index], snapshot)
+            else:
+                channel = snapshot.captures[:, index].copy()
+        x = self.channel_x_axis(snapshot, len(channel))
+        return x, channel[len(channel) - len(x):]
 
     def channel_graph_update(self):
-        self.graph_2.clear()
+        # one snapshot per tick, taken again if the ring wrapped onto it before the series were copied out
         channel = list()
-        if(self.checkbox_enable_mca.isChecked()):
-            try: 
-                marked_channels = [int(self.list_mca.item(x).text()) for x in range(self.list_mca.count())]
-                output_array = numpy.array([0 for i in range(self._spec_data.max_captures)])
-
-                # begin a per-element merge of the marked channels
-                for chan in marked_channels:
-                    output_array = output_array + numpy.array(self._spec_data.channel_graph(chan))
-                channel = output_array / len(marked_channels)
-
-                # plot averaged graph
-                self.graph_2.plot(numpy.arange(len(channel)), channel, pen = self.green_pen, skipFiniteCheck = True)
-            except Exception as e:
-                print(e)
+        x = list()
+        self.avg_track_line.setVisible(False)
+        try:
+            while(True):
+                snapshot = self._spec_data.snapshot()
+                if(len(snapshot) == 0):
+                    return
+                x, channel = self.channel_series(snapshot)
+                if(snapshot.valid):
+                    break
+            self.channel_curve.setData(x, channel)
+        except Exception as e:
+            print(e)
+            channel = list()
+            x = list()
+        if(len(channel) and not self.checkbox_enable_mca.isChecked() and self.checkbox_show_average.isChecked()):
+            _avg = float(channel.mean())
+            self.lcd_channel_average.display(_avg)
+            self.avg_track_line.setValue(_avg)
+            self.avg_track_line.setVisible(True)
 
-        else:
-            if(self.checkBox_savgol_enable.isChecked()):
-                pass
-            else:
-                try:
-                    channel = self._spec_data.channel_graph(self.channel_slider.value())
-                    self.graph_2.plot(numpy.arange(len(channel)), channel, pen = self.green_pen, skipFiniteCheck = True)
-                    if(self.checkbox_show_average.isChecked()):
-                        _avg = stat.mean(channel)
-                        self.lcd_channel_average.display(_avg)
-                        avg_track_line = pg.InfiniteLine(pos = _avg, pen = self.red_pen, angle = 0, movable = False)
-                        self.graph_2.addItem(avg_track_line)
-                except IndexError as e:      # the internal data is still building up, so we can safely pass this
-                    print(e)
-        
         # update capture rate statistics and scale graph
-        if(self._spec_data.capture_running):
+        if(self._spec_data.capture_running or self._recording is not None):
             self.label_3.setText(f"Average Capture Time (ms): {self._spec_data.capture_time_ms}")
-            try:
-                self.label_capture_ps.setText(f"Captures per second: {1000 / self._spec_data.capture_time_ms:.2f}")
-            except ZeroDivisionError as e:
-                print(e)
-            if(self.checkbox_auto_scale.isChecked()):
-                try:
-                    max_h = max(channel)
-                    min_h = min(channel)
-                    padding_factor = self.slider_channel_zoom.value() / 100
-                    pad = math.floor((max_h - min_h) * padding_factor)
-                    self.graph_2.setRange(
-                        xRange = (0, self._spec_data.max_captures),
-                        yRange = (max_h + pad, min_h - pad)
-                    )
-                except IndexError as e:      # the internal data is still building up, so we can safely pass this
-                    print(e)
+            self.label_capture_ps.setText(f"Captures per second: {self._spec_data.captures_per_second:.2f}")
+            reading = self._heart_rate.latest if self._heart_rate is not None else None
+            if(reading is not None and not math.isnan(reading.bpm)):
+                self.label_heart_rate.setText(f"Heart rate (bpm): {reading.bpm:.0f}")
+            else:
+                self.label_heart_rate.setText("Heart rate (bpm): --")
+            if(self.checkbox_auto_scale.isChecked() and len(channel) and len(x)):
+                max_h = float(numpy.max(channel))
+                min_h = float(numpy.min(channel))
+                padding_factor = self.slider_channel_zoom.value() / 100
+                pad = math.floor((max_h - min_h) * padding_factor)
+                self.graph_2.setRange(
+                    xRange = (float(x[0]), 0) if self.checkbox_time_axis.isChecked() else (0, self._spec_data.max_captures),
+                    yRange = (max_h + pad, min_h - pad)
+                )
+
+
+    def show_latency(self):
+        if(self._latency_dialog is None):
+            self._latency_dialog = LatencyDialog(self)
+        self._latency_dialog.show()
+        self._latency_dialog.raise_()
+
+    def review_toggle(self):
+        """Open a recording as a read-only data source for the graphs, or close the one being reviewed."""
+        if(self._recording is None):
+            if(self._spec_data is not None):
+                self.ui_display_error_message("Review Error", "Disconnect from the sensor before reviewing a recording")
+                return
+            path, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Open Recording", "", "SpectroPPG recording (*.sppg)")
+            if(path):
+                self.review_open(path)
+        else:
+            self.review_close()
 
+    def review_open(self, path: str):
+        from SpectroRecording import SpectroRecording
+        try:
+            recording = SpectroRecording(path)
+        except Exception as e:
+            self.ui_display_error_message("Review Error", e)
+            return
+        if(recording.record_count == 0):
+            recording.close()
+            self.ui_display_error_message("Review Error", f"{path} holds no captures")
+            return
+        self._recording = recording
+        self._spec_data = recording
+        self._mca_vector = None
+        self.button_open_recording.setText("Close Review")
+        self.button_connect.setEnabled(False)
+        self.button_record.setEnabled(False)
+        self.button_update_sensor.setEnabled(False)
+        self.slider_review.setRange(recording.history_length, recording.record_count)
+        self.slider_review.setValue(recording.position)
+        self.slider_review.setVisible(True)
+        self.review_refresh()
+
+    def review_close(self):
+        self.slider_review.setVisible(False)
+        self._spec_data = None
+        self._recording.close()
+        self._recording = None
+        self.button_open_recording.setText("Review...")
+        self.button_connect.setEnabled(True)
+        self.button_record.setEnabled(True)
+        self.button_update_sensor.setEnabled(True)
+
+    def review_seek(self, position: int):
+        if(self._recording is not None):
+            self._recording.seek(position)
+            self.review_refresh()
+
+    def review_refresh(self):
+        # there are no timers while reviewing, the graphs are redrawn whenever the window or channels change
+        if(self._recording is not None):
+            self.update_graph()
+            self.channel_graph_update()
 
     def serial_connect(self):
         if(self._spec_data is None):
             port = self.port_dropdown.itemData(self.port_dropdown.currentIndex())
             com_port = serial.Serial(port, baudrate = 115200, bytesize = serial.EIGHTBITS, parity = serial.PARITY_NONE, stopbits = serial.STOPBITS_ONE)
-            self._spec_data = SpectroData(com_port)
+            self._spec_data = SpectroData(com_port, calibration_cache = True)
+            self._mca_vector = None
+            self._heart_rate_channels = self.heart_rate_channels()
+            from SpectroHeartRate import HeartRateEngine
+            self._heart_rate = HeartRateEngine(self._spec_data, self._heart_rate_channels)
             self.button_connect.setText("Disconnect")
             self.button_startstop.setEnabled(True)
             self.channel_timer.start(self.channel_timer_ms)
@@ -172,8 +459,13 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         else:
             self.channel_timer.stop()
             self.graph_timer.stop()
+            self.button_record.setChecked(False)
+            self._heart_rate.close()
+            self._heart_rate = None
+            self._spec_data.close()
             del self._spec_data
             self._spec_data = None
+            self.calibration_changed(None)
             self.button_startstop.setEnabled(False)
             self.button_connect.setText("Connect")
     
@@ -188,7 +480,35 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
             self.button_connect.setEnabled(True)
 
     def update_channel_ui(self):
-        self.channel_lcd.display(self.channel_slider.value())
+        channel = self.channel_slider.value()
+        self.channel_lcd.display(channel)
+        # a typed wavelength stays as entered while it still picks this channel
+        if(self._calibration is None):
+            self.spinbox_wavelength.blockSignals(True)
+            self.spinbox_wavelength.setValue(0)
+            self.spinbox_wavelength.blockSignals(False)
+        elif(0 <= channel < self._calibration.num_points and self._calibration.channel_at(self.spinbox_wavelength.value()) != channel):
+            self.spinbox_wavelength.blockSignals(True)
+            self.spinbox_wavelength.setValue(self._calibration.wavelength_of(channel))
+            self.spinbox_wavelength.blockSignals(False)
+        self.heart_rate_channels_changed()
+        self.review_refresh()
+
+    def wavelength_selected(self, nm: int):
+        if(self._calibration is not None):
+            self.channel_slider.setValue(self._calibration.channel_at(nm))
+
+    def heart_rate_channels(self) -> list:
+        if(self.checkbox_enable_mca.isChecked() and len(self._mca_columns)):
+            return [int(c) for c in self._mca_columns]
+        return [self.channel_slider.value()]
+
+    def heart_rate_channels_changed(self):
+        # the engine restarts its windows on a channel change, so only tell it about real changes
+        channels = self.heart_rate_channels()
+        if(self._heart_rate is not None and channels != self._heart_rate_channels):
+            self._heart_rate_channels = channels
+            self._heart_rate.channels = channels
 
     def update_sensor(self):
         self._spec_data.auto_ae = self.checkbox_auto_ae.isChecked()
@@ -197,32 +517,94 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
 
     def export_channel_csv(self):
         default_filename = str(time.time()).split('.', maxsplit=1)[0] + '.csv'
-        channel = self.channel_slider.value()
-        try:
-            csv_file = open(default_filename, 'w', newline = '')
-            writer = csv.writer(csv_file)
-            writer.writerow(self._spec_data.channel_graph(channel))
-            csv_file.flush()
-            csv_file.close()
-            self.ui_display_error_message("Export", "Export Successful")
-        except Exception as e:
-            self.ui_display_error_message("Export Error", e)
+        if(self.checkbox_enable_mca.isChecked() and len(self._mca_columns)):
+            channels = self._mca_columns
+        else:
+            channels = [self.channel_slider.value()]
+        self.run_export(default_filename, channels)
 
     def export_all_csv(self):
-        default_filename = str(time.time()).split('.', maxsplit=1)[0] + '.xls'
-        xls = xlwt.Workbook()
-        sheet = xls.add_sheet("Test Results")
-        data = self._spec_data.captures
-        for i in range(len(data)):
-            for j in range(len(data[i])):
-                sheet.write(i, j, data[i][j])
-        xls.save(default_filename)
+        default_filename = str(time.time()).split('.', maxsplit=1)[0] + '.csv'
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Export Full History", default_filename, self.export_filter)
+        if(path):
+            self.run_export(path)
+
+    def export_recording_file(self):
+        recording, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Open Recording", "", "SpectroPPG recording (*.sppg)")
+        if(not recording):
+            return
+        default_filename = recording.rsplit('.', maxsplit=1)[0] + '.csv'
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Export Recording", default_filename, self.export_filter)
+        if(path):
+            import SpectroExport
+            self.start_export_job(path, SpectroExport.export_recording, path, recording)
+
+    def run_export(self, path: str, channels = None):
+        # copy a snapshot of the history so the export is consistent while captures keep coming in
+        while(True):
+            snapshot = self._spec_data.snapshot()
+            timestamps = numpy.array(snapshot.timestamps)
+            captures = numpy.array(snapshot.captures)
+            if(snapshot.valid):
+                break
+        if(len(captures) == 0):
+            self.ui_display_error_message("Export Error", "No captures to export")
+            return
+        import SpectroExport
+        self.start_export_job(path, SpectroExport.export_captures, path, timestamps, captures, channels, wavelengths = self.export_wavelengths())
+
+    def export_wavelengths(self) -> numpy.ndarray:
+        """Wavelengths to label exported channels with, None until the calibration of the sensor is known."""
+        return self._calibration.wavelengths if self._calibration is not None else None
+
+    def start_export_job(self, path: str, target, *args, **kwargs):
+        import SpectroExport
+        job = SpectroExport.ExportJob(target, *args, **kwargs)
+        dialog = QtWidgets.QProgressDialog(f"Exporting {path}", "Cancel", 0, 100, self)
+        dialog.setWindowTitle("Export")
+        dialog.setMinimumDuration(500)
+        dialog.canceled.connect(job.cancel)
+        timer = QtCore.QTimer(self)
+        self._export_jobs.append((job, dialog, timer))
+
+        def poll():
+            dialog.setValue(int(job.progress * 100))
+            if(job.done):
+                timer.stop()
+                dialog.reset()
+                self._export_jobs.remove((job, dialog, timer))
+                if(isinstance(job.error, SpectroExport.ExportCancelled)):
+                    return
+                if(job.error is not None):
+                    self.ui_display_error_message("Export Error", job.error)
+                else:
+                    self.ui_display_error_message("Export", f"Exported {job.result} captures to {path}")
+        timer.timeout.connect(poll)
+        timer.start(100)
+
+    def record_toggle(self, checked: bool):
+        if(self._spec_data is None):
+            self.button_record.setChecked(False)
+            return
+        if(checked):
+            default_filename = str(time.time()).split('.', maxsplit=1)[0] + '.sppg'
+            try:
+                self._spec_data.start_recording(default_filename, compress = True)
+                self.button_record.setText("Stop Recording")
+            except Exception as e:
+                self.button_record.setChecked(False)
+                self.ui_display_error_message("Recording Error", e)
+        else:
+            recorder = self._spec_data.stop_recording()
+            self.button_record.setText("Record")
+            if(recorder is not None):
+                self.ui_display_error_message("Recording", f"Saved {recorder.records_written} captures to {recorder.path} ({recorder.records_dropped} dropped)")
 
     def mca_mark_channel(self):
-        marked_channels = [int(self.list_mca.item(x).text()) for x in range(self.list_mca.count())]
+        marked_channels = [self.mca_item_channel(self.list_mca.item(x)) for x in range(self.list_mca.count())]
         new_channel = self.channel_slider.value()
         if new_channel not in marked_channels:
-            self.list_mca.addItem(str(new_channel))
+            self.list_mca.addItem(self.mca_item_text(new_channel))
 
     def mca_clear_channel(self):
         if(self.list_mca.count() > 1):
@@ -250,9 +632,14 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         error_message.exec_()
 
 def main():
-    app = QtWidgets.QApplication(sys.argv)
-    main = MainWindow()
-    main.show()
+    with startup.phase("QApplication"):
+        app = QtWidgets.QApplication(sys.argv)
+    with startup.phase("MainWindow.__init__"):
+        main = MainWindow()
+    with startup.phase("show"):
+        main.show()
+    # the first pass of the event loop paints the window
+    QtCore.QTimer.singleShot(0, lambda: (startup.mark("first window"), startup.finish()))
     sys.exit(app.exec_())
 
 
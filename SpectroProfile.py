@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+"""
+Startup timing report, switched on with an environment variable:
+
+    SPECTROPPG_STARTUP_PROFILE=1          report to stderr
+    SPECTROPPG_STARTUP_PROFILE=path.txt   report to a file
+
+Only the standard library is imported here, so it can be the first import and time everything after it.
+"""
+
+import os
+import sys
+import time
+import contextlib
+
+ENVIRONMENT_VARIABLE = "SPECTROPPG_STARTUP_PROFILE"
+
+
+class StartupProfile:
+    """
+    Nested named phases with their start offset and duration, a no-op unless enabled.\n
+    phase() times a block, lap() the stretch since the previous lap or the start of the enclosing phase, which
+    times a run of statements (e.g. a group of imports) without reindenting them."""
+
+    def __init__(self, target: str = None):
+        self._target: str = target
+        self._t0: float = time.perf_counter()
+        self._phases: list = list()         # (name, depth, start s, duration s), in start order
+        self._lap_starts: list = [0.0]      # per nesting level, where the next lap starts
+        self._finished: bool = False
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._target)
+    @property
+    def phases(self) -> list:
+        return list(self._phases)
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        if(not self._target):
+            yield
+            return
+        entry = [name, len(self._lap_starts) - 1, time.perf_counter() - self._t0, 0.0]
+        self._phases.append(entry)
+        self._lap_starts.append(entry[2])
+        try:
+            yield
+        finally:
+            self._lap_starts.pop()
+            end = time.perf_counter() - self._t0
+            entry[3] = end - entry[2]
+            self._lap_starts[-1] = end
+
+    def lap(self, name: str) -> None:
+        if(self._target):
+            now = time.perf_counter() - self._t0
+            self._phases.append([name, len(self._lap_starts) - 1, self._lap_starts[-1], now - self._lap_starts[-1]])
+            self._lap_starts[-1] = now
+
+    def mark(self, name: str) -> None:
+        """A zero length phase, e.g. the moment the first window is on screen."""
+        if(self._target):
+            now = time.perf_counter() - self._t0
+            self._phases.append([name, len(self._lap_starts) - 1, now, 0.0])
+            self._lap_starts[-1] = now
+
+    def report(self) -> str:
+        lines = [f"{'start (ms)':>10} {'took (ms)':>10}  phase"]
+        for name, depth, start, duration in self._phases:
+            lines.append(f"{start * 1000:10.1f} {duration * 1000:10.1f}  {'  ' * depth}{name}")
+        return "\n".join(lines)
+
+    def finish(self) -> None:
+        """Write the report once, to stderr or the file named by the environment variable."""
+        if(not self._target or self._finished):
+            return
+        self._finished = True
+        report = self.report()
+        if(self._target == "1"):
+            print(report, file = sys.stderr)
+        else:
+            with open(self._target, 'w') as f:
+                f.write(report + "\n")
+
+
+startup = StartupProfile(os.environ.get(ENVIRONMENT_VARIABLE))
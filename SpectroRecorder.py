@@ -0,0 +1,294 @@
+#!/usr/bin/python3
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+"""
+Chunked binary recording of every capture.
+
+File layout (all little endian):
+
+    file header     64 bytes  FILE_HEADER: magic "SPPGREC\\0", version, num_points, record size,
+                              records per chunk, flags, wall clock start (time_ns), counter start (perf_counter_ns)
+    calibration     40 bytes  CALIBRATION_HEADER, only when flags bit 1 is set: magic "CALB", sensor ID (ascii,
+                              zero padded), wavelength count
+                    payload   wavelength count uint16 wavelengths in nm, one per spectral point
+    chunk           32 bytes  CHUNK_HEADER: magic "CHNK", flags (bit 0 = zlib), record count, payload size,
+                              first and last record timestamp
+                    payload   record_count records of record_dtype(num_points), zlib compressed when flagged
+    ...
+    index           40 bytes per chunk, INDEX_DTYPE: chunk offset, first record number, record count, flags,
+                              first and last record timestamp
+    trailer         24 bytes  TRAILER: magic "SPPGIDX\\0", index offset, chunk count
+
+The calibration labels the spectra of the sensor that recorded them, whichever sensor is connected later.
+Record timestamps are perf_counter_ns receipt times, the file header holds the matching wall clock start.
+A file without a trailer (e.g. the program crashed) is still readable, read_index() falls back to walking the chunk headers.
+"""
+
+import os
+import time
+import zlib
+import queue
+import struct
+import threading
+import numpy
+from SpectroCalibration import Calibration
+
+FILE_MAGIC = b'SPPGREC\0'
+CHUNK_MAGIC = b'CHNK'
+TRAILER_MAGIC = b'SPPGIDX\0'
+CALIBRATION_MAGIC = b'CALB'
+VERSION = 2
+READABLE_VERSIONS = (1, 2)          # version 1 files have no calibration block
+FLAG_ZLIB = 0x01
+FLAG_CALIBRATION = 0x02
+
+FILE_HEADER = struct.Struct('<8sHHIIIqq24x')
+CALIBRATION_HEADER = struct.Struct('<4s32sI')
+CHUNK_HEADER = struct.Struct('<4sIIIqq')
+TRAILER = struct.Struct('<8sQQ')
+INDEX_DTYPE = numpy.dtype([
+    ('offset', '<u8'),
+    ('first_record', '<u8'),
+    ('record_count', '<u4'),
+    ('flags', '<u4'),
+    ('first_timestamp_ns', '<i8'),
+    ('last_timestamp_ns', '<i8'),
+])
+
+def record_dtype(num_points: int) -> numpy.dtype:
+    return numpy.dtype([
+        ('timestamp_ns', '<i8'),
+        ('integration_time', '<u2'),
+        ('saturated', 'u1'),
+        ('reserved', 'u1'),
+        ('spectrum', '<f4', (num_points,)),
+    ])
+
+
+class SpectroRecorder:
+    """
+    Streams captures to a chunked recording file from its own writer thread.\n
+    add() only queues the capture, so it can be called from the acquisition path. When the queue is full
+    the capture is dropped and counted instead of blocking the caller. calibration, when known, is stored
+    with the recording."""
+
+    def __init__(self, path: str, num_points: int = 135, chunk_records: int = 256, compress: bool = False,
+                 compress_level: int = 1, queue_size: int = 1024, flush_interval: float = 1.0, calibration: Calibration = None):
+        assert chunk_records > 0
+        self._path: str = path
+        self._num_points: int = num_points
+        self._dtype = record_dtype(num_points)
+        self._chunk_records: int = chunk_records
+        self._compress: bool = compress
+        self._compress_level: int = compress_level
+        self._flush_interval: float = flush_interval
+
+        self._chunk = numpy.zeros(chunk_records, dtype = self._dtype)
+        self._chunk_fill: int = 0
+        self._index: list = list()
+        self._records_written: int = 0
+        self._records_dropped: int = 0
+        self._bytes_written: int = 0
+        self._queue_high_water: int = 0
+
+        if(calibration is not None and calibration.num_points != num_points):
+            calibration = None
+        self._file = open(path, 'wb')
+        self._start_time_ns: int = time.time_ns()
+        self._start_counter_ns: int = time.perf_counter_ns()
+        flags = (FLAG_ZLIB if compress else 0) | (FLAG_CALIBRATION if calibration is not None else 0)
+        self._file.write(FILE_HEADER.pack(FILE_MAGIC, VERSION, num_points, self._dtype.itemsize, chunk_records,
+                                          flags, self._start_time_ns, self._start_counter_ns))
+        self._bytes_written += FILE_HEADER.size
+        if(calibration is not None):
+            wavelengths = numpy.asarray(calibration.wavelengths, dtype = '<u2')
+            self._file.write(CALIBRATION_HEADER.pack(CALIBRATION_MAGIC, (calibration.sensor_id or "").encode('ascii'), len(wavelengths)))
+            self._file.write(wavelengths.tobytes())
+            self._bytes_written += CALIBRATION_HEADER.size + wavelengths.nbytes
+
+        self._queue = queue.Queue(maxsize = queue_size)
+        self._closed: bool = False
+        self._thread = threading.Thread(target = self._writer)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def path(self) -> str:
+        return self._path
+    @property
+    def records_written(self) -> int:
+        return self._records_written
+    @property
+    def records_dropped(self) -> int:
+        return self._records_dropped
+    @property
+    def chunks_written(self) -> int:
+        return len(self._index)
+    @property
+    def bytes_written(self) -> int:
+        return self._bytes_written
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+    @property
+    def queue_high_water(self) -> int:
+        return self._queue_high_water
+
+    def add(self, timestamp_ns: int, integration_time: int, saturated: bool, spectrum) -> bool:
+        """Queue one capture for writing, returns False if it was dropped because the writer is behind."""
+        if(self._closed):
+            return False
+        try:
+            self._queue.put_nowait((timestamp_ns, integration_time, saturated, spectrum))
+        except queue.Full:
+            self._records_dropped += 1
+            return False
+        depth = self._queue.qsize()
+        if(depth > self._queue_high_water):
+            self._queue_high_water = depth
+        return True
+
+    def close(self) -> None:
+        """Write out everything queued, then the index and trailer."""
+        if(self._closed):
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _writer(self) -> None:
+        last_flush = time.monotonic()
+        while(True):
+            try:
+                item = self._queue.get(timeout = self._flush_interval)
+            except queue.Empty:
+                item = False
+            if(item is None):
+                break
+            if(item):
+                timestamp_ns, integration_time, saturated, spectrum = item
+                self._chunk[self._chunk_fill] = (timestamp_ns, integration_time, saturated, 0, spectrum)
+                self._chunk_fill += 1
+
+            # full chunks go out right away, partial ones at least every flush interval
+            if(self._chunk_fill == self._chunk_records or (self._chunk_fill and time.monotonic() - last_flush >= self._flush_interval)):
+                self._write_chunk()
+                last_flush = time.monotonic()
+        if(self._chunk_fill):
+            self._write_chunk()
+        self._write_index()
+        self._file.close()
+
+    def _write_chunk(self) -> None:
+        records = self._chunk[:self._chunk_fill]
+        payload = records.tobytes()
+        flags = 0
+        if(self._compress):
+            payload = zlib.compress(payload, self._compress_level)
+            flags |= FLAG_ZLIB
+        offset = self._file.tell()
+        first_ts, last_ts = int(records['timestamp_ns'][0]), int(records['timestamp_ns'][-1])
+        self._file.write(CHUNK_HEADER.pack(CHUNK_MAGIC, flags, self._chunk_fill, len(payload), first_ts, last_ts))
+        self._file.write(payload)
+        self._file.flush()
+        self._index.append((offset, self._records_written, self._chunk_fill, flags, first_ts, last_ts))
+        self._records_written += self._chunk_fill
+        self._bytes_written += CHUNK_HEADER.size + len(payload)
+        self._chunk_fill = 0
+
+    def _write_index(self) -> None:
+        index_offset = self._file.tell()
+        self._file.write(numpy.array(self._index, dtype = INDEX_DTYPE).tobytes())
+        self._file.write(TRAILER.pack(TRAILER_MAGIC, index_offset, len(self._index)))
+        self._bytes_written += len(self._index) * INDEX_DTYPE.itemsize + TRAILER.size
+
+
+def read_header(f) -> dict:
+    f.seek(0)
+    magic, version, num_points, record_size, chunk_records, flags, start_time_ns, start_counter_ns = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+    if(magic != FILE_MAGIC):
+        raise ValueError("not a SpectroPPG recording")
+    if(version not in READABLE_VERSIONS):
+        raise ValueError(f"unsupported recording version {version}")
+    data_offset = FILE_HEADER.size
+    if(flags & FLAG_CALIBRATION):
+        _, _, count = CALIBRATION_HEADER.unpack(f.read(CALIBRATION_HEADER.size))
+        data_offset += CALIBRATION_HEADER.size + 2 * count
+    return {
+        "version": version,
+        "num_points": num_points,
+        "record_size": record_size,
+        "chunk_records": chunk_records,
+        "flags": flags,
+        "start_time_ns": start_time_ns,
+        "start_counter_ns": start_counter_ns,
+        "data_offset": data_offset,         # where the first chunk starts
+    }
+
+def read_calibration(f) -> Calibration:
+    """The calibration stored with a recording, None if it was recorded without one."""
+    header = read_header(f)
+    if(not header["flags"] & FLAG_CALIBRATION):
+        return None
+    f.seek(FILE_HEADER.size)
+    magic, sensor_id, count = CALIBRATION_HEADER.unpack(f.read(CALIBRATION_HEADER.size))
+    wavelengths = numpy.frombuffer(f.read(2 * count), dtype = '<u2')
+    if(magic != CALIBRATION_MAGIC or len(wavelengths) != header["num_points"]):
+        raise ValueError("corrupt calibration block")
+    return Calibration(sensor_id.rstrip(b'\0').decode('ascii'), wavelengths)
+
+def read_index(f) -> numpy.ndarray:
+    """Chunk index of an open recording, read from the footer or rebuilt from the chunk headers if the footer is missing."""
+    data_offset = read_header(f)["data_offset"]
+    size = f.seek(0, os.SEEK_END)
+    if(size >= data_offset + TRAILER.size):
+        f.seek(size - TRAILER.size)
+        magic, index_offset, chunk_count = TRAILER.unpack(f.read(TRAILER.size))
+        if(magic == TRAILER_MAGIC and index_offset + chunk_count * INDEX_DTYPE.itemsize + TRAILER.size == size):
+            f.seek(index_offset)
+            return numpy.frombuffer(f.read(chunk_count * INDEX_DTYPE.itemsize), dtype = INDEX_DTYPE)
+
+    # no usable footer, walk the chunk headers
+    entries = list()
+    offset, first_record = data_offset, 0
+    while(offset + CHUNK_HEADER.size <= size):
+        f.seek(offset)
+        magic, flags, count, payload_size, first_ts, last_ts = CHUNK_HEADER.unpack(f.read(CHUNK_HEADER.size))
+        if(magic != CHUNK_MAGIC or offset + CHUNK_HEADER.size + payload_size > size):
+            break
+        entries.append((offset, first_record, count, flags, first_ts, last_ts))
+        first_record += count
+        offset += CHUNK_HEADER.size + payload_size
+    return numpy.array(entries, dtype = INDEX_DTYPE)
+
+def read_chunk(f, entry, num_points: int) -> numpy.ndarray:
+    """Records of one chunk, entry is a row of the chunk index."""
+    f.seek(int(entry['offset']))
+    magic, flags, count, payload_size, _, _ = CHUNK_HEADER.unpack(f.read(CHUNK_HEADER.size))
+    if(magic != CHUNK_MAGIC):
+        raise ValueError("corrupt chunk header")
+    payload = f.read(payload_size)
+    if(flags & FLAG_ZLIB):
+        payload = zlib.decompress(payload)
+    return numpy.frombuffer(payload, dtype = record_dtype(num_points), count = count)
+
+def find_chunk(index: numpy.ndarray, timestamp_ns: int) -> int:
+    """Number of the chunk holding the first record at or after timestamp_ns (len(index) if there is none)."""
+    return int(numpy.searchsorted(index['last_timestamp_ns'], timestamp_ns, side = 'left'))
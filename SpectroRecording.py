@@ -0,0 +1,217 @@
+#!/usr/bin/python3
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+import mmap
+import collections
+import zlib
+import numpy
+import SpectroRecorder
+from SpectroData import CaptureView, CaptureSnapshot
+
+class SpectroRecording(CaptureView):
+    """
+    Random access to a recording file written by SpectroRecorder.\n
+    The file is memory mapped and only the header and chunk index are read on open, chunks are decoded when first touched.
+    Uncompressed chunks are zero-copy views of the mapping, compressed ones are inflated into a small LRU cache.
+    Ranges inside one uncompressed chunk come back as views, ranges spanning chunks are stitched together.\n
+    For the graphs it behaves like a stopped SpectroData: captures, timestamps and channel_graph cover a window
+    of the last window captures before position, move it with seek()."""
+
+    def __init__(self, path: str, window: int = 100, cache_chunks: int = 8):
+        assert window > 0 and cache_chunks > 0
+        self._path: str = path
+        self._file = open(path, 'rb')
+        try:
+            self._header: dict = SpectroRecorder.read_header(self._file)
+            self._index: numpy.ndarray = SpectroRecorder.read_index(self._file)
+            self._calibration = SpectroRecorder.read_calibration(self._file)
+            self._map = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        self._num_points: int = self._header["num_points"]
+        self._dtype = SpectroRecorder.record_dtype(self._num_points)
+        # record number where each chunk ends, for bisecting record ranges onto chunks
+        self._chunk_ends = numpy.cumsum(self._index['record_count'], dtype = numpy.int64)
+        self._record_count: int = int(self._chunk_ends[-1]) if len(self._index) else 0
+        self._cache_chunks: int = cache_chunks
+        self._chunk_cache = collections.OrderedDict()
+
+        self._window: int = window
+        self._position: int = min(window, self._record_count)
+
+    @property
+    def path(self) -> str:
+        return self._path
+    @property
+    def header(self) -> dict:
+        return dict(self._header)
+    @property
+    def calibration(self) -> "Calibration":
+        """Calibration of the sensor that made the recording, None for recordings without one."""
+        return self._calibration
+    @property
+    def record_count(self) -> int:
+        return self._record_count
+    @property
+    def chunk_count(self) -> int:
+        return len(self._index)
+    @property
+    def duration(self) -> float:
+        """Seconds between the first and the last record."""
+        if(self._record_count == 0):
+            return 0.0
+        return (int(self._index['last_timestamp_ns'][-1]) - int(self._index['first_timestamp_ns'][0])) / 1e9
+    @property
+    def position(self) -> int:
+        return self._position
+    @property
+    def window(self) -> int:
+        return self._window
+    @window.setter
+    def window(self, val: int) -> None:
+        assert val > 0
+        self._window = val
+    @property
+    def captures(self) -> numpy.ndarray:
+        return self.capture_range(self.window_start, self._position)
+    @property
+    def timestamps(self) -> numpy.ndarray:
+        return self.records(self.window_start, self._position)['timestamp_ns']
+    @property
+    def integration_times(self) -> numpy.ndarray:
+        return self.records(self.window_start, self._position)['integration_time']
+    @property
+    def history_length(self) -> int:
+        return min(self._window, self._position)
+    @property
+    def max_captures(self) -> int:
+        return self._window
+    @property
+    def num_points(self) -> int:
+        return self._num_points
+    @property
+    def captures_taken(self) -> int:
+        # captures "taken" so far at the review position, so incremental consumers see new rows while scrubbing forward
+        return self._position
+    @property
+    def window_start(self) -> int:
+        """Record number of the first capture in the review window."""
+        return self._position - self.history_length
+    @property
+    def captures_dropped(self) -> int:
+        return 0
+    @property
+    def capture_time_ms(self) -> float:
+        return round(1000 / self.captures_per_second) if self.captures_per_second > 0 else 0
+    @property
+    def captures_per_second(self) -> float:
+        timestamps = self.timestamps
+        if(len(timestamps) < 2 or timestamps[-1] <= timestamps[0]):
+            return 0.0
+        return (len(timestamps) - 1) / ((int(timestamps[-1]) - int(timestamps[0])) / 1e9)
+    @property
+    def capture_running(self) -> bool:
+        return False
+
+    def seek(self, position: int) -> int:
+        """Move the window so it ends just before record number position, returns the clamped position."""
+        self._position = max(0, min(int(position), self._record_count))
+        return self._position
+
+    def since(self, sequence: int) -> CaptureSnapshot:
+        """Snapshot of the window from record sequence on, the file never changes so it stays valid."""
+        records = self.records(max(sequence, self.window_start), self._position)
+        return CaptureSnapshot(self, self._position, records['spectrum'], records['timestamp_ns'], integration_times = records['integration_time'])
+
+    def records(self, start: int, stop: int) -> numpy.ndarray:
+        """Structured records start to stop (record_dtype), a view when the range sits in one uncompressed chunk."""
+        start = max(0, min(start, self._record_count))
+        stop = max(start, min(stop, self._record_count))
+        if(start == stop):
+            return numpy.zeros(0, dtype = self._dtype)
+        first = int(numpy.searchsorted(self._chunk_ends, start, side = 'right'))
+        last = int(numpy.searchsorted(self._chunk_ends, stop - 1, side = 'right'))
+        parts = list()
+        for chunk in range(first, last + 1):
+            chunk_start = int(self._index['first_record'][chunk])
+            records = self._chunk(chunk)
+            parts.append(records[max(start - chunk_start, 0) : stop - chunk_start])
+        return parts[0] if len(parts) == 1 else numpy.concatenate(parts)
+
+    def capture_range(self, start: int, stop: int, channels = None) -> numpy.ndarray:
+        """Spectra of captures start to stop, optionally only the given channels (an int, slice or list of columns)."""
+        spectra = self.records(start, stop)['spectrum']
+        return spectra if channels is None else spectra[:, channels]
+
+    def timestamp_range(self, start: int, stop: int) -> numpy.ndarray:
+        return self.records(start, stop)['timestamp_ns']
+
+    def record_at(self, time_s: float) -> int:
+        """Number of the first record at or after time_s seconds from the start of the recording."""
+        timestamp_ns = self._header["start_counter_ns"] + int(time_s * 1e9)
+        chunk = SpectroRecorder.find_chunk(self._index, timestamp_ns)
+        if(chunk == len(self._index)):
+            return self._record_count
+        timestamps = self._chunk(chunk)['timestamp_ns']
+        return int(self._index['first_record'][chunk]) + int(numpy.searchsorted(timestamps, timestamp_ns, side = 'left'))
+
+    def time_range(self, start_s: float, stop_s: float, channels = None) -> numpy.ndarray:
+        """Spectra recorded from start_s up to (not including) stop_s seconds after the start of the recording."""
+        return self.capture_range(self.record_at(start_s), self.record_at(stop_s), channels)
+
+    def channel_range(self, index: int, start: int = 0, stop: int = None) -> numpy.ndarray:
+        return self.capture_range(start, self._record_count if stop is None else stop, index)
+
+    def close(self) -> None:
+        self._chunk_cache.clear()
+        if(self._map is not None):
+            try:
+                self._map.close()
+            except BufferError:
+                pass        # views handed out still reference the mapping, it is released with the last of them
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _chunk(self, chunk: int) -> numpy.ndarray:
+        entry = self._index[chunk]
+        offset = int(entry['offset']) + SpectroRecorder.CHUNK_HEADER.size
+        count = int(entry['record_count'])
+        if(not entry['flags'] & SpectroRecorder.FLAG_ZLIB):
+            return numpy.frombuffer(self._map, dtype = self._dtype, count = count, offset = offset)
+
+        records = self._chunk_cache.get(chunk)
+        if(records is None):
+            magic, flags, _, payload_size, _, _ = SpectroRecorder.CHUNK_HEADER.unpack_from(self._map, int(entry['offset']))
+            if(magic != SpectroRecorder.CHUNK_MAGIC):
+                raise ValueError("corrupt chunk header")
+            records = numpy.frombuffer(zlib.decompress(self._map[offset : offset + payload_size]), dtype = self._dtype, count = count)
+            self._chunk_cache[chunk] = records
+            if(len(self._chunk_cache) > self._cache_chunks):
+                self._chunk_cache.popitem(last = False)
+        else:
+            self._chunk_cache.move_to_end(chunk)
+        return records
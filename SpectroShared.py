@@ -0,0 +1,251 @@
+#!/usr/bin/python3
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+"""
+The capture ring of a SpectroData in a named multiprocessing.shared_memory segment, for other processes.
+
+Segment layout (all little endian, every array 8 byte aligned):
+
+    header          64 bytes  RING_HEADER: magic "SPPGRING", version, header size, num_points, capacity,
+                              max history, offsets of the three arrays, sequence, write cursor, flags
+    captures        float32 (2 * capacity, num_points)
+    timestamps      int64 (2 * capacity), perf_counter_ns receipt time of the writing process
+    integration     uint16 (2 * capacity), IntegrationTime of each capture
+
+Capture n is written to rows n % capacity and n % capacity + capacity, so any run of up to capacity captures
+is one contiguous, chronological slice. The writer fills both rows first and then stores sequence = n + 1
+(a single aligned 8 byte store) and the write cursor (sequence % capacity). The rows of captures first to
+sequence - 1 stay untouched until the writer wraps onto them, which takes capacity - (sequence - first)
+more captures: a reader copies or uses its rows and then checks the sequence again to know whether they
+were overwritten meanwhile. Readers never take a lock or write anything, so they can not slow the writer.
+Flag bit 0 is set once the writer has closed the segment.
+
+SpectroData(shared_memory = "name") publishes its ring (SpectroCapture.py --publish name from the command
+line), SharedCaptureClient("name") reads it from any other process:
+
+    client = SharedCaptureClient("name")
+    for snapshot in client.follow():
+        values = snapshot.captures[:, 67].copy()
+        if(snapshot.valid):
+            ...
+"""
+
+import time
+import struct
+import numpy
+from multiprocessing.shared_memory import SharedMemory
+from SpectroData import CaptureView, CaptureSnapshot
+
+RING_MAGIC = b'SPPGRING'
+RING_VERSION = 1
+RING_HEADER = struct.Struct('<8sHHIIIQQQqII')
+FLAG_CLOSED = 0x01
+
+# offsets of the fields the writer keeps updating, the cursor and flags are the two uint32 at CURSOR_OFFSET
+SEQUENCE_OFFSET = 48
+CURSOR_OFFSET = 56
+
+def ring_layout(capacity: int, num_points: int) -> dict:
+    """Byte offsets of the arrays and the total segment size."""
+    captures = RING_HEADER.size
+    timestamps = captures + 2 * capacity * num_points * 4
+    integration_times = timestamps + 2 * capacity * 8
+    size = integration_times + 2 * capacity * 2
+    return {"captures": captures, "timestamps": timestamps, "integration_times": integration_times, "size": (size + 7) // 8 * 8}
+
+def _ring_arrays(buffer, capacity: int, num_points: int, layout: dict):
+    rows = 2 * capacity
+    return (numpy.ndarray((rows, num_points), dtype = numpy.float32, buffer = buffer, offset = layout["captures"]),
+            numpy.ndarray(rows, dtype = numpy.int64, buffer = buffer, offset = layout["timestamps"]),
+            numpy.ndarray(rows, dtype = numpy.uint16, buffer = buffer, offset = layout["integration_times"]))
+
+# segments created by this process, their resource tracker registration belongs to the SharedRing
+_created_names: set = set()
+
+def _attach(name: str) -> SharedMemory:
+    try:
+        return SharedMemory(name, track = False)
+    except TypeError:
+        pass
+    # before python 3.13 attaching registers the segment with this process' resource tracker, which would
+    # unlink it from under the writer when this process exits. Processes forked from the writer share its
+    # tracker and must leave the registration alone, as must a reader in the writer's own process.
+    memory = SharedMemory(name)
+    from multiprocessing import resource_tracker, parent_process
+    if(parent_process() is None and memory.name not in _created_names):
+        resource_tracker.unregister(memory._name, "shared_memory")
+    return memory
+
+
+class SharedRing:
+    """Writer side: creates the segment and hands SpectroData the arrays to use as its ring."""
+
+    def __init__(self, name: str, capacity: int, num_points: int, max_history: int):
+        self._layout: dict = ring_layout(capacity, num_points)
+        self._memory = SharedMemory(name, create = True, size = self._layout["size"])
+        _created_names.add(self._memory.name)
+        RING_HEADER.pack_into(self._memory.buf, 0, RING_MAGIC, RING_VERSION, RING_HEADER.size, num_points, capacity, max_history,
+                              self._layout["captures"], self._layout["timestamps"], self._layout["integration_times"], 0, 0, 0)
+        self._captures, self._timestamps, self._integration_times = _ring_arrays(self._memory.buf, capacity, num_points, self._layout)
+        self._captures[:] = 0
+        self._timestamps[:] = 0
+        self._integration_times[:] = 0
+        self._sequence = numpy.ndarray(1, dtype = numpy.int64, buffer = self._memory.buf, offset = SEQUENCE_OFFSET)
+        self._cursor_flags = numpy.ndarray(2, dtype = numpy.uint32, buffer = self._memory.buf, offset = CURSOR_OFFSET)
+        self._capacity: int = capacity
+
+    @property
+    def name(self) -> str:
+        return self._memory.name
+    @property
+    def captures(self) -> numpy.ndarray:
+        return self._captures
+    @property
+    def timestamps(self) -> numpy.ndarray:
+        return self._timestamps
+    @property
+    def integration_times(self) -> numpy.ndarray:
+        return self._integration_times
+
+    def publish(self, sequence: int) -> None:
+        """Make captures up to sequence - 1 visible, call after their rows are written."""
+        self._sequence[0] = sequence
+        self._cursor_flags[0] = sequence % self._capacity
+
+    def close(self) -> None:
+        self._cursor_flags[1] |= FLAG_CLOSED
+        self._sequence = self._cursor_flags = None
+        self._captures = self._timestamps = self._integration_times = None
+        try:
+            self._memory.close()
+        except BufferError:
+            pass        # snapshots handed out still reference the segment, it is unmapped with the last of them
+        self._memory.unlink()
+        _created_names.discard(self._memory.name)
+
+
+class SharedCaptureClient(CaptureView):
+    """
+    Read-only view of a ring published by another process, with the same snapshot API as SpectroData.\n
+    since() and snapshot() return views straight into the segment, check valid after using them. follow()
+    iterates the new captures as they arrive and counts the ones a slow reader missed."""
+
+    def __init__(self, name: str):
+        self._memory = _attach(name)
+        try:
+            magic, version, header_size, num_points, capacity, max_history, captures, timestamps, integration_times, _, _, _ = \
+                RING_HEADER.unpack_from(self._memory.buf, 0)
+            if(magic != RING_MAGIC or version != RING_VERSION):
+                raise ValueError(f"{name} is not a SpectroPPG capture ring")
+        except Exception:
+            self._memory.close()
+            raise
+        self._num_points: int = num_points
+        self._capacity: int = capacity
+        self._max_history: int = max_history
+        layout = {"captures": captures, "timestamps": timestamps, "integration_times": integration_times}
+        self._captures, self._timestamps, self._integration_times = _ring_arrays(self._memory.buf, capacity, num_points, layout)
+        for array in (self._captures, self._timestamps, self._integration_times):
+            array.flags.writeable = False
+        self._sequence = numpy.ndarray(1, dtype = numpy.int64, buffer = self._memory.buf, offset = SEQUENCE_OFFSET)
+        self._cursor_flags = numpy.ndarray(2, dtype = numpy.uint32, buffer = self._memory.buf, offset = CURSOR_OFFSET)
+        self._captures_missed: int = 0
+
+    @property
+    def name(self) -> str:
+        return self._memory.name
+    @property
+    def num_points(self) -> int:
+        return self._num_points
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+    @property
+    def max_captures(self) -> int:
+        return self._max_history
+    @property
+    def sequence(self) -> int:
+        return int(self._sequence[0])
+    @property
+    def captures_taken(self) -> int:
+        return self.sequence
+    @property
+    def write_cursor(self) -> int:
+        return int(self._cursor_flags[0])
+    @property
+    def writer_closed(self) -> bool:
+        return bool(self._cursor_flags[1] & FLAG_CLOSED)
+    @property
+    def captures_missed(self) -> int:
+        """Captures follow() skipped because the writer had already overwritten them."""
+        return self._captures_missed
+    @property
+    def captures(self) -> numpy.ndarray:
+        return self.snapshot().captures
+    @property
+    def timestamps(self) -> numpy.ndarray:
+        return self.snapshot().timestamps
+
+    def since(self, sequence: int) -> CaptureSnapshot:
+        taken = self.sequence
+        return self.span(taken - max(0, min(taken - sequence, taken, self._max_history)), taken)
+
+    def span(self, first: int, stop: int) -> CaptureSnapshot:
+        """Snapshot of captures first to stop - 1, which have to be within the last capacity captures to be valid."""
+        count = max(0, min(stop - first, self._capacity))
+        start = (stop - count) % self._capacity
+        return CaptureSnapshot(self, stop, self._captures[start : start + count], self._timestamps[start : start + count],
+                               self._capacity - count, self._integration_times[start : start + count])
+
+    def follow(self, sequence: int = None, poll_interval: float = 0.005, timeout: float = None):
+        """
+        Yield a snapshot of every batch of new captures, starting at capture sequence (the next one by default).\n
+        Use each snapshot before asking for the next one and check its valid afterwards: if the writer overwrote
+        the rows while they were in use the snapshot turns invalid, a reader never gets torn data unnoticed. A reader that falls more than
+        the history behind skips ahead and counts the skipped captures in captures_missed. Stops when the
+        writer closes, or after timeout seconds without a new capture."""
+        sequence = self.sequence if sequence is None else sequence
+        idle_since = time.monotonic()
+        while(True):
+            snapshot = self.since(sequence)
+            if(snapshot.sequence > sequence):
+                if(snapshot.first > sequence):
+                    self._captures_missed += snapshot.first - sequence
+                sequence = snapshot.sequence
+                idle_since = time.monotonic()
+                yield snapshot
+            elif(self.writer_closed or (timeout is not None and time.monotonic() - idle_since > timeout)):
+                return
+            else:
+                time.sleep(poll_interval)
+
+    def close(self) -> None:
+        self._sequence = self._cursor_flags = None
+        self._captures = self._timestamps = self._integration_times = None
+        try:
+            self._memory.close()
+        except BufferError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
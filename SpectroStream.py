@@ -0,0 +1,524 @@
+#!/usr/bin/python3
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+"""
+Live captures streamed to any number of subscribers over TCP or a UNIX socket.
+
+Addresses are "host:port", a port number (loopback only) or "unix:/path/to/socket". Captures are only
+served to other machines when a host is given explicitly, e.g. "0.0.0.0:5025". Protocol (all little endian):
+
+    subscriber -> server    SUBSCRIBE: magic "SPSB", version, policy (0 drop oldest, 1 disconnect),
+                            channel count (0 = every channel), queue size (0 = server default, capped at
+                            the server's maximum),
+                            then channel count uint16 channel indices
+    server -> subscriber    HELLO: magic "SPHL", version, channels per frame, spectrum size of the sensor
+    server -> subscriber    frames, back to back: FRAME_HEADER (magic "SF", channels, sequence,
+                            perf_counter_ns timestamp of the server, integration time, saturated, flags)
+                            followed by channels float32 values
+
+Every subscriber has its own bounded queue and sender thread, the capture path only encodes and queues
+frames and never waits on a socket. When a queue is full the subscriber's policy either drops its oldest
+frame (the next frame sent has FLAG_DROPPED set, and the sequence numbers show the gap) or disconnects it.
+"""
+
+import os
+import sys
+import time
+import errno
+import stat
+import socket
+import struct
+import argparse
+import threading
+import collections
+import numpy
+
+PROTOCOL_VERSION = 1
+SUBSCRIBE = struct.Struct('<4sHBBHI')
+SUBSCRIBE_MAGIC = b'SPSB'
+HELLO = struct.Struct('<4sHHI')
+HELLO_MAGIC = b'SPHL'
+FRAME_HEADER = struct.Struct('<2sHQqHBB')
+FRAME_MAGIC = b'SF'
+FLAG_DROPPED = 0x01
+
+POLICY_DROP_OLDEST = 0
+POLICY_DISCONNECT = 1
+POLICIES = {"drop_oldest": POLICY_DROP_OLDEST, "disconnect": POLICY_DISCONNECT}
+
+def frame_dtype(channels: int) -> numpy.dtype:
+    """One frame as a numpy record, so a buffer of frames parses with a single frombuffer."""
+    return numpy.dtype([
+        ('magic', 'S2'),
+        ('channels', '<u2'),
+        ('sequence', '<u8'),
+        ('timestamp_ns', '<i8'),
+        ('integration_time', '<u2'),
+        ('saturated', 'u1'),
+        ('flags', 'u1'),
+        ('spectrum', '<f4', (channels,)),
+    ])
+
+def parse_address(address):
+    """(family, address) for socket(): "unix:/path", "host:port" or a port on the loopback interface."""
+    if(isinstance(address, str) and address.startswith("unix:")):
+        return socket.AF_UNIX, address[5:]
+    if(isinstance(address, int) or ":" not in str(address)):
+        return socket.AF_INET, ("127.0.0.1", int(address))
+    host, port = str(address).rsplit(":", 1)
+    return socket.AF_INET, (host, int(port))
+
+def _remove_stale_socket(path: str) -> None:
+    """Unlink the socket a server that did not close left behind at path, a server still listening on it is an error."""
+    try:
+        if(not stat.S_ISSOCK(os.stat(path).st_mode)):
+            return                      # not a socket, bind() reports it
+    except OSError:
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise OSError(errno.EADDRINUSE, f"a server is already listening on {path}")
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while(len(data) < size):
+        chunk = sock.recv(size - len(data))
+        if(not chunk):
+            raise ConnectionError("connection closed")
+        data += chunk
+    return bytes(data)
+
+
+class Subscriber:
+    """One connected client: its channel subset, bounded frame queue, sender thread and counters."""
+
+    def __init__(self, server, sock: socket.socket, peer, channels: numpy.ndarray, policy: int, queue_size: int):
+        self._server = server
+        self._socket = sock
+        self._peer = peer
+        self._channels: numpy.ndarray = channels            # None for every channel
+        self._policy: int = policy
+        self._queue_size: int = queue_size
+        self._queue = collections.deque()
+        self._condition = threading.Condition()
+        self._dropped_since_send: bool = False
+        self._closed: bool = False
+        self._connected_at: float = time.monotonic()
+
+        self._frames_sent: int = 0
+        self._bytes_sent: int = 0
+        self._frames_dropped: int = 0
+        self._queue_high_water: int = 0
+
+        self._thread = threading.Thread(target = self._sender)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def channels(self) -> numpy.ndarray:
+        return self._channels
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self._connected_at
+        return {
+            "peer": str(self._peer),
+            "channels": len(self._channels) if self._channels is not None else None,
+            "policy": "disconnect" if self._policy == POLICY_DISCONNECT else "drop_oldest",
+            "frames_sent": self._frames_sent,
+            "bytes_sent": self._bytes_sent,
+            "frames_dropped": self._frames_dropped,
+            "frames_per_second": self._frames_sent / elapsed if elapsed > 0 else 0.0,
+            "megabytes_per_second": self._bytes_sent / elapsed / 1e6 if elapsed > 0 else 0.0,
+            "queue_depth": len(self._queue),
+            "queue_high_water": self._queue_high_water,
+            "connected_seconds": elapsed,
+        }
+
+    def offer(self, frame: bytes) -> None:
+        """Queue a frame without ever blocking, applying the overflow policy."""
+        with self._condition:
+            if(self._closed):
+                return
+            if(len(self._queue) >= self._queue_size):
+                self._frames_dropped += 1
+                if(self._policy == POLICY_DISCONNECT):
+                    self._close_locked()
+                    return
+                self._queue.popleft()
+                self._dropped_since_send = True
+            self._queue.append(frame)
+            self._queue_high_water = max(self._queue_high_water, len(self._queue))
+            self._condition.notify()
+
+    def close(self) -> None:
+        with self._condition:
+            self._close_locked()
+
+    def _close_locked(self) -> None:
+        if(not self._closed):
+            self._closed = True
+            self._queue.clear()
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._condition.notify()
+
+    def _sender(self) -> None:
+        try:
+            while(True):
+                with self._condition:
+                    while(not self._queue and not self._closed):
+                        self._condition.wait()
+                    if(self._closed):
+                        break
+                    # everything queued goes out in one send
+                    frames = list(self._queue)
+                    self._queue.clear()
+                    dropped = self._dropped_since_send
+                    self._dropped_since_send = False
+                if(dropped):
+                    first = bytearray(frames[0])
+                    first[FRAME_HEADER.size - 1] |= FLAG_DROPPED
+                    frames[0] = bytes(first)
+                data = b''.join(frames)
+                self._socket.sendall(data)
+                self._frames_sent += len(frames)
+                self._bytes_sent += len(data)
+        except OSError:
+            pass
+        finally:
+            self.close()
+            self._socket.close()
+            self._server._remove(self)
+
+
+class StreamServer:
+    """
+    Serves captures to subscribers, fed by a SpectroData capture listener or by publish() calls.\n
+    Pass spec_data to subscribe to it right away, the server then unsubscribes itself on close().
+    Subscribers may ask for a queue of up to max_queue_size frames."""
+
+    def __init__(self, address, spec_data = None, num_points: int = 135, queue_size: int = 256, max_subscribers: int = 32,
+                 max_queue_size: int = 4096):
+        self._family, self._address = parse_address(address)
+        self._num_points: int = spec_data.num_points if spec_data is not None else num_points
+        self._queue_size: int = queue_size
+        self._max_queue_size: int = max(max_queue_size, queue_size)
+        self._max_subscribers: int = max_subscribers
+        self._subscribers: list = list()
+        self._lock = threading.Lock()
+        self._sequence: int = 0
+        self._closed: bool = False
+
+        self._socket = socket.socket(self._family, socket.SOCK_STREAM)
+        if(self._family == socket.AF_INET):
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        else:
+            _remove_stale_socket(self._address)
+        self._socket.bind(self._address)
+        self._socket.listen()
+        self._accept_thread = threading.Thread(target = self._accept)
+        self._accept_thread.daemon = True
+        self._accept_thread.start()
+
+        self._spec_data = spec_data
+        if(spec_data is not None):
+            spec_data.add_capture_listener(self.publish)
+
+    @property
+    def address(self):
+        """Bound address, with the real port when bound to port 0."""
+        return self._socket.getsockname()
+    @property
+    def subscribers(self) -> list:
+        return list(self._subscribers)
+    @property
+    def frames_published(self) -> int:
+        return self._sequence
+
+    def stats(self) -> list:
+        return [subscriber.stats() for subscriber in self._subscribers]
+
+    def publish(self, timestamp_ns: int, info) -> None:
+        """Capture listener: info is a SpectrumInfo."""
+        self.publish_spectrum(timestamp_ns, info.SpectrumArray, info.IntegrationTime, info.IsSaturated)
+
+    def publish_spectrum(self, timestamp_ns: int, spectrum: numpy.ndarray, integration_time: int = 0, saturated: bool = False) -> None:
+        sequence = self._sequence
+        self._sequence += 1
+        subscribers = self._subscribers
+        if(not subscribers):
+            return
+        spectrum = numpy.asarray(spectrum, dtype = '<f4')
+        # every distinct channel subset is encoded once per capture
+        frames = dict()
+        for subscriber in subscribers:
+            key = None if subscriber.channels is None else subscriber.channels.tobytes()
+            frame = frames.get(key)
+            if(frame is None):
+                values = spectrum if subscriber.channels is None else spectrum[subscriber.channels]
+                frame = FRAME_HEADER.pack(FRAME_MAGIC, len(values), sequence, timestamp_ns, integration_time, bool(saturated), 0) + values.tobytes()
+                frames[key] = frame
+            subscriber.offer(frame)
+
+    def close(self) -> None:
+        if(self._closed):
+            return
+        self._closed = True
+        if(self._spec_data is not None):
+            self._spec_data.remove_capture_listener(self.publish)
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+        for subscriber in self.subscribers:
+            subscriber.close()
+        if(self._family == socket.AF_UNIX):
+            try:
+                os.unlink(self._address)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _accept(self) -> None:
+        while(not self._closed):
+            try:
+                sock, peer = self._socket.accept()
+            except OSError:
+                break
+            # the handshake runs on its own thread, a client that never sends its request holds up nobody
+            threading.Thread(target = self._handshake, args = (sock, peer), daemon = True).start()
+
+    def _handshake(self, sock: socket.socket, peer) -> None:
+        try:
+            sock.settimeout(5.0)
+            magic, version, policy, _, channel_count, queue_size = SUBSCRIBE.unpack(_recv_exactly(sock, SUBSCRIBE.size))
+            if(magic != SUBSCRIBE_MAGIC or version != PROTOCOL_VERSION or policy not in POLICIES.values()):
+                raise ValueError("bad subscribe request")
+            channels = None
+            if(channel_count):
+                channels = numpy.frombuffer(_recv_exactly(sock, 2 * channel_count), dtype = '<u2').astype(numpy.intp)
+                if(channels.max() >= self._num_points):
+                    raise ValueError("channel out of range")
+            with self._lock:
+                if(len(self._subscribers) >= self._max_subscribers or self._closed):
+                    raise ValueError("no more subscribers")
+                sock.sendall(HELLO.pack(HELLO_MAGIC, PROTOCOL_VERSION, channel_count or self._num_points, self._num_points))
+                sock.settimeout(None)
+                if(self._family == socket.AF_INET):
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                subscriber = Subscriber(self, sock, peer, channels, policy, min(queue_size or self._queue_size, self._max_queue_size))
+                # copied on write, publish() iterates the list without the lock
+                self._subscribers = self._subscribers + [subscriber]
+        except (OSError, ValueError, struct.error):
+            sock.close()
+
+    def _remove(self, subscriber: Subscriber) -> None:
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s is not subscriber]
+
+
+class StreamClient:
+    """
+    Subscribes to a StreamServer. read() returns every frame that has arrived as one numpy record array
+    (see frame_dtype), parsed in place from the receive buffer."""
+
+    def __init__(self, address, channels = None, policy: str = "drop_oldest", queue_size: int = 0, timeout: float = None):
+        family, address = parse_address(address)
+        if(family == socket.AF_INET and address[0] == "0.0.0.0"):
+            address = ("127.0.0.1", address[1])
+        self._socket = socket.socket(family, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        self._socket.connect(address)
+        channels = [] if channels is None else list(channels)
+        self._socket.sendall(SUBSCRIBE.pack(SUBSCRIBE_MAGIC, PROTOCOL_VERSION, POLICIES[policy], 0, len(channels), queue_size)
+                             + numpy.asarray(channels, dtype = '<u2').tobytes())
+        magic, version, self._channels, self._num_points = HELLO.unpack(_recv_exactly(self._socket, HELLO.size))
+        if(magic != HELLO_MAGIC or version != PROTOCOL_VERSION):
+            raise ConnectionError("not a SpectroPPG stream server")
+        self._dtype = frame_dtype(self._channels)
+        self._buffer = bytearray()
+        self._frames_received: int = 0
+        self._bytes_received: int = 0
+        self._frames_missed: int = 0
+        self._next_sequence: int = None
+
+    @property
+    def channels(self) -> int:
+        return self._channels
+    @property
+    def num_points(self) -> int:
+        return self._num_points
+    @property
+    def frame_size(self) -> int:
+        return self._dtype.itemsize
+    @property
+    def frames_received(self) -> int:
+        return self._frames_received
+    @property
+    def bytes_received(self) -> int:
+        return self._bytes_received
+    @property
+    def frames_missed(self) -> int:
+        """Gaps in the sequence numbers, frames the server dropped for this client."""
+        return self._frames_missed
+
+    def read(self, max_bytes: int = 1 << 20) -> numpy.ndarray:
+        """Block until at least one whole frame arrived, returns all complete frames (empty once the server closed)."""
+        while(len(self._buffer) < self._dtype.itemsize):
+            chunk = self._socket.recv(max_bytes)
+            if(not chunk):
+                return numpy.zeros(0, dtype = self._dtype)
+            self._buffer += chunk
+            self._bytes_received += len(chunk)
+        count = len(self._buffer) // self._dtype.itemsize
+        frames = numpy.frombuffer(bytes(self._buffer[: count * self._dtype.itemsize]), dtype = self._dtype)
+        del self._buffer[: count * self._dtype.itemsize]
+        if(frames['magic'][0] != FRAME_MAGIC):
+            raise ConnectionError("lost frame alignment")
+        sequences = frames['sequence'].astype(numpy.int64)
+        expected = sequences[0] if self._next_sequence is None else self._next_sequence
+        self._frames_missed += int(sequences[-1] - expected + 1 - count)
+        self._next_sequence = int(sequences[-1]) + 1
+        self._frames_received += count
+        return frames
+
+    def __iter__(self):
+        while(True):
+            frames = self.read()
+            if(len(frames) == 0):
+                return
+            yield from frames
+
+    def close(self) -> None:
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def measure_loopback(address = "127.0.0.1:0", subscribers: int = 2, seconds: float = 3.0, channels = None, num_points: int = 135) -> dict:
+    """Publish synthetic spectra as fast as possible to loopback clients, returns the rates each client received."""
+    spectrum = numpy.linspace(0, 1, num_points, dtype = numpy.float32)
+    with StreamServer(address, num_points = num_points, queue_size = 1024) as server:
+        bound = server.address
+        client_address = f"unix:{bound}" if isinstance(bound, str) else f"127.0.0.1:{bound[1]}"
+        clients = [StreamClient(client_address, channels) for _ in range(subscribers)]
+        while(len(server.subscribers) < subscribers):
+            time.sleep(0.01)
+
+        def drain(client):
+            while(len(client.read())):
+                pass
+        threads = [threading.Thread(target = drain, args = (client,), daemon = True) for client in clients]
+        for thread in threads:
+            thread.start()
+        start = time.perf_counter()
+        published = 0
+        while(time.perf_counter() - start < seconds):
+            for _ in range(100):
+                server.publish_spectrum(time.perf_counter_ns(), spectrum)
+            published += 100
+            time.sleep(0)       # let the senders and clients run
+        elapsed = time.perf_counter() - start
+        stats = server.stats()
+    for thread in threads:
+        thread.join(5)
+    result = {
+        "published_per_second": published / elapsed,
+        "clients": [{
+            "frames_per_second": client.frames_received / elapsed,
+            "megabytes_per_second": client.bytes_received / elapsed / 1e6,
+            "frames_missed": client.frames_missed,
+        } for client in clients],
+        "server_dropped": sum(s["frames_dropped"] for s in stats),
+    }
+    for client in clients:
+        client.close()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description = "SpectroPPG capture stream server and test client")
+    commands = parser.add_subparsers(dest = "command", required = True)
+    serve = commands.add_parser("serve", help = "capture from a sensor and serve the captures")
+    serve.add_argument("address", help = "host:port, port (loopback only) or unix:/path to listen on, 0.0.0.0:port serves the network")
+    serve.add_argument("--port", required = True, help = "serial port of the sensor, or \"sim\" for the simulator")
+    serve.add_argument("--queue-size", type = int, default = 256)
+    client = commands.add_parser("client", help = "subscribe and print the receive rate every second")
+    client.add_argument("address")
+    client.add_argument("--channels", type = lambda text: [int(c) for c in text.split(",")], help = "comma separated channel subset")
+    client.add_argument("--policy", choices = list(POLICIES), default = "drop_oldest")
+    loopback = commands.add_parser("loopback", help = "measure the server's sustained rate to local clients")
+    loopback.add_argument("--address", default = "127.0.0.1:0")
+    loopback.add_argument("--subscribers", type = int, default = 2)
+    loopback.add_argument("--seconds", type = float, default = 3.0)
+    loopback.add_argument("--channels", type = lambda text: [int(c) for c in text.split(",")])
+    args = parser.parse_args()
+
+    if(args.command == "serve"):
+        from SpectroData import SpectroData
+        from SpectroCapture import open_device
+        spec_data = SpectroData(open_device(args.port))
+        server = StreamServer(args.address, spec_data, queue_size = args.queue_size)
+        spec_data.capture_running = True
+        try:
+            while(True):
+                time.sleep(5)
+                for stats in server.stats():
+                    print(f"{stats['peer']}: {stats['frames_per_second']:.1f} frames/s, {stats['frames_dropped']} dropped, queue {stats['queue_depth']}", file = sys.stderr)
+        except KeyboardInterrupt:
+            pass
+        server.close()
+        spec_data.close()
+    elif(args.command == "client"):
+        with StreamClient(args.address, args.channels, args.policy) as stream:
+            last_time, last_frames = time.monotonic(), 0
+            while(len(stream.read())):
+                now = time.monotonic()
+                if(now - last_time >= 1.0):
+                    print(f"{(stream.frames_received - last_frames) / (now - last_time):.1f} frames/s, {stream.frames_missed} missed")
+                    last_time, last_frames = now, stream.frames_received
+    else:
+        result = measure_loopback(args.address, args.subscribers, args.seconds, args.channels)
+        print(f"published: {result['published_per_second']:.0f} frames/s, server dropped {result['server_dropped']}")
+        for i, client in enumerate(result["clients"]):
+            print(f"client {i}: {client['frames_per_second']:.0f} frames/s, {client['megabytes_per_second']:.1f} MB/s, {client['frames_missed']} missed")
+
+if __name__ == "__main__":
+    main()
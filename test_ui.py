@@ -38,6 +38,11 @@ class Ui_MainWindow(object):
         self.label.setObjectName("label")
         self.horizontalLayout_3.addWidget(self.label)
         self.gridLayout_7.addLayout(self.horizontalLayout_3, 1, 0, 1, 1)
+        self.slider_review = QtWidgets.QSlider(self.horizontalFrame)
+        self.slider_review.setVisible(False)
+        self.slider_review.setOrientation(QtCore.Qt.Horizontal)
+        self.slider_review.setObjectName("slider_review")
+        self.gridLayout_7.addWidget(self.slider_review, 5, 0, 1, 1)
         self.horizontalLayout_4 = QtWidgets.QHBoxLayout()
         self.horizontalLayout_4.setObjectName("horizontalLayout_4")
         self.label_3 = QtWidgets.QLabel(self.horizontalFrame)
@@ -46,6 +51,11 @@ class Ui_MainWindow(object):
         self.horizontalLayout_4.addWidget(self.label_3)
         spacerItem = QtWidgets.QSpacerItem(40, 20, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Minimum)
         self.horizontalLayout_4.addItem(spacerItem)
+        self.label_heart_rate = QtWidgets.QLabel(self.horizontalFrame)
+        self.label_heart_rate.setObjectName("label_heart_rate")
+        self.horizontalLayout_4.addWidget(self.label_heart_rate)
+        spacerItem1 = QtWidgets.QSpacerItem(40, 20, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Minimum)
+        self.horizontalLayout_4.addItem(spacerItem1)
         self.label_capture_ps = QtWidgets.QLabel(self.horizontalFrame)
         self.label_capture_ps.setObjectName("label_capture_ps")
         self.horizontalLayout_4.addWidget(self.label_capture_ps)
@@ -72,6 +82,16 @@ class Ui_MainWindow(object):
         self.button_connect.setMaximumSize(QtCore.QSize(85, 27))
         self.button_connect.setObjectName("button_connect")
         self.horizontalLayout_5.addWidget(self.button_connect)
+        self.button_open_recording = QtWidgets.QPushButton(self.horizontalFrame_3)
+        self.button_open_recording.setMinimumSize(QtCore.QSize(85, 27))
+        self.button_open_recording.setMaximumSize(QtCore.QSize(85, 27))
+        self.button_open_recording.setObjectName("button_open_recording")
+        self.horizontalLayout_5.addWidget(self.button_open_recording)
+        self.button_latency = QtWidgets.QPushButton(self.horizontalFrame_3)
+        self.button_latency.setMinimumSize(QtCore.QSize(85, 27))
+        self.button_latency.setMaximumSize(QtCore.QSize(85, 27))
+        self.button_latency.setObjectName("button_latency")
+        self.horizontalLayout_5.addWidget(self.button_latency)
         self.gridLayout_7.addWidget(self.horizontalFrame_3, 0, 0, 1, 1)
         self.frame = QtWidgets.QFrame(self.horizontalFrame)
         self.frame.setFrameShape(QtWidgets.QFrame.NoFrame)
@@ -84,8 +104,8 @@ class Ui_MainWindow(object):
         self.button_startstop.setMaximumSize(QtCore.QSize(86, 27))
         self.button_startstop.setObjectName("button_startstop")
         self.horizontalLayout_2.addWidget(self.button_startstop)
-        spacerItem1 = QtWidgets.QSpacerItem(40, 20, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Minimum)
-        self.horizontalLayout_2.addItem(spacerItem1)
+        spacerItem2 = QtWidgets.QSpacerItem(40, 20, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Minimum)
+        self.horizontalLayout_2.addItem(spacerItem2)
         self.label_2 = QtWidgets.QLabel(self.frame)
         self.label_2.setObjectName("label_2")
         self.horizontalLayout_2.addWidget(self.label_2)
@@ -104,6 +124,12 @@ class Ui_MainWindow(object):
         self.channel_lcd.setProperty("value", 60.0)
         self.channel_lcd.setObjectName("channel_lcd")
         self.horizontalLayout_2.addWidget(self.channel_lcd)
+        self.spinbox_wavelength = QtWidgets.QSpinBox(self.frame)
+        self.spinbox_wavelength.setEnabled(False)
+        self.spinbox_wavelength.setKeyboardTracking(False)
+        self.spinbox_wavelength.setMaximum(2000)
+        self.spinbox_wavelength.setObjectName("spinbox_wavelength")
+        self.horizontalLayout_2.addWidget(self.spinbox_wavelength)
         self.gridLayout_7.addWidget(self.frame, 3, 0, 1, 1)
         self.gridLayout = QtWidgets.QGridLayout()
         self.gridLayout.setObjectName("gridLayout")
@@ -194,17 +220,23 @@ class Ui_MainWindow(object):
         self.label_18.setObjectName("label_18")
         self.verticalLayout_4.addWidget(self.label_18)
         self.spinbox_fw_length = QtWidgets.QSpinBox(self.verticalFrame1)
+        self.spinbox_fw_length.setMinimum(2)
+        self.spinbox_fw_length.setMaximum(99)
+        self.spinbox_fw_length.setProperty("value", 11)
         self.spinbox_fw_length.setObjectName("spinbox_fw_length")
         self.verticalLayout_4.addWidget(self.spinbox_fw_length)
         self.label_17 = QtWidgets.QLabel(self.verticalFrame1)
         self.label_17.setObjectName("label_17")
         self.verticalLayout_4.addWidget(self.label_17)
         self.spinbox_filter_po = QtWidgets.QSpinBox(self.verticalFrame1)
+        self.spinbox_filter_po.setMinimum(0)
+        self.spinbox_filter_po.setMaximum(10)
+        self.spinbox_filter_po.setProperty("value", 3)
         self.spinbox_filter_po.setObjectName("spinbox_filter_po")
         self.verticalLayout_4.addWidget(self.spinbox_filter_po)
         self.verticalLayout_3.addWidget(self.verticalFrame1)
         self.verticalFrame2 = QtWidgets.QFrame(self.verticalFrame)
-        self.verticalFrame2.setMaximumSize(QtCore.QSize(132, 114))
+        self.verticalFrame2.setMaximumSize(QtCore.QSize(132, 182))
         self.verticalFrame2.setFrameShape(QtWidgets.QFrame.Box)
         self.verticalFrame2.setObjectName("verticalFrame2")
         self.verticalLayout = QtWidgets.QVBoxLayout(self.verticalFrame2)
@@ -223,6 +255,13 @@ class Ui_MainWindow(object):
         self.button_export_all = QtWidgets.QPushButton(self.verticalFrame2)
         self.button_export_all.setObjectName("button_export_all")
         self.verticalLayout.addWidget(self.button_export_all)
+        self.button_export_recording = QtWidgets.QPushButton(self.verticalFrame2)
+        self.button_export_recording.setObjectName("button_export_recording")
+        self.verticalLayout.addWidget(self.button_export_recording)
+        self.button_record = QtWidgets.QPushButton(self.verticalFrame2)
+        self.button_record.setCheckable(True)
+        self.button_record.setObjectName("button_record")
+        self.verticalLayout.addWidget(self.button_record)
         self.verticalLayout_3.addWidget(self.verticalFrame2)
         self.verticalFrame3 = QtWidgets.QFrame(self.verticalFrame)
         self.verticalFrame3.setMaximumSize(QtCore.QSize(132, 99999))
@@ -258,6 +297,9 @@ class Ui_MainWindow(object):
         self.checkbox_auto_scale.setChecked(True)
         self.checkbox_auto_scale.setObjectName("checkbox_auto_scale")
         self.verticalLayout_5.addWidget(self.checkbox_auto_scale)
+        self.checkbox_time_axis = QtWidgets.QCheckBox(self.verticalFrame3)
+        self.checkbox_time_axis.setObjectName("checkbox_time_axis")
+        self.verticalLayout_5.addWidget(self.checkbox_time_axis)
         self.checkbox_show_average = QtWidgets.QCheckBox(self.verticalFrame3)
         self.checkbox_show_average.setObjectName("checkbox_show_average")
         self.verticalLayout_5.addWidget(self.checkbox_show_average)
@@ -277,8 +319,8 @@ class Ui_MainWindow(object):
         self.lcd_channel_average.setObjectName("lcd_channel_average")
         self.verticalLayout_5.addWidget(self.lcd_channel_average)
         self.verticalLayout_3.addWidget(self.verticalFrame3)
-        spacerItem2 = QtWidgets.QSpacerItem(20, 40, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
-        self.verticalLayout_3.addItem(spacerItem2)
+        spacerItem3 = QtWidgets.QSpacerItem(20, 40, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
+        self.verticalLayout_3.addItem(spacerItem3)
         self.horizontalLayout_21.addWidget(self.verticalFrame)
         self.gridLayout_8.addWidget(self.horizontalFrame, 0, 1, 1, 1)
         self.verticalFrame4 = QtWidgets.QFrame(self.centralwidget)
@@ -319,9 +361,28 @@ class Ui_MainWindow(object):
         self.button_mca_clear.setObjectName("button_mca_clear")
         self.horizontalLayout_6.addWidget(self.button_mca_clear)
         self.verticalLayout_2.addLayout(self.horizontalLayout_6)
+        self.horizontalLayout_mca_weight = QtWidgets.QHBoxLayout()
+        self.horizontalLayout_mca_weight.setObjectName("horizontalLayout_mca_weight")
+        self.label_mca_weight = QtWidgets.QLabel(self.verticalFrame4)
+        self.label_mca_weight.setObjectName("label_mca_weight")
+        self.horizontalLayout_mca_weight.addWidget(self.label_mca_weight)
+        self.spinbox_mca_weight = QtWidgets.QDoubleSpinBox(self.verticalFrame4)
+        self.spinbox_mca_weight.setDecimals(2)
+        self.spinbox_mca_weight.setMaximum(10.0)
+        self.spinbox_mca_weight.setSingleStep(0.1)
+        self.spinbox_mca_weight.setProperty("value", 1.0)
+        self.spinbox_mca_weight.setObjectName("spinbox_mca_weight")
+        self.horizontalLayout_mca_weight.addWidget(self.spinbox_mca_weight)
+        self.verticalLayout_2.addLayout(self.horizontalLayout_mca_weight)
         self.checkbox_enable_mca = QtWidgets.QCheckBox(self.verticalFrame4)
         self.checkbox_enable_mca.setObjectName("checkbox_enable_mca")
         self.verticalLayout_2.addWidget(self.checkbox_enable_mca)
+        self.combo_mca_combiner = QtWidgets.QComboBox(self.verticalFrame4)
+        self.combo_mca_combiner.setObjectName("combo_mca_combiner")
+        self.combo_mca_combiner.addItem("")
+        self.combo_mca_combiner.addItem("")
+        self.combo_mca_combiner.addItem("")
+        self.verticalLayout_2.addWidget(self.combo_mca_combiner)
         self.gridLayout_8.addWidget(self.verticalFrame4, 0, 0, 1, 1)
         MainWindow.setCentralWidget(self.centralwidget)
 
@@ -334,12 +395,18 @@ class Ui_MainWindow(object):
         self.label_channel.setText(_translate("MainWindow", "Channel History"))
         self.label.setText(_translate("MainWindow", "Live Spectrum"))
         self.label_3.setText(_translate("MainWindow", "Capture time avg (ms): 000"))
+        self.label_heart_rate.setText(_translate("MainWindow", "Heart rate (bpm): --"))
         self.label_capture_ps.setText(_translate("MainWindow", "Captures per second:  00"))
         self.label_4.setText(_translate("MainWindow", "Port:"))
         self.button_refresh.setText(_translate("MainWindow", "Refresh"))
         self.button_connect.setText(_translate("MainWindow", "Connect"))
+        self.button_open_recording.setText(_translate("MainWindow", "Review..."))
+        self.button_latency.setText(_translate("MainWindow", "Latency..."))
         self.button_startstop.setText(_translate("MainWindow", "Start"))
         self.label_2.setText(_translate("MainWindow", "Channel Select:"))
+        self.spinbox_wavelength.setToolTip(_translate("MainWindow", "Select the channel nearest a wavelength, once the sensor calibration is known"))
+        self.spinbox_wavelength.setSpecialValueText(_translate("MainWindow", "-- nm"))
+        self.spinbox_wavelength.setSuffix(_translate("MainWindow", " nm"))
         self.label_13.setText(_translate("MainWindow", "Sensor Controls"))
         self.checkbox_auto_ae.setText(_translate("MainWindow", "Auto AE"))
         self.label_15.setText(_translate("MainWindow", "Frame Average:"))
@@ -352,9 +419,14 @@ class Ui_MainWindow(object):
         self.label_5.setText(_translate("MainWindow", "Export Data"))
         self.button_export_channel.setText(_translate("MainWindow", "Channel CSV"))
         self.button_export_all.setText(_translate("MainWindow", "Full History"))
+        self.button_export_recording.setToolTip(_translate("MainWindow", "Export a recording file to CSV or NumPy"))
+        self.button_export_recording.setText(_translate("MainWindow", "Recording..."))
+        self.button_record.setToolTip(_translate("MainWindow", "Stream every capture to a recording file"))
+        self.button_record.setText(_translate("MainWindow", "Record"))
         self.label_6.setText(_translate("MainWindow", "Channel Graph"))
         self.label_7.setText(_translate("MainWindow", "Zoom:"))
         self.checkbox_auto_scale.setText(_translate("MainWindow", "Auto Scale"))
+        self.checkbox_time_axis.setText(_translate("MainWindow", "Time Axis (s)"))
         self.checkbox_show_average.setText(_translate("MainWindow", "Show Average"))
         self.label_8.setText(_translate("MainWindow", "Marked Channels"))
         __sortingEnabled = self.list_mca.isSortingEnabled()
@@ -368,5 +440,11 @@ class Ui_MainWindow(object):
         self.list_mca.setSortingEnabled(__sortingEnabled)
         self.button_mca_mark.setText(_translate("MainWindow", "Mark"))
         self.button_mca_clear.setText(_translate("MainWindow", "Clear"))
+        self.label_mca_weight.setText(_translate("MainWindow", "Weight:"))
+        self.spinbox_mca_weight.setToolTip(_translate("MainWindow", "Weight of the selected marked channel in the weighted mean"))
         self.checkbox_enable_mca.setText(_translate("MainWindow", "Enable MCA"))
+        self.combo_mca_combiner.setToolTip(_translate("MainWindow", "How the marked channels are combined"))
+        self.combo_mca_combiner.setItemText(0, _translate("MainWindow", "Mean"))
+        self.combo_mca_combiner.setItemText(1, _translate("MainWindow", "Weighted mean"))
+        self.combo_mca_combiner.setItemText(2, _translate("MainWindow", "Median"))
 from pyqtgraph import PlotWidget
@@ -0,0 +1,84 @@
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+import os
+import sys
+import time
+import numpy
+import pytest
+
+# the modules live flat in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from NSP32Simulator import VirtualNSP32
+from SpectroData import SpectroData
+from SpectroRecorder import SpectroRecorder, record_dtype
+
+
+class LossyNSP32(VirtualNSP32):
+    """VirtualNSP32 that ignores the first drop_commands[code] commands of each command code, as if their replies were lost."""
+
+    def __init__(self, drop_commands: dict = None, **simulator_args):
+        super().__init__(**simulator_args)
+        self.drop_commands: dict = dict(drop_commands or {})
+
+    def _handle_command(self, cmd: bytes, now: float) -> None:
+        if(self.drop_commands.get(cmd[2], 0) > 0):
+            self.drop_commands[cmd[2]] -= 1
+            return
+        super()._handle_command(cmd, now)
+
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while(not condition()):
+        if(time.monotonic() > deadline):
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def write_recording(path: str, count: int = 100, sensor: VirtualNSP32 = None, **recorder_args) -> numpy.ndarray:
+    """Record count simulated captures 20 ms apart to path, returns the records as written (record_dtype)."""
+    sensor = sensor if sensor is not None else VirtualNSP32(seed = 0)
+    recorder = SpectroRecorder(path, len(sensor.wavelengths), **recorder_args)
+    records = numpy.zeros(count, dtype = record_dtype(len(sensor.wavelengths)))
+    records['timestamp_ns'] = time.perf_counter_ns() + numpy.arange(count) * 20_000_000
+    records['integration_time'] = 20 + numpy.arange(count) % 3
+    records['saturated'] = numpy.arange(count) % 7 == 0
+    records['spectrum'] = [sensor.spectrum_at(i * 0.02) for i in range(count)]
+    for record in records:
+        assert recorder.add(int(record['timestamp_ns']), int(record['integration_time']), bool(record['saturated']), record['spectrum'])
+    recorder.close()
+    return records
+
+
+@pytest.fixture
+def spec_data_factory():
+    """Builds SpectroData on simulated sensors and closes them after the test."""
+    opened = list()
+
+    def factory(sensor = None, **spectro_args) -> SpectroData:
+        spec_data = SpectroData(sensor if sensor is not None else VirtualNSP32(seed = 0), **spectro_args)
+        opened.append(spec_data)
+        return spec_data
+
+    yield factory
+    for spec_data in opened:
+        spec_data.close()
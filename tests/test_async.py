@@ -0,0 +1,99 @@
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+
+import sys
+import asyncio
+import numpy
+import pytest
+import NSP32Async
+from NSP32Async import open_nsp32, build_command
+from NanoLambdaNSP32 import CmdCodeEnum
+from NSP32Simulator import VirtualNSP32
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason = "NSP32Async is POSIX only")
+
+
+def test_commands_and_their_replies():
+    async def run():
+        async with await open_nsp32("sim", seed = 0) as sensor:
+            sensor_id = await sensor.get_sensor_id()
+            # commands from concurrent tasks each get their own reply
+            _, wavelengths, info, _ = await asyncio.gather(sensor.hello(), sensor.get_wavelength(), sensor.acq_spectrum(10), sensor.standby())
+            return sensor_id, wavelengths, info, sensor.pending, sensor.unmatched_packets
+    sensor_id, wavelengths, info, pending, unmatched = asyncio.run(run())
+    assert sensor_id == "4E-4C-00-00-01"
+    numpy.testing.assert_array_equal(wavelengths, VirtualNSP32().wavelengths)
+    assert info.IntegrationTime == 10 and len(info.SpectrumArray) == 135
+    assert (pending, unmatched) == (0, 0)
+
+
+def test_a_late_reply_never_completes_a_later_command():
+    async def run():
+        async with await open_nsp32("sim", command_latency = 0.3, seed = 0) as sensor:
+            with pytest.raises(TimeoutError):
+                await sensor.hello(timeout = 0.1)
+            await asyncio.sleep(0.4)
+            assert sensor.unmatched_packets == 1
+            assert await sensor.get_sensor_id() == "4E-4C-00-00-01"
+            return sensor.pending
+    assert asyncio.run(run()) == 0
+
+
+@pytest.mark.parametrize("bad_checksum_rate", [0.0, 0.05])
+def test_spectra_stream(bad_checksum_rate):
+    async def run():
+        async with await open_nsp32("sim", baudrate = 0, bad_checksum_rate = bad_checksum_rate, seed = 3) as sensor:
+            spectra = [item async for item in sensor.spectra(5, count = 100, timeout = 0.1)]
+            return spectra, sensor.spectra_lost, sensor.checksum_failures
+    spectra, lost, failures = asyncio.run(run())
+    assert len(spectra) == 100
+    timestamps = [timestamp_ns for timestamp_ns, _ in spectra]
+    assert timestamps == sorted(timestamps)
+    assert all(info.IntegrationTime == 5 for _, info in spectra)
+    if(bad_checksum_rate):
+        # corrupted spectra are replaced by new acquisitions instead of ending the stream
+        assert failures > 0 and lost > 0
+    else:
+        assert (failures, lost) == (0, 0)
+
+
+def test_close_fails_commands_still_waiting():
+    async def run():
+        sensor = await open_nsp32("sim", command_latency = 0.5, seed = 0)
+        command = asyncio.ensure_future(sensor.get_sensor_id())
+        await asyncio.sleep(0.1)
+        sensor.close()
+        with pytest.raises(ConnectionError):
+            await command
+        with pytest.raises(ConnectionError):
+            await sensor.hello()
+    asyncio.run(run())
+
+
+def test_commands_carry_a_valid_checksum():
+    cmd = build_command(CmdCodeEnum.AcqSpectrum, 7, NSP32Async.acquisition_payload(300, 2, True))
+    assert cmd[:4] == bytes((CmdCodeEnum.Prefix0, CmdCodeEnum.Prefix1, CmdCodeEnum.AcqSpectrum, 7))
+    assert cmd[4:6] == (300).to_bytes(2, 'little') and sum(cmd) & 0xFF == 0
+
+
+def test_windows_is_refused(monkeypatch):
+    monkeypatch.setattr(sys, "platform", "win32")
+    with pytest.raises(NotImplementedError):
+        NSP32Async.check_platform()
@@ -0,0 +1,103 @@
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+
+import os
+import numpy
+from NanoLambdaNSP32 import CmdCodeEnum
+from SpectroCalibration import Calibration, CalibrationCache
+from NSP32Simulator import VirtualNSP32
+from conftest import LossyNSP32
+
+
+class CountingNSP32(VirtualNSP32):
+    def __init__(self, **simulator_args):
+        super().__init__(**simulator_args)
+        self.commands: list = list()
+
+    def _handle_command(self, cmd: bytes, now: float) -> None:
+        self.commands.append(cmd[2])
+        super()._handle_command(cmd, now)
+
+
+def test_nearest_channel():
+    calibration = Calibration("NL0001", [400, 410, 405, 430])
+    assert calibration.num_points == 4 and calibration.wavelength_of(2) == 405
+    assert calibration.channel_at(404) == 2
+    assert calibration.channel_at(300) == 0 and calibration.channel_at(1000) == 3
+    numpy.testing.assert_array_equal(calibration.channel_at([401, 409, 421]), [0, 1, 3])
+    assert not calibration.wavelengths.flags.writeable
+
+
+def test_cache_round_trip(tmp_path):
+    cache = CalibrationCache(str(tmp_path / "calibration"))
+    wavelengths = VirtualNSP32().wavelengths
+    assert cache.load("4E-4C-00-00-01") is None
+    assert cache.store(Calibration("4E-4C-00-00-01", wavelengths))
+    assert os.path.basename(cache.path("4E-4C-00-00-01")) == "4E-4C-00-00-01.npy"
+    assert os.path.basename(cache.path("../x y")) == "___x_y.npy"
+    calibration = cache.load("4E-4C-00-00-01")
+    assert calibration.sensor_id == "4E-4C-00-00-01"
+    numpy.testing.assert_array_equal(calibration.wavelengths, wavelengths)
+    assert [name for name in os.listdir(cache.directory) if not name.endswith(".npy")] == []
+
+
+def test_unreadable_cache_entries_are_ignored(tmp_path):
+    cache = CalibrationCache(str(tmp_path))
+    with open(cache.path("truncated"), 'wb') as f:
+        f.write(b'\x93NUMPY')
+    numpy.save(cache.path("floats"), numpy.linspace(340, 1010, 135))
+    assert cache.load("truncated") is None and cache.load("floats") is None
+    # a cache that can not be written is not an error
+    assert not CalibrationCache(cache.path("floats")).store(Calibration("NL0001", [400]))
+
+
+def test_calibration_is_read_once_and_then_cached(spec_data_factory, tmp_path):
+    directory = str(tmp_path / "calibration")
+    first = CountingNSP32(seed = 0)
+    spec_data = spec_data_factory(first, calibration_cache = directory)
+    assert spec_data.wait_calibration(5) is not None and not spec_data.calibration_cached
+    numpy.testing.assert_array_equal(spec_data.wavelengths, first.wavelengths)
+    assert first.commands.count(CmdCodeEnum.GetWavelength) == 1
+
+    second = CountingNSP32(seed = 1)
+    spec_data = spec_data_factory(second, calibration_cache = directory)
+    assert spec_data.wait_calibration(5) is not None and spec_data.calibration_cached
+    numpy.testing.assert_array_equal(spec_data.wavelengths, first.wavelengths)
+    assert CmdCodeEnum.GetWavelength not in second.commands
+
+
+def test_without_a_cache_the_table_is_always_read(spec_data_factory):
+    sensor = CountingNSP32(seed = 0)
+    spec_data = spec_data_factory(sensor)
+    assert spec_data.wait_calibration(5) is not None and not spec_data.calibration_cached
+    assert sensor.commands.count(CmdCodeEnum.GetWavelength) == 1
+
+
+def test_lost_wavelength_reply_is_requested_again(spec_data_factory):
+    sensor = LossyNSP32({CmdCodeEnum.GetWavelength: 1}, seed = 0)
+    spec_data = spec_data_factory(sensor)
+    assert spec_data.wait_calibration(5) is not None
+    numpy.testing.assert_array_equal(spec_data.wavelengths, sensor.wavelengths)
+
+
+def test_table_of_another_size_is_ignored(spec_data_factory, capsys):
+    spec_data = spec_data_factory(VirtualNSP32(seed = 0), num_points = 100)
+    assert spec_data.wait_calibration(0.5) is None
+    assert "calibration ignored" in capsys.readouterr().out
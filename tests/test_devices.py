@@ -0,0 +1,93 @@
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+
+import numpy
+import pytest
+from SpectroDevices import DeviceManager
+from NSP32Simulator import VirtualNSP32
+from conftest import wait_for
+
+
+def test_devices_capture_side_by_side():
+    with DeviceManager(max_capture_history = 50) as manager:
+        for i in range(3):
+            manager.open(VirtualNSP32(seed = i), f"sim{i}")
+        manager.configure(integration_passes = 10, frame_average = 1)
+        assert all(device.integration_passes == 10 for device in manager.devices.values())
+        manager.capture_running = True
+        assert wait_for(lambda: all(device.captures_taken >= 10 for device in manager.devices.values()))
+        manager.capture_running = False
+        stats = manager.stats()
+        assert stats["total"]["captures_taken"] == sum(stats[name]["captures_taken"] for name in manager.names)
+        assert all(stats[name]["average_captures_per_second"] > 0 for name in manager.names)
+    assert len(manager) == 0
+
+
+def test_default_names_are_not_reused():
+    with DeviceManager() as manager:
+        manager.open(VirtualNSP32(seed = 0))
+        manager.open(VirtualNSP32(seed = 1))
+        manager.close("device0")
+        manager.open(VirtualNSP32(seed = 2))
+        assert manager.names == ["device1", "device2"]
+        with pytest.raises(ValueError):
+            manager.open(VirtualNSP32(seed = 3), "device1")
+
+
+class ClosingNSP32(VirtualNSP32):
+    def __init__(self, **simulator_args):
+        super().__init__(**simulator_args)
+        self.closed: bool = False
+
+    def close(self) -> None:
+        self.closed = True
+        super().close()
+
+
+def test_a_failed_open_closes_the_port_it_opened():
+    opened = list()
+    def factory(port):
+        opened.append(ClosingNSP32(seed = 0))
+        return opened[-1]
+    # SpectroData rejects the argument, after the port was opened
+    with DeviceManager(serial_factory = factory, max_capture_history = 0) as manager:
+        with pytest.raises(AssertionError):
+            manager.open("/dev/ttyUSB0")
+        assert opened[0].closed and len(manager) == 0
+
+        handed_in = ClosingNSP32(seed = 1)
+        with pytest.raises(AssertionError):
+            manager.open(handed_in)
+        assert not handed_in.closed
+        handed_in.close()
+
+
+def test_captures_are_aligned_on_the_reference_device():
+    with DeviceManager(max_capture_history = 10) as manager:
+        reference, other = manager.open(VirtualNSP32(seed = 0), "a"), manager.open(VirtualNSP32(seed = 1), "b")
+        epoch = manager.epoch_ns
+        for i in range(5):
+            reference.add_capture(numpy.full(135, i), epoch + i * 20_000_000)
+        for i, offset_ms in enumerate((1, 19, 45, 61)):
+            other.add_capture(numpy.full(135, 10 + i), epoch + offset_ms * 1_000_000)
+        times_s, rows = manager.aligned(tolerance_ms = 5)
+        numpy.testing.assert_allclose(times_s, numpy.arange(5) * 0.02)
+        numpy.testing.assert_array_equal(rows["a"][:, 0], numpy.arange(5))
+        numpy.testing.assert_array_equal(rows["b"][:, 0], [10, 11, 12, 13, numpy.nan])
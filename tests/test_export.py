@@ -0,0 +1,115 @@
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+
+import os
+import csv
+import numpy
+import pytest
+import SpectroExport
+from SpectroCalibration import Calibration
+from NSP32Simulator import VirtualNSP32
+from conftest import write_recording
+
+
+def simulated_captures(count: int = 50, sensor: VirtualNSP32 = None):
+    sensor = sensor if sensor is not None else VirtualNSP32(seed = 0)
+    timestamps = 5_000_000_000 + numpy.arange(count, dtype = numpy.int64) * 20_000_000
+    return timestamps, numpy.array([sensor.spectrum_at(i * 0.02) for i in range(count)], dtype = numpy.float32)
+
+
+def test_csv(tmp_path):
+    sensor = VirtualNSP32(seed = 1)
+    timestamps, captures = simulated_captures(sensor = sensor)
+    path = str(tmp_path / "captures.csv")
+    assert SpectroExport.export_captures(path, timestamps, captures, [3, 67], sensor.wavelengths) == 50
+    with open(path, newline = '') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["time_s", f"{sensor.wavelengths[3]}nm", f"{sensor.wavelengths[67]}nm"]
+    table = numpy.array(rows[1:], dtype = numpy.float64)
+    numpy.testing.assert_allclose(table[:, 0], numpy.arange(50) * 0.02, atol = 1e-6)
+    numpy.testing.assert_allclose(table[:, 1:], captures[:, [3, 67]], rtol = 1e-6)
+
+
+def test_npy(tmp_path):
+    timestamps, captures = simulated_captures()
+    path = str(tmp_path / "captures.npy")
+    SpectroExport.export_captures(path, timestamps, captures)
+    table = numpy.load(path)
+    assert table.shape == (50, 136)
+    numpy.testing.assert_array_equal(table[:, 1:], captures)
+
+
+def test_npz(tmp_path):
+    sensor = VirtualNSP32(seed = 2)
+    timestamps, captures = simulated_captures(sensor = sensor)
+    path = str(tmp_path / "captures.npz")
+    SpectroExport.export_captures(path, timestamps, captures, range(10, 20), sensor.wavelengths)
+    with numpy.load(path) as archive:
+        numpy.testing.assert_array_equal(archive["spectra"], captures[:, 10:20])
+        numpy.testing.assert_allclose(archive["timestamps_s"], numpy.arange(50) * 0.02)
+        numpy.testing.assert_array_equal(archive["channels"], numpy.arange(10, 20))
+        numpy.testing.assert_array_equal(archive["wavelengths"], sensor.wavelengths)
+
+
+def test_unsupported_format(tmp_path):
+    timestamps, captures = simulated_captures(5)
+    with pytest.raises(ValueError):
+        SpectroExport.export_captures(str(tmp_path / "captures.xls"), timestamps, captures)
+
+
+def test_recording_is_labelled_by_its_own_calibration(tmp_path):
+    sensor = VirtualNSP32(seed = 3)
+    path, labelled, unlabelled = (str(tmp_path / name) for name in ("session.sppg", "labelled.csv", "unlabelled.csv"))
+    records = write_recording(path, 300, sensor, chunk_records = 64, calibration = Calibration("NL0001", sensor.wavelengths))
+    assert SpectroExport.export_recording(labelled, path, [0, 134]) == 300
+    with open(labelled) as f:
+        assert f.readline().strip() == f"time_s,{sensor.wavelengths[0]}nm,{sensor.wavelengths[134]}nm"
+    table = numpy.loadtxt(labelled, delimiter = ",", skiprows = 1)
+    numpy.testing.assert_allclose(table[:, 1:], records['spectrum'][:, [0, 134]], rtol = 1e-6)
+
+    write_recording(path, 10, sensor)
+    SpectroExport.export_recording(unlabelled, path, [0, 134])
+    with open(unlabelled) as f:
+        assert f.readline().strip() == "time_s,ch0,ch134"
+    with pytest.raises(ValueError):
+        SpectroExport.export_recording(unlabelled, path, wavelengths = sensor.wavelengths[:100])
+
+
+@pytest.mark.parametrize("extension", [".csv", ".npy", ".npz"])
+def test_cancelled_export_leaves_no_file(tmp_path, extension):
+    timestamps, captures = simulated_captures(10000)
+    path = str(tmp_path / ("captures" + extension))
+    with open(path, 'w') as f:
+        f.write("previous export")
+    def cancel(fraction):
+        # what ExportJob's progress callback does once the job is cancelled
+        raise SpectroExport.ExportCancelled()
+    with pytest.raises(SpectroExport.ExportCancelled):
+        SpectroExport.export_captures(path, timestamps, captures, progress = cancel)
+    assert os.listdir(tmp_path) == ["captures" + extension]
+    with open(path) as f:
+        assert f.read() == "previous export"
+
+
+def test_export_job_reports_progress(tmp_path):
+    timestamps, captures = simulated_captures(10000)
+    job = SpectroExport.ExportJob(SpectroExport.export_captures, str(tmp_path / "captures.npy"), timestamps, captures)
+    assert job.wait(10)
+    assert job.error is None and job.result == 10000 and job.progress == 1.0
@@ -0,0 +1,87 @@
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+
+import numpy
+import pytest
+from SpectroFilter import FilteredChannel, StreamingSavgol, savgol_coefficients
+from SpectroRecording import SpectroRecording
+from NSP32Simulator import VirtualNSP32
+from conftest import write_recording
+
+
+def reference(samples: numpy.ndarray, window_length: int, polyorder: int) -> numpy.ndarray:
+    coefficients = savgol_coefficients(window_length, polyorder)
+    out = numpy.array(samples, dtype = numpy.float64)
+    for n in range(window_length - 1, len(samples)):
+        out[n] = samples[n - window_length + 1 : n + 1] @ coefficients
+    return out
+
+def simulated_channel(count: int, channel: int = 67) -> numpy.ndarray:
+    sensor = VirtualNSP32(seed = 0)
+    return numpy.array([sensor.spectrum_at(i * 0.02)[channel] for i in range(count)], dtype = numpy.float64)
+
+
+def test_polynomials_up_to_polyorder_pass_unchanged():
+    x = numpy.arange(-10, 1, dtype = numpy.float64)
+    coefficients = savgol_coefficients(11, 3)
+    for power in range(4):
+        assert x ** power @ coefficients == pytest.approx(0.0 ** power, abs = 1e-9)
+    with pytest.raises(ValueError):
+        savgol_coefficients(5, 5)
+
+
+@pytest.mark.parametrize("block", [1, 7, 64, 500])
+def test_streaming_matches_filtering_everything_at_once(block):
+    samples = simulated_channel(400)
+    streaming = StreamingSavgol(100, 11, 3)
+    for start in range(0, len(samples), block):
+        streaming.extend(samples[start : start + block])
+    numpy.testing.assert_allclose(streaming.series, reference(samples, 11, 3)[-100:], rtol = 1e-5)
+
+
+def test_filtered_channel_follows_new_captures(spec_data_factory):
+    samples = simulated_channel(150)
+    spec_data = spec_data_factory(max_capture_history = 60)
+    channel = FilteredChannel(9, 2)
+    for start in range(0, 150, 25):
+        for i in range(start, start + 25):
+            row = numpy.zeros(spec_data.num_points)
+            row[67] = samples[i]
+            spec_data.add_capture(row, i)
+        filtered = channel.update(spec_data, ("channel", 67), lambda rows: rows[:, 67])
+        stop = start + 25
+        numpy.testing.assert_allclose(filtered, reference(samples[:stop], 9, 2)[-min(stop, 60):], rtol = 1e-5)
+
+    # another series starts over from the history that is left
+    filtered = channel.update(spec_data, ("channel", 0), lambda rows: rows[:, 0])
+    numpy.testing.assert_array_equal(filtered, numpy.zeros(60))
+
+
+def test_filtered_channel_restarts_when_a_recording_seeks_back(tmp_path):
+    path = str(tmp_path / "session.sppg")
+    records = write_recording(path, 200, chunk_records = 32)
+    samples = records['spectrum'][:, 67].astype(numpy.float64)
+    channel = FilteredChannel(11, 3)
+    with SpectroRecording(path, window = 50) as recording:
+        # the first update and seeking backwards restart from the window, moving forward continues the stream
+        for position, filtered_from in ((120, 70), (150, 70), (60, 10)):
+            recording.seek(position)
+            filtered = channel.update(recording, "ch67", lambda rows: rows[:, 67])
+            numpy.testing.assert_allclose(filtered, reference(samples[filtered_from : position], 11, 3)[-50:], rtol = 1e-5)
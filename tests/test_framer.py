@@ -0,0 +1,116 @@
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+import numpy
+import pytest
+from NanoLambdaNSP32 import NSP32, CmdCodeEnum, ReturnPacket
+from NSP32Simulator import build_packet, spectrum_packet, wavelength_packet
+
+
+def packet_stream(count: int = 20) -> tuple:
+    """count spectra with a few short replies mixed in, and the spectra they carry."""
+    spectra = [numpy.full(135, i, dtype = numpy.float32) for i in range(count)]
+    stream = bytearray(build_packet(CmdCodeEnum.GetSensorId, 0, b'\x4E\x4C\x00\x00\x01'))
+    stream += wavelength_packet(numpy.arange(135, dtype = numpy.uint16))
+    for i, spectrum in enumerate(spectra):
+        stream += build_packet(CmdCodeEnum.AcqSpectrum, i + 1)
+        stream += spectrum_packet(spectrum, i + 1)
+    return bytes(stream), spectra
+
+def frame(data: bytes, chunk_size: int) -> tuple:
+    packets = list()
+    nsp32 = NSP32(None, packets.append)
+    for start in range(0, len(data), chunk_size):
+        nsp32.OnReturnBytesReceived(data[start : start + chunk_size])
+    return nsp32, packets
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 64, 565, 1 << 20])
+def test_chunking_does_not_change_the_packets(chunk_size):
+    data, spectra = packet_stream()
+    nsp32, packets = frame(data, chunk_size)
+    assert [pkt.CmdCode for pkt in packets[:2]] == [CmdCodeEnum.GetSensorId, CmdCodeEnum.GetWavelength]
+    received = [pkt.ExtractSpectrumInfo().SpectrumArray for pkt in packets if pkt.CmdCode == CmdCodeEnum.GetSpectrum]
+    assert len(received) == len(spectra)
+    for expected, spectrum in zip(spectra, received):
+        numpy.testing.assert_array_equal(spectrum, expected)
+    assert all(pkt.IsPacketValid for pkt in packets)
+    assert nsp32.PacketsEmitted == len(packets)
+    assert nsp32.BytesDiscarded == 0
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_garbage_between_packets_is_discarded(chunk_size):
+    garbage = bytes(range(0x10, 0x40))          # no prefix byte in it
+    good = spectrum_packet(numpy.ones(135, dtype = numpy.float32), 5)
+    nsp32, packets = frame(garbage + good + garbage + good, chunk_size)
+    valid = [pkt for pkt in packets if pkt.IsPacketValid]
+    assert [pkt.UserCode for pkt in valid] == [5, 5]
+    assert nsp32.BytesDiscarded == 2 * len(garbage)
+    assert nsp32.ExpectedBytes > 0
+
+
+def test_corrupted_packet_is_reported_and_the_next_one_received():
+    bad = spectrum_packet(numpy.ones(135, dtype = numpy.float32), 1)
+    bad[-1] ^= 0xFF
+    good = spectrum_packet(numpy.ones(135, dtype = numpy.float32), 2)
+    nsp32, packets = frame(bytes(bad + good), 100)
+    assert nsp32.ChecksumFailures == 1
+    assert [(pkt.UserCode, pkt.IsPacketValid) for pkt in packets if pkt.CmdCode == CmdCodeEnum.GetSpectrum][-1] == (2, True)
+
+
+def test_header_is_notified_before_the_packet_completes():
+    headers = list()
+    nsp32 = NSP32(None, None, lambda cmd, user_code: headers.append((cmd, user_code)))
+    pkt = spectrum_packet(numpy.ones(135, dtype = numpy.float32), 9)
+    nsp32.OnReturnBytesReceived(pkt[:10])
+    assert headers == [(CmdCodeEnum.GetSpectrum, 9)]
+    nsp32.OnReturnBytesReceived(pkt[10:])
+    assert headers == [(CmdCodeEnum.GetSpectrum, 9)]
+
+
+def test_commands_wait_for_their_own_return():
+    sent = list()
+    nsp32 = NSP32(sent.append, None)
+    nsp32.AcqSpectrum(1, 20, 1, False)
+    nsp32.AcqSpectrum(2, 20, 1, False)
+    assert len(sent) == 1 and nsp32.IsWaitingCmdReturn
+
+    # the spectrum of an older acquisition does not return AcqSpectrum 1
+    nsp32._EmitPacket(ReturnPacket(CmdCodeEnum.GetSpectrum, 7, True, b''))
+    assert len(sent) == 1
+    nsp32._EmitPacket(ReturnPacket(CmdCodeEnum.AcqSpectrum, 1, True, b''))
+    assert len(sent) == 2 and sent[1][3] == 2
+
+    # a lost return is given up on explicitly
+    nsp32.AbortWaitingCmd()
+    assert not nsp32.IsWaitingCmdReturn
+    assert nsp32.WaitingCmdAge == 0.0
+
+
+def test_next_command_goes_out_when_the_listener_raises():
+    sent = list()
+    def listener(pkt):
+        raise RuntimeError("listener failed")
+    nsp32 = NSP32(sent.append, listener)
+    nsp32.Hello(0)
+    nsp32.Hello(1)
+    with pytest.raises(RuntimeError):
+        nsp32.OnReturnBytesReceived(build_packet(CmdCodeEnum.Hello, 0))
+    assert len(sent) == 2
@@ -0,0 +1,110 @@
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+
+import time
+import threading
+import numpy
+import pytest
+from SpectroHeartRate import HeartRateEngine
+from NSP32Simulator import VirtualNSP32
+from conftest import wait_for
+
+
+def push_simulated(engine: HeartRateEngine, sensor: VirtualNSP32, seconds: float, rate_hz: float = 50.0, t0_ns: int = 0) -> int:
+    """Push seconds of simulated captures at slightly irregular intervals, waiting whenever the engine's queue is full."""
+    rng = numpy.random.default_rng(0)
+    t = 0.0
+    while(t < seconds):
+        while(not engine.push(t0_ns + int(t * 1e9), sensor.spectrum_at(t))):
+            time.sleep(0.001)
+        t += (1 + rng.uniform(-0.2, 0.2)) / rate_hz
+    return t0_ns + int(t * 1e9)
+
+
+@pytest.mark.parametrize("heart_rate", [54.0, 72.0, 110.0])
+def test_pulse_rate_of_the_simulator(heart_rate):
+    engine = HeartRateEngine(channels = [20, 40, 67], publish_interval = 0)
+    try:
+        push_simulated(engine, VirtualNSP32(heart_rate = heart_rate, seed = 1), 12.0)
+        assert wait_for(lambda: engine.latest is not None and engine.latest.samples > 400)
+        assert engine.latest.bpm == pytest.approx(heart_rate, abs = 2.0)
+    finally:
+        engine.close()
+
+
+@pytest.mark.parametrize("heart_rate", [54.0, 72.0, 110.0])
+def test_beat_intervals_on_well_perfused_channels(heart_rate):
+    # the beat detector needs a clean pulse, the channels around 560 nm carry the strongest one
+    engine = HeartRateEngine(channels = [44, 45, 46], publish_interval = 0)
+    try:
+        push_simulated(engine, VirtualNSP32(heart_rate = heart_rate, noise = 0.0005, seed = 1), 12.0)
+        assert wait_for(lambda: engine.latest is not None and engine.latest.samples > 400)
+        assert engine.latest.peak_bpm == pytest.approx(heart_rate, abs = 3.0)
+    finally:
+        engine.close()
+
+
+def test_new_channels_start_a_new_window():
+    engine = HeartRateEngine(channels = [67], publish_interval = 0)
+    try:
+        sensor = VirtualNSP32(seed = 2)
+        end_ns = push_simulated(engine, sensor, 4.0)
+        assert wait_for(lambda: engine.latest is not None and engine.latest.samples > 150)
+        engine.channels = [10, 67, 10]
+        numpy.testing.assert_array_equal(engine.channels, [10, 67])
+        push_simulated(engine, sensor, 1.0, t0_ns = end_ns)
+        assert wait_for(lambda: engine.latest.timestamp_ns > end_ns)
+        assert engine.latest.samples <= 51
+    finally:
+        engine.close()
+
+
+def test_bad_samples_and_listeners_do_not_stop_the_engine(capsys):
+    engine = HeartRateEngine(channels = [67], publish_interval = 0)
+    readings = list()
+    def failing_listener(reading):
+        raise RuntimeError("listener failed")
+    engine.add_listener(failing_listener)
+    engine.add_listener(readings.append)
+    try:
+        engine.push(0, numpy.zeros(3))          # too short for channel 67
+        push_simulated(engine, VirtualNSP32(seed = 3), 1.0, t0_ns = 1)
+        assert wait_for(lambda: len(readings) > 10)
+    finally:
+        engine.close()
+    assert "listener failed" in capsys.readouterr().out
+
+
+def test_callers_are_not_blocked_by_a_busy_engine():
+    engine = HeartRateEngine(channels = [67], publish_interval = 0, queue_size = 4)
+    release = threading.Event()
+    engine.add_listener(lambda reading: release.wait(5))
+    sensor = VirtualNSP32(seed = 4)
+    for i in range(20):
+        engine.push(i * 20_000_000, sensor.spectrum_at(i * 0.02))
+    assert engine.samples_dropped > 0
+
+    start = time.monotonic()
+    engine.channels = [1, 2]
+    assert time.monotonic() - start < 0.1
+    release.set()
+    start = time.monotonic()
+    engine.close()
+    assert time.monotonic() - start < 2.0 and not engine._thread.is_alive()
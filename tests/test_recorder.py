@@ -0,0 +1,100 @@
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+
+import os
+import numpy
+import pytest
+import SpectroRecorder
+from SpectroCalibration import Calibration
+from NSP32Simulator import VirtualNSP32
+from conftest import write_recording
+
+
+def read_all(path: str) -> numpy.ndarray:
+    with open(path, 'rb') as f:
+        header = SpectroRecorder.read_header(f)
+        index = SpectroRecorder.read_index(f)
+        return numpy.concatenate([SpectroRecorder.read_chunk(f, entry, header["num_points"]) for entry in index])
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_every_capture_is_written_in_chunks(tmp_path, compress):
+    path = str(tmp_path / "session.sppg")
+    records = write_recording(path, 100, chunk_records = 16, compress = compress)
+    with open(path, 'rb') as f:
+        header = SpectroRecorder.read_header(f)
+        index = SpectroRecorder.read_index(f)
+    assert header["num_points"] == 135 and bool(header["flags"] & SpectroRecorder.FLAG_ZLIB) == compress
+    assert list(index['record_count']) == [16] * 6 + [4]
+    assert list(index['first_record']) == list(range(0, 100, 16))
+    numpy.testing.assert_array_equal(index['first_timestamp_ns'], records['timestamp_ns'][::16])
+    numpy.testing.assert_array_equal(read_all(path), records)
+
+
+def test_index_is_rebuilt_without_the_trailer(tmp_path):
+    path = str(tmp_path / "session.sppg")
+    records = write_recording(path, 50, chunk_records = 8)
+    with open(path, 'rb') as f:
+        index = SpectroRecorder.read_index(f)
+    # a recording cut short loses its index and trailer, the chunks are walked instead
+    os.truncate(path, int(index['offset'][-1]) + 1)
+    with open(path, 'rb') as f:
+        assert len(SpectroRecorder.read_index(f)) == len(index) - 1
+    numpy.testing.assert_array_equal(read_all(path), records[:48])
+
+
+def test_calibration_is_stored_with_the_recording(tmp_path):
+    path = str(tmp_path / "session.sppg")
+    sensor = VirtualNSP32(seed = 4)
+    records = write_recording(path, 20, sensor, calibration = Calibration("NL0001", sensor.wavelengths))
+    with open(path, 'rb') as f:
+        calibration = SpectroRecorder.read_calibration(f)
+    assert calibration.sensor_id == "NL0001"
+    numpy.testing.assert_array_equal(calibration.wavelengths, sensor.wavelengths)
+    numpy.testing.assert_array_equal(read_all(path), records)
+
+
+def test_version_1_files_without_calibration_still_read(tmp_path):
+    path = str(tmp_path / "session.sppg")
+    records = write_recording(path, 20)
+    with open(path, 'r+b') as f:
+        f.seek(8)
+        f.write((1).to_bytes(2, 'little'))
+    with open(path, 'rb') as f:
+        assert SpectroRecorder.read_header(f)["version"] == 1
+        assert SpectroRecorder.read_calibration(f) is None
+    numpy.testing.assert_array_equal(read_all(path), records)
+
+
+def test_find_chunk_bisects_on_time(tmp_path):
+    path = str(tmp_path / "session.sppg")
+    records = write_recording(path, 40, chunk_records = 10)
+    with open(path, 'rb') as f:
+        index = SpectroRecorder.read_index(f)
+    timestamps = records['timestamp_ns']
+    assert SpectroRecorder.find_chunk(index, int(timestamps[0]) - 1) == 0
+    assert SpectroRecorder.find_chunk(index, int(timestamps[25])) == 2
+    assert SpectroRecorder.find_chunk(index, int(timestamps[-1]) + 1) == len(index)
+
+
+def test_captures_added_after_close_are_refused(tmp_path):
+    recorder = SpectroRecorder.SpectroRecorder(str(tmp_path / "session.sppg"))
+    recorder.close()
+    assert not recorder.add(0, 20, False, numpy.zeros(135))
@@ -0,0 +1,79 @@
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+
+import numpy
+import pytest
+from SpectroRecording import SpectroRecording
+from conftest import write_recording
+
+
+@pytest.fixture(params = [False, True], ids = ["plain", "zlib"])
+def recorded(request, tmp_path):
+    path = str(tmp_path / "session.sppg")
+    records = write_recording(path, 100, chunk_records = 16, compress = request.param)
+    with SpectroRecording(path, window = 10, cache_chunks = 2) as recording:
+        yield recording, records
+
+
+def test_ranges_across_chunks(recorded):
+    recording, records = recorded
+    assert recording.record_count == 100 and recording.chunk_count == 7
+    for start, stop in [(0, 100), (3, 9), (14, 50), (95, 200), (60, 60)]:
+        numpy.testing.assert_array_equal(recording.records(start, stop), records[start:stop])
+    numpy.testing.assert_array_equal(recording.capture_range(10, 40, [5, 67]), records['spectrum'][10:40][:, [5, 67]])
+    numpy.testing.assert_array_equal(recording.channel_range(67), records['spectrum'][:, 67])
+
+
+def test_uncompressed_ranges_in_one_chunk_are_views(tmp_path):
+    path = str(tmp_path / "session.sppg")
+    write_recording(path, 40, chunk_records = 16)
+    with SpectroRecording(path) as recording:
+        assert not recording.records(2, 10).flags.owndata
+        assert recording.records(10, 20).flags.owndata
+
+
+def test_window_follows_seek(recorded):
+    recording, records = recorded
+    assert recording.position == 10 and recording.window_start == 0
+    assert recording.seek(55) == 55
+    numpy.testing.assert_array_equal(recording.captures, records['spectrum'][45:55])
+    numpy.testing.assert_array_equal(recording.integration_times, records['integration_time'][45:55])
+    snapshot = recording.snapshot()
+    assert snapshot.valid and snapshot.first == 45 and snapshot.sequence == 55
+    numpy.testing.assert_array_equal(recording.since(50).timestamps, records['timestamp_ns'][50:55])
+    assert recording.seek(1000) == 100 and recording.seek(-5) == 0
+    assert len(recording.captures) == 0
+    assert recording.captures_per_second == 0.0
+
+
+def test_time_lookup(recorded):
+    recording, records = recorded
+    start_ns = recording.header["start_counter_ns"]
+    offset_s = (int(records['timestamp_ns'][30]) - start_ns) / 1e9
+    assert recording.record_at(offset_s) == 30
+    assert recording.record_at(offset_s + 0.001) == 31
+    assert recording.record_at(1e6) == 100
+    numpy.testing.assert_array_equal(recording.time_range(offset_s, offset_s + 0.2), records['spectrum'][30:40])
+    assert recording.duration == pytest.approx(99 * 0.02)
+
+
+def test_recording_without_calibration(recorded):
+    recording, records = recorded
+    assert recording.calibration is None
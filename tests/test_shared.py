@@ -0,0 +1,127 @@
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+
+import os
+import sys
+import json
+import subprocess
+import numpy
+import pytest
+from multiprocessing.shared_memory import SharedMemory
+from SpectroShared import SharedCaptureClient, SharedRing
+from conftest import wait_for
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def unique_name(tag: str) -> str:
+    return f"sppg_test_{tag}_{os.getpid()}"
+
+
+def test_client_sees_the_writers_ring(spec_data_factory):
+    spec_data = spec_data_factory(max_capture_history = 20, snapshot_slack = 8, shared_memory = unique_name("ring"))
+    spec_data.capture_running = True
+    assert wait_for(lambda: spec_data.captures_taken >= 30)
+    spec_data.capture_running = False
+    with SharedCaptureClient(spec_data.shared_memory_name) as client:
+        assert (client.num_points, client.capacity, client.max_captures) == (135, 28, 20)
+        ours, theirs = spec_data.snapshot(), client.snapshot()
+        assert ours.sequence == theirs.sequence and theirs.valid
+        numpy.testing.assert_array_equal(theirs.captures, ours.captures)
+        numpy.testing.assert_array_equal(theirs.timestamps, ours.timestamps)
+        numpy.testing.assert_array_equal(theirs.integration_times, ours.integration_times)
+        assert not theirs.captures.flags.writeable
+
+
+def test_snapshots_turn_invalid_when_the_writer_wraps_onto_them(spec_data_factory):
+    spec_data = spec_data_factory(max_capture_history = 8, snapshot_slack = 4, shared_memory = unique_name("wrap"))
+    for i in range(10):
+        spec_data.add_capture(numpy.full(spec_data.num_points, i), i)
+    with SharedCaptureClient(spec_data.shared_memory_name) as client:
+        snapshot = client.snapshot()
+        numpy.testing.assert_array_equal(snapshot.captures[:, 0], numpy.arange(2, 10))
+        for i in range(10, 13):
+            spec_data.add_capture(numpy.full(spec_data.num_points, i), i)
+        assert snapshot.valid
+        spec_data.add_capture(numpy.full(spec_data.num_points, 13), 13)
+        assert not snapshot.valid
+
+
+def test_follow_counts_missed_captures_and_stops_with_the_writer(spec_data_factory):
+    spec_data = spec_data_factory(max_capture_history = 8, snapshot_slack = 4, shared_memory = unique_name("follow"))
+    with SharedCaptureClient(spec_data.shared_memory_name) as client:
+        received = list()
+        follower = client.follow(sequence = 0, poll_interval = 0.001, timeout = 5)
+        for i in range(3):
+            spec_data.add_capture(numpy.full(spec_data.num_points, i), i)
+        received.extend(next(follower).captures[:, 0])
+        for i in range(3, 23):
+            spec_data.add_capture(numpy.full(spec_data.num_points, i), i)
+        received.extend(next(follower).captures[:, 0])
+        spec_data.close()
+        assert list(follower) == []
+        assert received == list(range(3)) + list(range(15, 23))
+        assert client.captures_missed == 12 and client.writer_closed
+
+
+def test_another_process_reads_the_ring(spec_data_factory):
+    spec_data = spec_data_factory(shared_memory = unique_name("process"))
+    for i in range(50):
+        spec_data.add_capture(numpy.arange(spec_data.num_points) + i, 1000 + i)
+    reader = (
+        "import json, sys\n"
+        "from SpectroShared import SharedCaptureClient\n"
+        "client = SharedCaptureClient(sys.argv[1])\n"
+        "snapshot = client.snapshot()\n"
+        "print(json.dumps([snapshot.sequence, snapshot.timestamps.tolist(), float(snapshot.captures.sum()), snapshot.valid]))\n"
+        "client.close()\n"
+    )
+    result = subprocess.run([sys.executable, "-c", reader, spec_data.shared_memory_name], cwd = ROOT,
+                            capture_output = True, text = True, timeout = 30)
+    assert result.returncode == 0, result.stderr
+    sequence, timestamps, total, valid = json.loads(result.stdout)
+    snapshot = spec_data.snapshot()
+    assert (sequence, valid) == (50, True)
+    assert timestamps == snapshot.timestamps.tolist()
+    assert total == pytest.approx(float(snapshot.captures.sum()))
+    # the reader leaving does not take the segment with it
+    assert "leaked" not in result.stderr
+    with SharedCaptureClient(spec_data.shared_memory_name) as client:
+        assert client.sequence == 50
+
+
+def test_segment_is_gone_after_the_writer_closes(spec_data_factory):
+    spec_data = spec_data_factory(shared_memory = unique_name("closed"))
+    name = spec_data.shared_memory_name
+    spec_data.close()
+    with pytest.raises(FileNotFoundError):
+        SharedCaptureClient(name)
+
+
+def test_other_segments_are_refused():
+    ring = SharedRing(unique_name("foreign"), 4, 135, 2)
+    try:
+        memory = SharedMemory(ring.name)
+        memory.buf[:8] = b'NOT RING'
+        memory.close()
+        with pytest.raises(ValueError):
+            SharedCaptureClient(ring.name)
+    finally:
+        ring.close()
@@ -0,0 +1,96 @@
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+import time
+import numpy
+from NanoLambdaNSP32 import CmdCodeEnum
+from NSP32Simulator import VirtualNSP32
+from SpectroRecording import SpectroRecording
+from conftest import LossyNSP32, wait_for
+
+
+def test_captures_and_calibration_from_the_simulator(spec_data_factory):
+    sensor = VirtualNSP32(seed = 1)
+    spec_data = spec_data_factory(sensor)
+    assert spec_data.wait_calibration(5) is not None
+    numpy.testing.assert_array_equal(spec_data.wavelengths, sensor.wavelengths)
+    spec_data.capture_running = True
+    assert wait_for(lambda: spec_data.captures_taken >= 10)
+    spec_data.capture_running = False
+    snapshot = spec_data.snapshot()
+    assert snapshot.valid
+    assert numpy.all(numpy.diff(snapshot.timestamps) > 0)
+
+
+def test_lost_sensor_id_reply_is_requested_again(spec_data_factory):
+    spec_data = spec_data_factory(LossyNSP32({CmdCodeEnum.GetSensorId: 1}, seed = 2))
+    spec_data.capture_running = True
+    # acquisitions are not held up behind the lost reply
+    assert wait_for(lambda: spec_data.captures_taken >= 5, timeout = 3)
+    assert spec_data.wait_calibration(5) is not None
+    assert spec_data.sensor_id is not None
+
+
+def test_watchdog_restarts_after_a_lost_spectrum(spec_data_factory):
+    spec_data = spec_data_factory(LossyNSP32({CmdCodeEnum.AcqSpectrum: 1}, seed = 3))
+    spec_data._acq_timeout = 0.3
+    spec_data.capture_running = True
+    assert wait_for(lambda: spec_data.captures_taken >= 5, timeout = 5)
+
+
+def test_snapshot_stays_valid_until_the_ring_wraps_onto_it(spec_data_factory):
+    spec_data = spec_data_factory(max_capture_history = 8, snapshot_slack = 4)
+    for i in range(20):
+        spec_data.add_capture(numpy.full(spec_data.num_points, i), i)
+    snapshot = spec_data.snapshot()
+    assert len(snapshot) == 8 and snapshot.first == 12
+    numpy.testing.assert_array_equal(snapshot.captures[:, 0], numpy.arange(12, 20))
+    for i in range(20, 23):
+        spec_data.add_capture(numpy.full(spec_data.num_points, i), i)
+    assert snapshot.valid
+    numpy.testing.assert_array_equal(snapshot.captures[:, 0], numpy.arange(12, 20))
+    spec_data.add_capture(numpy.full(spec_data.num_points, 23), 23)
+    assert not snapshot.valid
+    assert spec_data.snapshot().valid
+
+
+def test_recording_round_trip(spec_data_factory, tmp_path):
+    path = str(tmp_path / "session.sppg")
+    spec_data = spec_data_factory()
+    assert spec_data.wait_calibration(5) is not None
+    spec_data.start_recording(path)
+    spec_data.capture_running = True
+    assert wait_for(lambda: spec_data.captures_taken >= 12)
+    spec_data.capture_running = False
+    # the acquisition still in flight is stored and recorded too
+    taken = -1
+    while(taken != spec_data.captures_taken):
+        taken = spec_data.captures_taken
+        time.sleep(0.3)
+    recorder = spec_data.stop_recording()
+    snapshot = spec_data.snapshot()
+
+    with SpectroRecording(path, window = 1000) as recording:
+        assert recording.record_count == recorder.records_written == len(snapshot)
+        numpy.testing.assert_array_equal(recording.captures, snapshot.captures)
+        numpy.testing.assert_array_equal(recording.timestamps, snapshot.timestamps)
+        numpy.testing.assert_array_equal(recording.integration_times, snapshot.integration_times)
+        # labelled by the sensor that recorded it
+        assert recording.calibration.sensor_id == spec_data.sensor_id
+        numpy.testing.assert_array_equal(recording.calibration.wavelengths, spec_data.wavelengths)
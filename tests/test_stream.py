@@ -0,0 +1,121 @@
+#
+#            SpectroPPG
+#   Written by Kevin Williams - 2024
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+
+
+import errno
+import socket
+import numpy
+import pytest
+from SpectroStream import StreamServer, StreamClient, FLAG_DROPPED
+from conftest import wait_for
+
+
+def read_frames(client: StreamClient, count: int) -> numpy.ndarray:
+    frames = list()
+    while(sum(len(f) for f in frames) < count):
+        frames.append(client.read())
+    return numpy.concatenate(frames)
+
+def drain(client: StreamClient):
+    """Every frame until the server closes the connection."""
+    while(True):
+        frames = client.read()
+        if(len(frames) == 0):
+            return
+        yield frames
+
+def flood(server: StreamServer, frames: int) -> None:
+    spectrum = numpy.linspace(0, 1, 135, dtype = numpy.float32)
+    for i in range(frames):
+        server.publish_spectrum(i, spectrum)
+
+
+def test_subscribers_receive_live_captures(spec_data_factory):
+    spec_data = spec_data_factory()
+    with StreamServer("127.0.0.1:0", spec_data) as server:
+        address = f"127.0.0.1:{server.address[1]}"
+        with StreamClient(address, timeout = 10) as everything, StreamClient(address, [67, 10], timeout = 10) as subset:
+            assert wait_for(lambda: len(server.subscribers) == 2)
+            assert (everything.channels, subset.channels, subset.num_points) == (135, 2, 135)
+            spec_data.capture_running = True
+            full, partial = read_frames(everything, 10), read_frames(subset, 10)
+            spec_data.capture_running = False
+    assert full['magic'][0] == b'SF' and everything.frames_missed == 0
+    assert numpy.all(numpy.diff(full['sequence'].astype(numpy.int64)) == 1)
+    # the frames carry the captures as SpectroData stored them
+    snapshot = spec_data.snapshot()
+    rows = numpy.searchsorted(snapshot.timestamps, full['timestamp_ns'])
+    numpy.testing.assert_array_equal(full['spectrum'], snapshot.captures[rows])
+    numpy.testing.assert_array_equal(full['integration_time'], snapshot.integration_times[rows])
+    rows = numpy.searchsorted(snapshot.timestamps, partial['timestamp_ns'])
+    numpy.testing.assert_array_equal(partial['spectrum'], snapshot.captures[rows][:, [67, 10]])
+
+
+def test_a_slow_subscriber_loses_its_oldest_frames():
+    with StreamServer("127.0.0.1:0", queue_size = 8) as server:
+        with StreamClient(f"127.0.0.1:{server.address[1]}", timeout = 10) as client:
+            assert wait_for(lambda: len(server.subscribers) == 1)
+            flood(server, 20000)
+            assert server.stats()[0]["frames_dropped"] > 0
+            server.close()
+            frames = numpy.concatenate(list(drain(client)))
+    assert client.frames_missed > 0
+    assert numpy.any(frames['flags'] & FLAG_DROPPED)
+    assert numpy.all(numpy.diff(frames['sequence'].astype(numpy.int64)) > 0)
+
+
+def test_a_slow_subscriber_with_the_disconnect_policy_is_dropped():
+    with StreamServer("127.0.0.1:0", queue_size = 8) as server:
+        with StreamClient(f"127.0.0.1:{server.address[1]}", policy = "disconnect", timeout = 10) as client:
+            assert wait_for(lambda: len(server.subscribers) == 1)
+            flood(server, 20000)
+            assert wait_for(lambda: server.subscribers == [])
+            received = sum(len(frames) for frames in drain(client))
+    # the connection ends instead of skipping frames, it may end before the sender got to run at all
+    assert received < 20000 and client.frames_missed == 0
+
+
+def test_requested_queue_sizes_are_capped():
+    with StreamServer("127.0.0.1:0", queue_size = 8, max_queue_size = 64) as server:
+        address = f"127.0.0.1:{server.address[1]}"
+        with StreamClient(address, queue_size = 1 << 30), StreamClient(address, queue_size = 16), StreamClient(address):
+            assert wait_for(lambda: len(server.subscribers) == 3)
+            assert sorted(subscriber._queue_size for subscriber in server.subscribers) == [8, 16, 64]
+
+
+def test_bad_requests_are_refused():
+    with StreamServer("127.0.0.1:0", num_points = 135) as server:
+        with pytest.raises(ConnectionError):
+            StreamClient(f"127.0.0.1:{server.address[1]}", [200], timeout = 10)
+        assert server.subscribers == []
+
+
+def test_unix_socket_left_behind_is_replaced(tmp_path):
+    path = str(tmp_path / "stream.sock")
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+    with StreamServer(f"unix:{path}") as server:
+        with pytest.raises(OSError) as error:
+            StreamServer(f"unix:{path}")
+        assert error.value.errno == errno.EADDRINUSE
+        with StreamClient(f"unix:{path}", timeout = 10) as client:
+            assert wait_for(lambda: len(server.subscribers) == 1)
+            server.publish_spectrum(1, numpy.ones(135))
+            assert client.read()['timestamp_ns'].tolist() == [1]